@@ -13,9 +13,21 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+# As a library, assemble() goes straight from source to bytes:
+#
+#  code, symbols = assemble(source)
+#  cpu.load_bytes(code)
+#
+# render_text() and render_image() turn the result into the .ls8 text
+# format and the binary image format that asm.py writes.
 
-import sys
+import contextlib
+import os
 import re
+import struct
+import sys
+from collections import deque
 
 # Opcodes
 OPCODES = {
@@ -57,18 +69,49 @@ OPCODES = {
 
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+REGEX = re.compile(r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?")
 
 # Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+REGEX_DATA = re.compile(r"(?:\w+?:)?\s*D[SB]\s*(.+)", re.IGNORECASE)
+
+# Opcode -> (type, machine code), for the tokenizer
+INSTRUCTIONS = {name: (info["type"], int(info["code"], 2))
+    for name, info in OPCODES.items()}
+
+# Operand -> register number
+REGISTERS = {f"R{n}": n for n in range(8)}
+
+# Operand count of each opcode type; type 8 is LDI r,i or LDI r,label
+OPERANDS = {0: 0, 1: 1, 2: 2, 8: 2}
+
+# Byte -> its line in the text format
+BITS = ["{:08b}".format(v) for v in range(256)]
+
+# Source lines between writes of the streaming text output
+FLUSH_LINES = 4096
+
+# Binary image header (see ls8/image.py): magic, version, entry, load
+# address, reserved, code length, symbol count
+IMAGE_HEADER = struct.Struct("<4sBBBBHH")
+IMAGE_MAGIC = b"LS8\x00"
+IMAGE_VERSION = 1
 
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-b] [-O] [inputfile] [outputfile]
+
+    -b writes a binary image instead of the text .ls8 format. -O runs the
+    peephole optimizer (see optimize.py) first.
     """
 
+    flags = set()
+    while len(argv) > 1 and argv[1] in ("-b", "-O"):
+        flags.add(argv[1])
+        argv = argv[:1] + argv[2:]
+
+    binary = "-b" in flags
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,321 +125,468 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-b] [-O] [infile.asm] [outfile.ls8]",
+            file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, binary, "-O" in flags
 
 
-def open_files(inputfile, outputfile):
+@contextlib.contextmanager
+def open_output(outputfile, binary=False):
     """
-    Open files for reading and writing. If either of the files are named "-",
-    stdin or stdout is returned as appropriate.
+    Open outputfile for writing, or stdout if it's "-", in binary mode if
+    binary is set. A file is written under a temporary name and renamed
+    into place when the with block finishes, so an error leaves no
+    half-written output behind.
     """
 
-    if inputfile == "-":
-        inputfile = sys.stdin
-    else:
-        inputfile = open(inputfile)
-
     if outputfile == "-":
-        outputfile = sys.stdout
-    else:
-        outputfile = open(outputfile, "w")
+        yield sys.stdout.buffer if binary else sys.stdout
+        return
 
-    return inputfile, outputfile
+    temporary = outputfile + ".tmp"
 
+    try:
+        with open(temporary, "wb" if binary else "w") as f:
+            yield f
 
-def normalize_line(groups):
-    """
-    Takes match groups and uppercases them if they're not None.
+        os.replace(temporary, outputfile)
+
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+class AsmError(Exception):
     """
+    An error in the source. status is the exit status asm.py reports it
+    with.
 
-    result = []
+    assemble() raises one AsmError for all the errors it found: errors is
+    the list of them, and the message has one per line.
+    """
 
-    for g in groups:
-        if g is None:
-            result.append(None)
-        else:
-            result.append(g.upper())
+    def __init__(self, message, status=1, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors if errors is not None else [self]
 
-    return result
 
+class Listing:
+    """
+    The comments of the text .ls8 format, collected by assemble() so
+    render_text() can reproduce it from the machine code.
+    """
 
-def p8(v):
-    return "{:08b}".format(v)
+    def __init__(self):
+        self.labels = deque()  # (address, name), in source order
+        self.comments = {}  # address -> comment on that byte
 
 
-def pass1(inputfile, sym, code):
+class Assembler:
     """
-    Pass 1
+    Single-pass assembler.
+
+    feed() takes source lines and appends their machine code to code as it
+    goes. An LDI of a label that isn't defined yet gets a placeholder byte
+    and an entry in fixups, and is patched as soon as the label turns up.
+    Errors are collected, a line at a time, and finish() raises them
+    together.
 
-    * Read the source code lines
-    * Parse labels, opcodes, and operands
-    * Record label offsets
-    * Emit machine code
+    If out (a text file) is given, the text .ls8 format is written to it as
+    the code becomes final: everything before the oldest byte still waiting
+    for a label. listing collects the comments either way.
     """
 
-    # Source line number
-    line_num = 0
+    def __init__(self, listing=None, out=None):
+        if listing is None and out is not None:
+            listing = Listing()
 
-    # Current code address (for labels)
-    addr = 0
+        self.listing = listing
+        self.out = out
+        self.code = bytearray()
+        self.symbols = {}
+        self.fixups = {}  # label -> [(offset, line number)] waiting for it
+        self.waiting = deque()  # offsets of fixups, oldest first
+        self.errors = []  # (line number, AsmError)
+        self.line_num = 0
+        self.written = 0  # bytes written to out
 
-    def get_reg(op, fatal=True):
-        """Get a register number from a string, e.g. "R2" -> 2"""
+    def error(self, line_num, message, status):
+        self.errors.append((line_num, AsmError(message, status)))
 
-        nonlocal line_num
+    def feed(self, lines):
+        """
+        Assemble lines, an iterable of source lines, after the ones fed
+        before.
+        """
 
-        m = re.match(r"R([0-7])", op)
+        code = self.code
+        listing = self.listing
+        comments = listing.comments if listing is not None else None
+        error = self.error
+        match = REGEX.match
+        instructions = INSTRUCTIONS
+        registers = REGISTERS
+        operands = OPERANDS
+        out = self.out
+        line_num = self.line_num
 
-        if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                    file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
+        for line in lines:
+            line_num += 1
 
-        return int(m.group(1))
+            if out is not None and line_num % FLUSH_LINES == 0:
+                self.flush()
 
-    def out0(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with zero operands"""
+            # Strip comments
+            comment_index = line.find(';')
+            if comment_index != -1:
+                line = line[:comment_index]
 
-        nonlocal addr
+            # Normalize
+            line = line.strip()
 
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
+            # Ignore blank lines
+            if not line:
+                continue
 
-    def out1(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with one operand"""
+            m = match(line)
 
-        nonlocal addr
+            if m is None:
+                error(line_num, f"No match: {line}", 3)
+                continue
 
-        reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+            label, opcode, op_a, op_b = m.groups()
 
-    def out2(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with two operands"""
+            # Track label address
+            if label is not None:
+                self.define(label.upper(), line_num)
 
-        nonlocal addr
+            if opcode is None:
+                continue
 
-        reg_a = get_reg(op_a)
-        reg_b = get_reg(op_b)
+            opcode = opcode.upper()
+            info = instructions.get(opcode)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+            if info is None:
+                if opcode == 'DS' or opcode == 'DB':
+                    self.data(opcode, line, line_num)
+                else:
+                    error(line_num, f"line {line_num}: unknown opcode {opcode}",
+                        2)
+                continue
 
-        addr += 3
+            op_type, machine_code = info
 
-    def out8(opcode, op_a, op_b, machine_code):
-        """Handle LDI opcode (type 8)"""
+            # Check operand count
+            found = (op_a is not None) + (op_b is not None)
+            desired = operands[op_type]
 
-        nonlocal addr
+            if found != desired:
+                which = "missing" if found < desired else "unexpected"
+                error(line_num, f"Line {line_num}: {which} operand to {opcode}",
+                    1)
+                continue
 
-        reg_a = get_reg(op_a)
+            if op_type == 0:
+                if comments is not None:
+                    comments[len(code)] = opcode
+                code.append(machine_code)
+                continue
 
-        try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            op_a = op_a.upper()
+            reg_a = registers.get(op_a)
 
-        except ValueError:
-            # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+            if reg_a is None:
+                error(line_num, f"Line {line_num}: unknown register {op_a}", 1)
+                continue
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
+            if op_type == 1:
+                if comments is not None:
+                    comments[len(code)] = f"{opcode} {op_a}"
+                code.append(machine_code)
+                code.append(reg_a)
+                continue
 
-        addr += 3
+            op_b = op_b.upper()
 
-    def handle_ds(line):
-        """
-        Handle DS pseudo-opcode
-        """
+            if op_type == 2:
+                reg_b = registers.get(op_b)
 
-        nonlocal addr
+                if reg_b is None:
+                    error(line_num, f"Line {line_num}: unknown register {op_b}",
+                        1)
+                    continue
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+                if comments is not None:
+                    comments[len(code)] = f"{opcode} {op_a},{op_b}"
+                code.append(machine_code)
+                code.append(reg_a)
+                code.append(reg_b)
+                continue
 
-        if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
+            # LDI: a value, or a label
+            try:
+                val_b = int(op_b, 0)
 
-        data = m.group(2)
+            except ValueError:
+                val_b = self.resolve(op_b, len(code) + 2, line_num)
 
-        for i in range(len(data)):
-            print_char = data[i]
+                if val_b is None:
+                    continue
 
-            if print_char == ' ':
-                print_char = '[space]'
+            else:
+                if val_b > 0xff:
+                    error(line_num, f"Line {line_num}: {op_b} doesn't fit in "
+                        "a byte", 2)
+                    continue
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
+            if comments is not None:
+                comments[len(code)] = f"{opcode} {op_a},{op_b}"
+            code.append(machine_code)
+            code.append(reg_a)
+            code.append(val_b)
 
-        addr += len(data)
+        self.line_num = line_num
 
-    def handle_db(line):
+    def define(self, name, line_num):
+        """Give label name the current address, and patch its fixups."""
+
+        address = len(self.code)
+
+        # The image's symbol table gives a name a length byte, in ASCII
+        if len(name) > 0xff or not name.isascii():
+            self.error(line_num, f"Line {line_num}: label {name[:16]}... "
+                "isn't an ASCII name of at most 255 characters", 2)
+            return
+
+        if name in self.symbols:
+            self.error(line_num, f"Line {line_num}: label {name} is already "
+                "defined", 2)
+            return
+
+        self.symbols[name] = address
+
+        if self.listing is not None:
+            self.listing.labels.append((address, name))
+
+        for offset, ref_line in self.fixups.pop(name, ()):
+            if address > 0xff:
+                self.error(ref_line, f"Line {ref_line}: {name} (address "
+                    f"{address}) doesn't fit in a byte", 2)
+            else:
+                self.code[offset] = address
+
+    def resolve(self, name, offset, line_num):
         """
-        Handle the DB pseudo-opcode
+        The address of label name for the byte at offset: now if it's
+        defined, else 0 until it is. None if it doesn't fit in a byte.
         """
 
-        nonlocal addr
+        address = self.symbols.get(name)
+
+        if address is None:
+            self.fixups.setdefault(name, []).append((offset, line_num))
+            self.waiting.append(offset)
+            return 0
+
+        if address > 0xff:
+            self.error(line_num, f"Line {line_num}: {name} (address "
+                f"{address}) doesn't fit in a byte", 2)
+            return None
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        return address
 
-        if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+    def data(self, opcode, line, line_num):
+        """Handle the DS and DB pseudo-opcodes"""
 
-        data = m.group(2)
+        m = REGEX_DATA.match(line)
+
+        if m is None:
+            self.error(line_num, f"line {line_num}: missing argument to "
+                f"{opcode}", 2)
+            return
+
+        data = m.group(1)
+        code = self.code
+        comments = self.listing.comments if self.listing is not None else None
+
+        if opcode == 'DS':
+            for char in data:
+                if comments is not None:
+                    comments[len(code)] = '[space]' if char == ' ' else char
+                code.append(ord(char) & 0xff)
+            return
 
         try:
             val = int(data, 0)
 
         except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                file=sys.stderr)
-            sys.exit(2)
+            self.error(line_num, f"line {line_num}: invalid integer argument "
+                "to DB", 2)
+            return
 
         # Force to byte size
-        val &= 0xff
-
-        code.append(f"{p8(val)} # {data}")
+        if comments is not None:
+            comments[len(code)] = data
+        code.append(val & 0xff)
 
-        addr += 1
+    def flush(self, final=False):
+        """
+        Write the code that's final to out. With final, that's all of it,
+        with any labels after the last byte.
+        """
 
-    def check_ops(opcode, op_a, op_b):
-        """Check operands for sanity with a particular opcode"""
+        waiting = self.waiting
+        pending = set()
 
-        def check_ops_count(desired, found):
-            # Makes sure we have right operand count
-            if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                    file=sys.stderr)
-                sys.exit(1)
-            elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                    file=sys.stderr)
-                sys.exit(1)
+        for offsets in self.fixups.values():
+            pending.update(offset for offset, line_num in offsets)
 
-        # Make sure we know this opcode at all
-        if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+        while waiting and waiting[0] not in pending:
+            waiting.popleft()
 
-        op_type = OPCODES[opcode]["type"]
+        end = waiting[0] if waiting else len(self.code)
 
-        total_operands = 0
+        if end > self.written or final:
+            self.out.write("".join(f"{line}\n" for line in text_lines(
+                self.code, self.listing, self.written, end, final)))
+            self.written = end
 
-        if op_a is not None:
-            total_operands += 1
+    def finish(self):
+        """
+        Check that every label used was defined, and write the rest of the
+        output. Raises AsmError for all the errors found, in line order.
+        """
 
-        if op_b is not None:
-            total_operands += 1
+        for name, offsets in self.fixups.items():
+            for offset, line_num in offsets:
+                self.error(line_num, f"Line {line_num}: unknown symbol: {name}",
+                    2)
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
-            check_ops_count(op_type, total_operands)
+        if self.errors:
+            self.errors.sort(key=lambda error: error[0])
+            errors = [error for line_num, error in self.errors]
+            raise AsmError("\n".join(str(error) for error in errors),
+                errors[0].status, errors)
 
-        elif op_type == 8:
-            # LDI r,i or LDI r,label
-            check_ops_count(2, total_operands)
+        if self.out is not None:
+            self.flush(final=True)
 
-    # Type to function mapping
-    type_f = {
-        0: out0,
-        1: out1,
-        2: out2,
-        8: out8,
-    }
 
-    for line in inputfile:
-        line_num += 1
+def assemble(source, listing=None):
+    """
+    Assemble source, a string or an iterable of lines (such as an open
+    file), and return (code, symbols): the machine code as bytes, ready for
+    CPU.load_bytes(), and a dict of label addresses. Raises AsmError for
+    the errors in the source, all of them at once.
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+    If listing (a Listing) is given, the comments of the text format are
+    collected in it for render_text().
+    """
 
-        # Normalize
-        line = line.strip()
+    if isinstance(source, str):
+        source = source.splitlines()
 
-        # Ignore blank lines
-        if input == '':
-            continue
+    assembler = Assembler(listing)
+    assembler.feed(source)
+    assembler.finish()
 
-        # print(line)  # debug
+    return bytes(assembler.code), assembler.symbols
 
-        m = re.match(REGEX, line)
 
-        if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+def text_lines(code, listing, start, end, final=True):
+    """
+    The lines of the text .ls8 format for code[start:end], taking the
+    labels and comments they use off listing. With final, the labels after
+    the last byte come too.
+    """
 
-            # print(label, opcode, op_a, op_b)  # debug
+    labels = listing.labels
+    comments = listing.comments
 
-            # Track label address
-            if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
-
-            if opcode is not None:
-                if opcode == 'DS':
-                    handle_ds(line)
-                elif opcode == 'DB':
-                    handle_db(line)
-                else:
-                    # Check operand count
-                    check_ops(opcode, op_a, op_b)
+    for address in range(start, end):
+        # Labels go on their own line, before the byte they point at
+        while labels and labels[0][0] == address:
+            yield f"# {labels.popleft()[1]} (address {address}):"
 
-                    # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+        comment = comments.pop(address, None)
+        if comment is None:
+            yield BITS[code[address]]
         else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+            yield f"{BITS[code[address]]} # {comment}"
 
+    if final:
+        while labels:
+            address, name = labels.popleft()
+            yield f"# {name} (address {address}):"
 
-def pass2(outputfile, sym, code):
+
+def render_text(code, listing=None):
     """
-    Output the code, substituting in any symbols.
+    The text .ls8 form of assembled code: a line per byte in binary, with
+    the comments in listing.
     """
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    copy = Listing()
 
-            if s in sym:
-                c = p8(sym[s])
+    if listing is not None:
+        copy.labels.extend(sorted(listing.labels, key=lambda label: label[0]))
+        copy.comments.update(listing.comments)
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+    return "".join(f"{line}\n" for line in text_lines(code, copy, 0,
+        len(code)))
 
-        outputfile.write(f"{c}\n")
+
+def render_image(code, sym):
+    """
+    The binary image form of assembled code, with the labels as its symbol
+    table.
+    """
+
+    symbols = bytearray()
+
+    for name, address in sym.items():
+        encoded = name.encode('ascii')
+        symbols += bytes((address, len(encoded))) + encoded
+
+    header = IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, 0, 0,
+        len(code), len(sym))
+
+    return header + bytes(symbols) + bytes(code)
 
 
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, binary, optimizing = parse_commandline(argv)
 
-    # Open files
-    inputfile, outputfile = open_files(inputfile, outputfile)
+    try:
+        source = sys.stdin if inputfile == "-" else open(inputfile)
 
-    # Set up the symbol table
-    sym = {}
+        with source, open_output(outputfile, binary) as out:
+            if optimizing:
+                import optimize
 
-    # Set up the machine code output
-    code = []
+                source, report = optimize.optimize(source)
+                print(report, file=sys.stderr)
 
-    # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+            if binary:
+                # The symbol table comes before the code, so this waits
+                # for the end
+                code, sym = assemble(source)
+                out.write(render_image(code, sym))
+
+            else:
+                # Stream the text format out as it's assembled
+                assembler = Assembler(out=out)
+                assembler.feed(source)
+                assembler.finish()
+
+    except AsmError as e:
+        print(e, file=sys.stderr)
+        return e.status
 
     return 0
 
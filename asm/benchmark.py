@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# Assembler throughput, in source lines per second.
+#
+# Usage: benchmark.py [lines...] [--trials N]
+#
+# Generates sources of the given numbers of lines (default 10000, 100000
+# and 300000) like a code generator would write them: a block of labels
+# used before they are defined, then instructions of every type, LDIs of
+# those labels, DS and DB data, comments and blank lines. Each is assembled
+# by the two-pass core in reference.py and by asm.py's single-pass core,
+# to bytes (assemble()) and to the text .ls8 format (what asm.py writes),
+# and both must give the same result. The best of the trials is reported,
+# along with the peak memory of making the text format.
+
+import io
+import random
+import sys
+import time
+import tracemalloc
+
+import asm
+import reference
+
+LINES = [10000, 100000, 300000]
+
+# Labels the generated code refers to; all of them land below address 256
+LABELS = 16
+
+
+def generate(count, seed=0):
+    """A source of count lines, the same for the same seed."""
+
+    rng = random.Random(seed)
+    lines = ["; generated"]
+
+    # Forward references, resolved by the labels just after
+    for n in range(LABELS):
+        lines.append(f"LDI R{n % 5},L{n}")
+
+    for n in range(LABELS):
+        lines.append(f"L{n}: INC R{n % 5}")
+
+    registers = [f"R{n}" for n in range(5)]
+    two = [name for name, info in asm.OPCODES.items() if info["type"] == 2]
+    one = [name for name, info in asm.OPCODES.items() if info["type"] == 1]
+
+    while len(lines) < count:
+        kind = rng.random()
+
+        if kind < 0.35:
+            lines.append(f"{rng.choice(two)} {rng.choice(registers)},"
+                f"{rng.choice(registers)}")
+        elif kind < 0.55:
+            lines.append(f"{rng.choice(one)} {rng.choice(registers)}  "
+                "; one operand")
+        elif kind < 0.7:
+            lines.append(f"LDI {rng.choice(registers)},{rng.randrange(256)}")
+        elif kind < 0.8:
+            lines.append(f"LDI {rng.choice(registers)},L{rng.randrange(LABELS)}")
+        elif kind < 0.85:
+            lines.append(rng.choice(["DS Hello, world", "DB 0x0a", "DB 12"]))
+        elif kind < 0.92:
+            lines.append("; a comment line")
+        elif kind < 0.96:
+            lines.append("")
+        else:
+            lines.append(rng.choice(["HLT", "RET", "NOP"]))
+
+    return lines
+
+
+def old_text(lines):
+    listing = asm.Listing()
+    code, sym = reference.assemble(lines, listing)
+    return asm.render_text(code, listing)
+
+
+def new_text(lines):
+    out = io.StringIO()
+    assembler = asm.Assembler(out=out)
+    assembler.feed(lines)
+    assembler.finish()
+    return out.getvalue()
+
+
+# name -> (reference version, single-pass version)
+TASKS = {
+    "bytes": (reference.assemble, asm.assemble),
+    "text": (old_text, new_text),
+}
+
+
+def best(function, lines, trials):
+    """The fastest of trials runs, in seconds, and the last result."""
+
+    fastest = None
+
+    for _ in range(trials):
+        began = time.perf_counter()
+        result = function(lines)
+        elapsed = time.perf_counter() - began
+
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+
+    return fastest, result
+
+
+def peak(function, lines):
+    """Peak bytes allocated by one run."""
+
+    tracemalloc.start()
+
+    try:
+        function(lines)
+        return tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv):
+    trials = 3
+    counts = []
+    args = argv[1:]
+
+    while args:
+        arg = args.pop(0)
+
+        if arg == "--trials":
+            trials = int(args.pop(0))
+        else:
+            counts.append(int(arg))
+
+    print(f"{'lines':>8} {'output':6} {'two-pass':>14} {'single-pass':>14} "
+        f"{'speedup':>8} {'peak KiB':>18}")
+
+    for count in counts or LINES:
+        lines = generate(count)
+
+        for name, (old, new) in TASKS.items():
+            old_time, old_result = best(old, lines, trials)
+            new_time, new_result = best(new, lines, trials)
+
+            if old_result != new_result:
+                print(f"{count} lines: the {name} output differs",
+                    file=sys.stderr)
+                return 1
+
+            memory = ""
+            if name == "text":
+                memory = (f"{peak(old, lines) / 1024:8.0f} "
+                    f"{peak(new, lines) / 1024:8.0f}")
+
+            print(f"{count:8} {name:6} {count / old_time:9.0f} l/s "
+                f"{count / new_time:9.0f} l/s {old_time / new_time:7.2f}x "
+                f"{memory:>18}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Build driver: assembles every .asm source into ls8/examples.
+#
+# Usage: build.py [-j JOBS] [--force] [--out DIR] [source.asm...]
+#
+# All the sources are assembled in this one process, or across a pool of
+# JOBS processes with -j. A manifest in the output directory records, for
+# each source, the hash of its contents, the version of the assembler
+# (a hash of asm.py) and the hash of the output written; a source whose
+# hashes all still match is skipped, so rebuilding an unchanged tree only
+# reads and hashes files. --force rebuilds everything.
+#
+# Outputs are written under a temporary name and renamed into place. An
+# existing output that holds the same machine code with comments of its
+# own (print8.ls8) is left as it is.
+#
+# Prints the time each file took and the cache hit rate. The exit status
+# is 1 if any source had errors.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(os.path.dirname(HERE), "ls8", "examples")
+
+MANIFEST = ".asm-manifest.json"
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def assembler_version():
+    """A hash of asm.py, so a change to the assembler rebuilds everything."""
+
+    with open(asm.__file__, "rb") as f:
+        return digest(f.read())
+
+
+def read_bytes(path):
+    """The contents of path, or None if it doesn't exist."""
+
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+
+    except FileNotFoundError:
+        return None
+
+
+def machine_code(text):
+    """The bytes a text .ls8 file holds, ignoring comments and blank lines."""
+
+    code = bytearray()
+
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+
+        if line:
+            code.append(int(line, 2))
+
+    return bytes(code)
+
+
+def same_code(written, text):
+    """
+    Whether the existing output written holds the machine code of text.
+    Anything that isn't a text .ls8 file doesn't.
+    """
+
+    try:
+        return machine_code(written.decode()) == machine_code(text)
+
+    except (ValueError, UnicodeDecodeError):
+        return False
+
+
+def assemble_file(path):
+    """
+    Assemble the source at path. Returns (text, error, seconds): the text
+    .ls8 output, or None and the AsmError's message.
+    """
+
+    began = time.perf_counter()
+
+    with open(path) as f:
+        source = f.read()
+
+    try:
+        listing = asm.Listing()
+        code, sym = asm.assemble(source, listing)
+        text, error = asm.render_text(code, listing), None
+
+    except asm.AsmError as e:
+        text, error = None, str(e)
+
+    return text, error, time.perf_counter() - began
+
+
+def write_atomic(path, data):
+    with asm.open_output(path, binary=True) as f:
+        f.write(data)
+
+
+def load_manifest(path, version):
+    """The manifest's entries, or none if it's for another assembler."""
+
+    data = read_bytes(path)
+
+    if data is None:
+        return {}
+
+    try:
+        manifest = json.loads(data)
+
+    except ValueError:
+        return {}
+
+    if manifest.get("assembler") != version:
+        return {}
+
+    return manifest.get("files", {})
+
+
+def build(sources, out, jobs=1, force=False):
+    """
+    Bring the outputs of sources up to date in the directory out. Returns
+    a list of (source, status, seconds, error), status being 'cached',
+    'built', 'kept' or 'error'.
+    """
+
+    version = assembler_version()
+    manifest_path = os.path.join(out, MANIFEST)
+    entries = {} if force else load_manifest(manifest_path, version)
+
+    results = {}
+    stale = []
+    hashes = {}
+
+    for source in sources:
+        began = time.perf_counter()
+        name = os.path.basename(source)
+        output = os.path.join(out, os.path.splitext(name)[0] + ".ls8")
+        hashes[source] = digest(read_bytes(source))
+        entry = entries.get(name)
+        written = read_bytes(output)
+
+        if (entry is not None and entry["source"] == hashes[source]
+                and written is not None and entry["output"] == digest(written)):
+            results[source] = ("cached", time.perf_counter() - began, None)
+        else:
+            stale.append((source, output, written))
+
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            built = list(pool.map(assemble_file,
+                [source for source, output, written in stale]))
+    else:
+        built = [assemble_file(source) for source, output, written in stale]
+
+    for (source, output, written), (text, error, seconds) in zip(stale, built):
+        name = os.path.basename(source)
+
+        if error is not None:
+            entries.pop(name, None)
+            results[source] = ("error", seconds, error)
+            continue
+
+        data = text.encode()
+
+        if written is not None and written != data and \
+                same_code(written, text):
+            # Same code, with comments written by hand
+            data = written
+            status = "kept"
+        else:
+            if written != data:
+                write_atomic(output, data)
+            status = "built"
+
+        entries[name] = {"source": hashes[source], "output": digest(data)}
+        results[source] = (status, seconds, None)
+
+    manifest = json.dumps({"assembler": version, "files": entries}, indent=1,
+        sort_keys=True).encode()
+
+    if manifest != read_bytes(manifest_path):
+        write_atomic(manifest_path, manifest)
+
+    return [(source,) + results[source] for source in sources]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="build.py",
+        description="Assemble .asm sources into ls8/examples.")
+    parser.add_argument("sources", nargs="*",
+        help="sources to build (default: the .asm files next to build.py)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="processes to assemble in")
+    parser.add_argument("--force", action="store_true",
+        help="ignore the manifest and rebuild everything")
+    parser.add_argument("--out", default=EXAMPLES,
+        help="output directory (default: ls8/examples)")
+    args = parser.parse_args(argv[1:])
+
+    began = time.perf_counter()
+    sources = args.sources or sorted(glob.glob(os.path.join(HERE, "*.asm")))
+    results = build(sources, args.out, args.jobs, args.force)
+    elapsed = time.perf_counter() - began
+
+    for source, status, seconds, error in results:
+        print(f"{os.path.basename(source):24} {status:6} "
+            f"{seconds * 1e3:8.2f} ms")
+
+        if error is not None:
+            for line in error.splitlines():
+                print(f"    {line}")
+
+    hits = sum(status == "cached" for source, status, seconds, error in results)
+    rate = hits / len(results) if results else 1.0
+    print(f"{len(results)} files, {hits} cached ({rate:.0%}), "
+        f"{elapsed * 1e3:.1f} ms")
+
+    return 1 if any(status == "error" for source, status, seconds, error
+        in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,33 @@
+; Fibonacci numbers
+;
+; Steps a = 0, b = 1 to a, b = b, a + b a hundred times, which leaves
+; fib(100) mod 256 in a, and does that 200 times over. Then prints it.
+;
+; Expected output: 195
+
+	LDI R7,200           ; repetitions
+	LDI R4,0             ; for CMP
+
+Repeat:
+	LDI R0,0             ; a
+	LDI R1,1             ; b
+	LDI R2,100           ; steps
+
+Step:
+	ADD R0,R1            ; a = a + b
+	PUSH R0              ; swap a and b
+	PUSH R1
+	POP R0
+	POP R1
+	DEC R2
+	CMP R2,R4
+	LDI R3,Step
+	JNE R3
+
+	DEC R7
+	CMP R7,R4
+	LDI R3,Repeat
+	JNE R3
+
+	PRN R0
+	HLT
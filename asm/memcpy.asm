@@ -0,0 +1,67 @@
+; Memory copy
+;
+; Fills 48 bytes at 0x90 with 0, 1, 2..., copies them to 0xC0 and back
+; again, 200 times over. Then prints the sum of the bytes at 0xC0, mod 256.
+;
+; Expected output: 104
+
+	LDI R0,0x90
+	LDI R1,0
+	LDI R2,0xC0
+
+Fill:
+	ST R0,R1
+	INC R0
+	INC R1
+	CMP R0,R2
+	LDI R3,Fill
+	JNE R3
+
+	LDI R7,200           ; repetitions
+
+Repeat:
+	LDI R0,0x90          ; source
+	LDI R1,0xC0          ; destination
+	LDI R4,0xC0          ; end of the source
+	LDI R3,Copy
+	CALL R3
+	LDI R0,0xC0
+	LDI R1,0x90
+	LDI R4,0xF0
+	LDI R3,Copy
+	CALL R3
+
+	DEC R7
+	LDI R0,0
+	CMP R7,R0
+	LDI R3,Repeat
+	JNE R3
+
+	LDI R0,0xC0
+	LDI R1,0             ; sum
+	LDI R4,0xF0
+
+Sum:
+	LD R2,R0
+	ADD R1,R2
+	INC R0
+	CMP R0,R4
+	LDI R3,Sum
+	JNE R3
+	PRN R1
+	HLT
+
+; Subroutine: Copy
+; R0 the source, R1 the destination, R4 the end of the source
+
+Copy:
+	LDI R3,CopyLoop
+
+CopyLoop:
+	LD R2,R0
+	ST R1,R2
+	INC R0
+	INC R1
+	CMP R0,R4
+	JNE R3
+	RET
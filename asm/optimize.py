@@ -0,0 +1,456 @@
+# Peephole optimizer for LS-8 assembly, run by asm.py -O.
+#
+# optimize() takes the source lines and returns them rewritten to run
+# fewer instructions, a line for a line, so the assembler then lays the
+# code out again and every label gets its new address. The rewrites:
+#
+#  * redundant LDI: loading a register with the value it's known to hold
+#  * strength reduction: MUL by a power of two becomes SHL (or ADD Rn,Rn
+#    for 2), and MUL by 1 goes
+#  * identities: ADD, SUB, OR, XOR, SHL and SHR of 0 and AND of 0xFF go
+#  * jump threading: LDI Rn,L1 / JMP Rn, where L1 is itself LDI Rn,L2 /
+#    JMP Rn, jumps straight to L2
+#  * a jump to the very next instruction goes
+#  * unreachable code: instructions after HLT, JMP, RET or IRET up to the
+#    next label that's used
+#
+# Register values are tracked from one instruction to the next. Any
+# label an LDI uses is somewhere code may be entered with unknown values,
+# and so is the instruction after a CALL or an INT; a label nothing uses
+# is not. That assumes code addresses only ever come from labels, which
+# is how the assembler is meant to be used. R6, which the interrupt
+# controller writes (IS), is never tracked.
+#
+# Each pass is checked: the program is assembled and run on the emulator
+# (../ls8) before and after, and a pass whose output, halting or faults
+# differ is thrown away. The report says what was rewritten and how many
+# instructions the run saved.
+
+import copy
+import os
+import sys
+from collections import Counter
+
+import asm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "ls8"))
+
+from alu import BINARY, UNARY
+from cpu import CPU, CPUFault
+from devices import CaptureOutput
+
+# Instructions run on the emulator to check each pass
+MAX_CYCLES = 1000000
+
+# Control never falls through these
+UNCONDITIONAL = {"HLT", "JMP", "RET", "IRET"}
+
+# The instruction after these is entered with unknown register values
+ENTERED = UNCONDITIONAL | {"CALL", "INT"}
+
+JUMPS = {"JMP", "JEQ", "JNE", "JGT", "JGE", "JLT", "JLE"}
+
+# Register operand b that leaves a unchanged
+IDENTITIES = {"ADD": 0, "SUB": 0, "OR": 0, "XOR": 0, "SHL": 0, "SHR": 0,
+    "AND": 0xFF}
+
+# The interrupt status register, written behind the program's back
+IS = 6
+
+
+class Statement:
+    """
+    A source line with an instruction or a label (or both), as the
+    optimizer sees it. a is the register of operand a; b is the register
+    of operand b, or for LDI the value: a number or a label name. changed
+    is set once the line has to be written out again.
+    """
+
+    def __init__(self, index, label, opcode, a=None, b=None):
+        self.index = index  # line number, from 0
+        self.label = label
+        self.opcode = opcode  # None for a bare label, "DATA" for DS and DB
+        self.a = a
+        self.b = b
+        self.changed = False
+
+    def remove(self):
+        self.opcode = None
+        self.changed = True
+
+    def render(self):
+        label = f"{self.label}: " if self.label is not None else ""
+
+        if self.opcode is None:
+            return label.rstrip()
+
+        operands = ""
+        if self.a is not None:
+            operands = f" R{self.a}"
+        if self.b is not None:
+            b = self.b if self.opcode == "LDI" else f"R{self.b}"
+            operands += f",{b}"
+
+        return f"{label}{self.opcode}{operands}"
+
+
+def parse(lines):
+    """
+    The statements in lines, or None if the assembler would reject any of
+    them.
+    """
+
+    statements = []
+
+    for index, line in enumerate(lines):
+        line = line.split(";", 1)[0].strip()
+
+        if not line:
+            continue
+
+        label, opcode, op_a, op_b = asm.REGEX.match(line).groups()
+
+        if label is not None:
+            label = label.upper()
+
+        if opcode is None:
+            if label is not None:
+                statements.append(Statement(index, label, None))
+            continue
+
+        opcode = opcode.upper()
+
+        if opcode in ("DS", "DB"):
+            statements.append(Statement(index, label, "DATA"))
+            continue
+
+        info = asm.INSTRUCTIONS.get(opcode)
+        operands = [op.upper() for op in (op_a, op_b) if op is not None]
+
+        if info is None or len(operands) != asm.OPERANDS[info[0]]:
+            return None
+
+        registers = [asm.REGISTERS.get(op) for op in operands]
+        if info[0] == 8:
+            try:
+                registers[1] = int(operands[1], 0)
+            except ValueError:
+                registers[1] = operands[1]
+
+        if None in registers:
+            return None
+
+        statements.append(Statement(index, label, opcode, *registers))
+
+    return statements
+
+
+def render(lines, statements):
+    """lines, with the changed statements written in."""
+
+    lines = list(lines)
+
+    for statement in statements:
+        if statement.changed:
+            lines[statement.index] = statement.render()
+
+    return lines
+
+
+def referenced(statements):
+    """The labels some LDI loads."""
+
+    return {s.b for s in statements if s.opcode == "LDI"
+        and isinstance(s.b, str)}
+
+
+def instructions(statements):
+    """The positions in statements of instructions and data, in order."""
+
+    return [i for i, s in enumerate(statements) if s.opcode is not None]
+
+
+def targets(statements):
+    """Label -> position of the instruction or data it points at."""
+
+    found = {}
+    waiting = []
+
+    for i, s in enumerate(statements):
+        if s.label is not None:
+            waiting.append(s.label)
+
+        if s.opcode is not None:
+            for label in waiting:
+                found[label] = i
+            waiting = []
+
+    return found
+
+
+def thread_jumps(statements, counts):
+    """Jump threading, and jumps to the next instruction."""
+
+    code = instructions(statements)
+    following = dict(zip(code, code[1:]))
+    preceding = dict(zip(code[1:], code))
+    at = targets(statements)
+    used = referenced(statements)
+    rewrites = 0
+
+    def load_and_jump(i):
+        # The label of LDI Rn,label / JMP Rn at position i, and n
+        s = statements[i]
+        j = following.get(i)
+
+        if (s.opcode == "LDI" and isinstance(s.b, str) and j is not None
+                and statements[j].opcode == "JMP" and statements[j].a == s.a):
+            return s.b, s.a
+
+        return None, None
+
+    for i in code:
+        label, register = load_and_jump(i)
+
+        if label is None:
+            continue
+
+        seen = {label}
+
+        while label in at:
+            hop, hop_register = load_and_jump(at[label])
+
+            if hop is None or hop_register != register or hop in seen:
+                break
+
+            label = hop
+            seen.add(label)
+
+        if label != statements[i].b:
+            statements[i].b = label
+            statements[i].changed = True
+            counts["jump threaded"] += 1
+            rewrites += 1
+
+    for i in code:
+        s = statements[i]
+        load = preceding.get(i)
+
+        if s.opcode not in JUMPS or load is None or i not in following:
+            continue
+
+        loaded = statements[load]
+
+        if (loaded.opcode != "LDI" or loaded.a != s.a
+                or at.get(loaded.b) != following[i]):
+            continue
+
+        # Nothing may jump in between with another address in the register
+        if any(statements[k].label in used for k in range(load + 1, i + 1)):
+            continue
+
+        s.remove()
+        counts["jump to the next instruction"] += 1
+        rewrites += 1
+
+    return rewrites
+
+
+def remove_unreachable(statements, counts):
+    """Instructions after an unconditional jump, up to a label in use."""
+
+    used = referenced(statements)
+    reachable = True
+    rewrites = 0
+
+    for s in statements:
+        if s.label in used or s.opcode == "DATA":
+            reachable = True
+
+        elif s.opcode is not None and not reachable:
+            s.remove()
+            counts["unreachable"] += 1
+            rewrites += 1
+            continue
+
+        if s.opcode in UNCONDITIONAL:
+            reachable = False
+
+    return rewrites
+
+
+def fold_constants(statements, counts):
+    """
+    Track the values loaded into registers, dropping the LDIs and ALU
+    instructions that change nothing and reducing MUL by powers of two.
+    """
+
+    used = referenced(statements)
+    known = [None] * 8
+    rewrites = 0
+
+    for s in statements:
+        if s.label in used or s.opcode == "DATA":
+            known = [None] * 8
+
+        op = s.opcode
+
+        if op == "LDI":
+            if s.a != IS and known[s.a] == s.b:
+                s.remove()
+                counts["redundant LDI"] += 1
+                rewrites += 1
+            else:
+                known[s.a] = s.b if s.a != IS else None
+
+        elif op in BINARY and op != "CMP":
+            value = known[s.b]
+
+            if op == "MUL" and isinstance(value, int) and value \
+                    and value & (value - 1) == 0:
+                shift = value.bit_length() - 1
+
+                if shift == 0:
+                    s.remove()
+                    counts["MUL by 1"] += 1
+                    rewrites += 1
+                elif shift in known:
+                    s.opcode, s.b = "SHL", known.index(shift)
+                    s.changed = True
+                    counts["MUL to SHL"] += 1
+                    rewrites += 1
+                elif shift == 1:
+                    s.opcode, s.b = "ADD", s.a
+                    s.changed = True
+                    counts["MUL to ADD"] += 1
+                    rewrites += 1
+
+            elif op in IDENTITIES and IDENTITIES[op] == value:
+                s.remove()
+                counts["identity"] += 1
+                rewrites += 1
+
+            a, b = known[s.a], value
+            if isinstance(a, int) and isinstance(b, int) and (
+                    b or op not in ("DIV", "MOD")):
+                known[s.a] = BINARY[op](a, b)
+            else:
+                known[s.a] = None
+
+        elif op in UNARY:
+            a = known[s.a]
+            known[s.a] = UNARY[op](a) if isinstance(a, int) else None
+
+        elif op in ("LD", "POP"):
+            known[s.a] = None
+
+        known[IS] = None
+
+        if op in ENTERED:
+            known = [None] * 8
+
+    return rewrites
+
+
+# In the order they're tried
+PASSES = [thread_jumps, remove_unreachable, fold_constants]
+
+
+class Run:
+    """What a program did on the emulator."""
+
+    def __init__(self, lines, max_cycles):
+        code, sym = asm.assemble(lines)
+        cpu = CPU(output=CaptureOutput())
+        cpu.load_bytes(code)
+        self.fault = None
+
+        try:
+            cpu.run(max_cycles)
+
+        except CPUFault as fault:
+            self.fault = type(fault).__name__
+
+        self.output = cpu.output.getvalue()
+        self.halted = cpu.halted
+        self.cycles = cpu.cycles
+
+    def agrees(self, other):
+        """Whether other, the same program optimized, did the same."""
+
+        if self.halted or self.fault:
+            return (other.output, other.halted, other.fault) == \
+                (self.output, self.halted, self.fault)
+
+        # Cut off: the faster one may have got further
+        return other.output.startswith(self.output)
+
+
+def optimize(lines, max_cycles=MAX_CYCLES):
+    """
+    Optimize the source in lines. Returns the new lines and a report of
+    what changed.
+    """
+
+    lines = list(lines)
+    statements = parse(lines)
+
+    try:
+        if statements is None:
+            raise asm.AsmError("the source has errors")
+
+        original = Run(lines, max_cycles)
+
+    except (asm.AsmError, ValueError) as e:
+        return lines, f"not optimized: {e}"
+
+    counts = Counter()
+    rejected = []
+    latest = original
+    progress = True
+
+    while progress:
+        progress = False
+
+        for rewrite in PASSES:
+            if rewrite.__name__ in rejected:
+                continue
+
+            trial = copy.deepcopy(statements)
+            found = Counter()
+
+            if not rewrite(trial, found):
+                continue
+
+            result = Run(render(lines, trial), max_cycles)
+
+            if original.agrees(result):
+                statements = trial
+                counts += found
+                latest = result
+                progress = True
+            else:
+                rejected.append(rewrite.__name__)
+
+    report = [", ".join(f"{count} {kind}" for kind, count in
+        sorted(counts.items())) or "nothing to optimize"]
+
+    for name in rejected:
+        report.append(f"{name} rejected: the program no longer does the same")
+
+    if original.halted or original.fault:
+        saved = original.cycles - latest.cycles
+        share = saved / original.cycles if original.cycles else 0.0
+
+        if original.fault:
+            report.append(f"stops with {original.fault} after "
+                f"{original.cycles} instructions")
+
+        report.append(f"{original.cycles} -> {latest.cycles} instructions run, "
+            f"{saved} saved ({share:.1%})")
+    else:
+        report.append(f"doesn't halt within {max_cycles} instructions; "
+            "output checked up to there")
+
+    return render(lines, statements), "\n".join(report)
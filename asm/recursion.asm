@@ -0,0 +1,78 @@
+; Recursion
+;
+; Computes fib(12) with the doubly recursive definition (465 calls, 12
+; deep) and 1 + 2 + ... + 50 with a recursive sum (50 deep), 20 times
+; over. Then prints both.
+;
+; Expected output:
+; 144
+; 251
+
+	LDI R4,20            ; repetitions
+
+Repeat:
+	LDI R0,12
+	LDI R3,Fib
+	CALL R3
+	LDI R7,0
+	ADD R7,R1            ; keep fib(12)
+	LDI R0,50
+	LDI R3,Sum
+	CALL R3
+	DEC R4
+	LDI R0,0
+	CMP R4,R0
+	LDI R3,Repeat
+	JNE R3
+
+	PRN R7
+	PRN R1
+	HLT
+
+; Subroutine: Fib
+; R0 n, returns fib(n) in R1. Keeps R0 and R4.
+
+Fib:
+	LDI R2,2
+	CMP R0,R2
+	LDI R3,FibMore
+	JGE R3
+	LDI R1,0
+	ADD R1,R0            ; fib(0) = 0, fib(1) = 1
+	RET
+
+FibMore:
+	DEC R0
+	PUSH R0
+	LDI R3,Fib
+	CALL R3              ; fib(n - 1)
+	POP R0
+	PUSH R1
+	DEC R0
+	LDI R3,Fib
+	CALL R3              ; fib(n - 2)
+	POP R2
+	ADD R1,R2
+	INC R0
+	INC R0
+	RET
+
+; Subroutine: Sum
+; R0 n, returns 1 + 2 + ... + n, mod 256, in R1. Keeps R0 and R4.
+
+Sum:
+	LDI R2,0
+	CMP R0,R2
+	LDI R3,SumMore
+	JNE R3
+	LDI R1,0
+	RET
+
+SumMore:
+	PUSH R0
+	DEC R0
+	LDI R3,Sum
+	CALL R3
+	POP R0
+	ADD R1,R0
+	RET
@@ -0,0 +1,273 @@
+# The two-pass assembler core that asm.py used before its single-pass
+# rewrite, kept as a reference: benchmark.py checks that both produce the
+# same machine code and compares their speed.
+#
+# It matches each line against uncompiled patterns, looks registers up with
+# a regex per operand, and stops at the first error.
+
+import re
+
+from asm import OPCODES, AsmError, Listing
+
+# Regex for matching lines
+# Capturing groups: label, opcode, operandA, operandB
+REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+
+# Regex for capturing DS and DB data
+REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
+REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+
+
+def normalize_line(groups):
+    """
+    Takes match groups and uppercases them if they're not None.
+    """
+
+    result = []
+
+    for g in groups:
+        if g is None:
+            result.append(None)
+        else:
+            result.append(g.upper())
+
+    return result
+
+
+
+def pass1(lines, sym, code, fixups, listing=None):
+    """
+    Pass 1
+
+    * Read the source code lines
+    * Parse labels, opcodes, and operands
+    * Record label offsets
+    * Emit machine code into the bytearray code, with a 0 for each label
+      operand and its (offset, label, line number) in fixups
+    """
+
+    if listing is None:
+        listing = Listing()
+
+    # Source line number
+    line_num = 0
+
+    def get_reg(op):
+        """Get a register number from a string, e.g. "R2" -> 2"""
+
+        m = re.match(r"R([0-7])", op)
+
+        if m is None:
+            raise AsmError(f"Line {line_num}: unknown register {op}", 1)
+
+        return int(m.group(1))
+
+    def emit(byte, comment=None):
+        if comment is not None:
+            listing.comments[len(code)] = comment
+        code.append(byte)
+
+    def out0(opcode, op_a, op_b, machine_code):
+        """Handle opcodes with zero operands"""
+
+        emit(machine_code, opcode)
+
+    def out1(opcode, op_a, op_b, machine_code):
+        """Handle opcodes with one operand"""
+
+        reg_a = get_reg(op_a)
+        emit(machine_code, f"{opcode} {op_a}")
+        emit(reg_a)
+
+    def out2(opcode, op_a, op_b, machine_code):
+        """Handle opcodes with two operands"""
+
+        reg_a = get_reg(op_a)
+        reg_b = get_reg(op_b)
+
+        emit(machine_code, f"{opcode} {op_a},{op_b}")
+        emit(reg_a)
+        emit(reg_b)
+
+    def out8(opcode, op_a, op_b, machine_code):
+        """Handle LDI opcode (type 8)"""
+
+        reg_a = get_reg(op_a)
+
+        try:
+            val_b = int(op_b, 0)
+
+        except ValueError:
+            # If it's not a value, it might be a symbol
+            val_b = None
+
+        else:
+            if val_b > 0xff:
+                raise AsmError(f"Line {line_num}: {op_b} doesn't fit in a "
+                    "byte", 2)
+
+        emit(machine_code, f"{opcode} {op_a},{op_b}")
+        emit(reg_a)
+
+        if val_b is None:
+            fixups.append((len(code), op_b, line_num))
+            val_b = 0
+
+        emit(val_b)
+
+    def handle_ds(line):
+        """
+        Handle DS pseudo-opcode
+        """
+
+        m = re.match(REGEX_DS, line, re.IGNORECASE)
+
+        if m is None or m.group(2) is None:
+            raise AsmError(f"line {line_num}: missing argument to DS", 2)
+
+        data = m.group(2)
+
+        for char in data:
+            emit(ord(char) & 0xff, '[space]' if char == ' ' else char)
+
+    def handle_db(line):
+        """
+        Handle the DB pseudo-opcode
+        """
+
+        m = re.match(REGEX_DB, line, re.IGNORECASE)
+
+        if m is None or m.group(2) is None:
+            raise AsmError(f"line {line_num}: missing argument to DB", 2)
+
+        data = m.group(2)
+
+        try:
+            val = int(data, 0)
+
+        except ValueError:
+            raise AsmError(f"line {line_num}: invalid integer argument to DB",
+                2)
+
+        # Force to byte size
+        emit(val & 0xff, data)
+
+    def check_ops(opcode, op_a, op_b):
+        """Check operands for sanity with a particular opcode"""
+
+        def check_ops_count(desired, found):
+            # Makes sure we have right operand count
+            if found < desired:
+                raise AsmError(f"Line {line_num}: missing operand to {opcode}",
+                    1)
+            elif found > desired:
+                raise AsmError(
+                    f"Line {line_num}: unexpected operand to {opcode}", 1)
+
+        # Make sure we know this opcode at all
+        if opcode not in OPCODES:
+            raise AsmError(f"line {line_num}: unknown opcode {opcode}", 2)
+
+        op_type = OPCODES[opcode]["type"]
+
+        total_operands = 0
+
+        if op_a is not None:
+            total_operands += 1
+
+        if op_b is not None:
+            total_operands += 1
+
+        if op_type == 0 or op_type == 1 or op_type == 2:
+            # 0, 1, or 2 register operands
+            check_ops_count(op_type, total_operands)
+
+        elif op_type == 8:
+            # LDI r,i or LDI r,label
+            check_ops_count(2, total_operands)
+
+    # Type to function mapping
+    type_f = {
+        0: out0,
+        1: out1,
+        2: out2,
+        8: out8,
+    }
+
+    for line in lines:
+        line_num += 1
+
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
+
+        # Normalize
+        line = line.strip()
+
+        # Ignore blank lines
+        if line == '':
+            continue
+
+        m = re.match(REGEX, line)
+
+        if m is not None:
+            label, opcode, op_a, op_b = normalize_line(m.groups())
+
+            # Track label address
+            if label is not None:
+                sym[label] = len(code)
+                listing.labels.append((len(code), label))
+
+            if opcode is not None:
+                if opcode == 'DS':
+                    handle_ds(line)
+                elif opcode == 'DB':
+                    handle_db(line)
+                else:
+                    # Check operand count
+                    check_ops(opcode, op_a, op_b)
+
+                    # Handle opcodes
+                    op_info = OPCODES[opcode]
+                    handler = type_f[op_info["type"]]
+                    handler(opcode, op_a, op_b, int(op_info["code"], 2))
+        else:
+            raise AsmError(f"No match: {line}", 3)
+
+
+def pass2(sym, code, fixups):
+    """
+    Patch the address of each label in fixups into code.
+    """
+
+    for offset, name, line_num in fixups:
+        if name not in sym:
+            raise AsmError(f"unknown symbol: {name}", 2)
+
+        code[offset] = sym[name]
+
+
+def assemble(source, listing=None):
+    """
+    Assemble source, a string or an iterable of lines (such as an open
+    file), and return (code, symbols): the machine code as bytes, ready for
+    CPU.load_bytes(), and a dict of label addresses. Raises AsmError for
+    the first error in the source, like asm.assemble() did.
+
+    If listing (a Listing) is given, the comments of the text format are
+    collected in it for render_text().
+    """
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    sym = {}
+    code = bytearray()
+    fixups = []
+
+    pass1(source, sym, code, fixups, listing)
+    pass2(sym, code, fixups)
+
+    return bytes(code), sym
+
@@ -0,0 +1,61 @@
+; Sieve of Eratosthenes
+;
+; Keeps a flag per number below 112 at 0x80 + n, clears them and crosses
+; out the multiples of every prime, counting the primes; 40 times over.
+; Then prints the count.
+;
+; Expected output: 29
+
+	LDI R7,40            ; repetitions
+
+Repeat:
+	LDI R0,0x80
+	LDI R1,0
+	LDI R2,0xF0
+
+Clear:
+	ST R0,R1
+	INC R0
+	CMP R0,R2
+	LDI R3,Clear
+	JNE R3
+
+	LDI R4,0             ; primes found
+	LDI R0,2             ; n
+
+Next:
+	LDI R1,0x80
+	ADD R1,R0            ; address of n's flag
+	LD R2,R1
+	LDI R3,0
+	CMP R2,R3
+	LDI R3,Skip
+	JNE R3               ; crossed out already
+	INC R4
+	LDI R2,0xF0
+	SUB R2,R0            ; stop before the flags end
+
+Mark:
+	CMP R1,R2
+	LDI R3,Skip
+	JGE R3
+	ADD R1,R0            ; next multiple
+	ST R1,R0             ; cross it out
+	LDI R3,Mark
+	JMP R3
+
+Skip:
+	INC R0
+	LDI R2,112
+	CMP R0,R2
+	LDI R3,Next
+	JNE R3
+
+	DEC R7
+	LDI R0,0
+	CMP R7,R0
+	LDI R3,Repeat
+	JNE R3
+
+	PRN R4
+	HLT
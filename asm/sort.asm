@@ -0,0 +1,71 @@
+; Bubble sort
+;
+; Fills the 16 bytes at 0xC0 with a pseudo-random sequence (x = 5x + 3),
+; sorts them in place with bubble sort, and does both 100 times over.
+; Then prints the sorted bytes.
+;
+; Expected output: 4 5 9 23 28 38 48 143 154 193 194 200 205 206 235 243
+; (one per line)
+
+	LDI R7,100           ; repetitions
+
+Repeat:
+	LDI R0,0xC0          ; fill pointer
+	LDI R1,7             ; x
+
+Fill:
+	LDI R2,5
+	MUL R1,R2
+	LDI R2,3
+	ADD R1,R2            ; x = 5x + 3
+	ST R0,R1
+	INC R0
+	LDI R2,0xD0
+	CMP R0,R2
+	LDI R3,Fill
+	JNE R3
+
+	LDI R4,0xCF          ; last address of the unsorted part
+
+Pass:
+	LDI R0,0xC0
+
+Compare:
+	LD R1,R0             ; a = [p]
+	INC R0
+	LD R2,R0             ; b = [p + 1]
+	CMP R1,R2
+	LDI R3,Ordered
+	JLE R3
+	ST R0,R1             ; swap them
+	DEC R0
+	ST R0,R2
+	INC R0
+
+Ordered:
+	CMP R0,R4
+	LDI R3,Compare
+	JNE R3
+	DEC R4               ; the largest is now in place
+	LDI R0,0xC0
+	CMP R4,R0
+	LDI R3,Pass
+	JNE R3
+
+	DEC R7
+	LDI R0,0
+	CMP R7,R0
+	LDI R3,Repeat
+	JNE R3
+
+	LDI R0,0xC0
+	LDI R4,0xD0
+
+Print:
+	LD R1,R0
+	PRN R1
+	INC R0
+	CMP R0,R4
+	LDI R3,Print
+	JNE R3
+	HLT
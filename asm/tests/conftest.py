@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The assembler modules import each other by plain name, as when run from
+# asm/
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
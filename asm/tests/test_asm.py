@@ -0,0 +1,23 @@
+import pytest
+
+import asm
+
+
+def test_all_errors_are_reported_in_line_order():
+    with pytest.raises(asm.AsmError) as raised:
+        asm.assemble("LDI R0,Nowhere\nFOO R1\nADD R0\nLDI R9,3\n")
+    assert [str(error).split(":")[0] for error in raised.value.errors] == \
+        ["Line 1", "line 2", "Line 3", "Line 4"]
+
+
+@pytest.mark.parametrize("name", ["L" * 256, "Étiquette"])
+def test_labels_the_symbol_table_cannot_hold(name):
+    with pytest.raises(asm.AsmError) as raised:
+        asm.assemble(f"LDI R0,1\n{name}:\nHLT\n")
+    assert str(raised.value).startswith("Line 2: label ")
+    assert raised.value.status == 2
+
+
+def test_longest_label_fits_the_image():
+    code, symbols = asm.assemble("L" * 255 + ":\nHLT\n")
+    assert asm.render_image(code, symbols).endswith(b"L" * 255 + b"\x01")
@@ -0,0 +1,35 @@
+import pytest
+
+import build
+
+SOURCE = "LDI R0,8\nPRN R0\nHLT\n"
+
+
+@pytest.mark.parametrize("corrupt", [
+    b"\xff\xfe\x00binary",  # not UTF-8
+    b"10000010\nnot binary digits\n",
+    b"LS8\x00\x01\x00\x00\x00",  # an image, not text
+])
+def test_corrupt_output_is_rebuilt(tmp_path, corrupt):
+    source = tmp_path / "prog.asm"
+    source.write_text(SOURCE)
+    output = tmp_path / "prog.ls8"
+    output.write_bytes(corrupt)
+
+    [(path, status, seconds, error)] = build.build([str(source)],
+        str(tmp_path))
+
+    assert (status, error) == ("built", None)
+    assert build.machine_code(output.read_text()) == \
+        bytes([0b10000010, 0, 8, 0b01000111, 0, 0b00000001])
+
+
+def test_unchanged_rebuild_is_cached(tmp_path):
+    source = tmp_path / "prog.asm"
+    source.write_text(SOURCE)
+    build.build([str(source)], str(tmp_path))
+
+    [(path, status, seconds, error)] = build.build([str(source)],
+        str(tmp_path))
+
+    assert status == "cached"
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""
+Asyncio input for LS-8 machines.
+
+    keyboard = Input.shared(sys.stdin)
+    keyboard.attach(cpu) # cpu = CPU(interrupts=True)
+    await cpu.run_async()
+
+An Input watches one file descriptor (a terminal, a pipe or a socket) with
+loop.add_reader(), so nothing blocks: when bytes arrive they are read in
+one go and each one goes to every attached machine as a key press, which
+the CPU's interrupt controller leaves at 0xF4 and raises interrupt 1 for.
+Input.shared() keeps one Input per descriptor, so any number of machines
+on the same loop share a single reader. For an asyncio StreamReader (from
+asyncio.open_connection() or a server), pump() feeds an Input instead.
+
+CPU.run_async() runs a machine in slices of `every` instructions and
+yields to the loop between them.
+
+Usage: aio.py [--every N] [--max-cycles N] program.ls8...
+
+Runs every program on one event loop with stdin as their shared keyboard.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+from cpu import *
+from interrupts import cbreak, restore
+
+
+class Input:
+    """One non-blocking reader, fanning key presses out to machines."""
+
+    # descriptor -> Input, for shared()
+    readers = {}
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.fd = None if stream is None else (
+            stream if isinstance(stream, int) else stream.fileno())
+        self.machines = []
+        self.loop = None
+        self.watched = False # True once add_reader() took the descriptor
+        self.saved = None # terminal settings to restore
+        self.closed = False # set at end of file
+        self.received = 0 # bytes read
+
+    @classmethod
+    def shared(cls, stream):
+        """The Input for stream's descriptor, created the first time."""
+        fd = stream if isinstance(stream, int) else stream.fileno()
+        reader = cls.readers.get(fd)
+        if reader is None:
+            reader = cls.readers[fd] = cls(stream)
+        return reader
+
+    def attach(self, cpu):
+        """Send keys to cpu. The first attach starts watching the input."""
+        if cpu.interrupts is None:
+            raise ValueError("the CPU has no interrupt controller; "
+                             "create it with CPU(interrupts=True)")
+        self.machines.append(cpu)
+        if self.loop is None and self.fd is not None and not self.closed:
+            self.loop = asyncio.get_running_loop()
+            self.saved = cbreak(self.fd)
+            os.set_blocking(self.fd, False)
+            try:
+                self.loop.add_reader(self.fd, self.ready)
+                self.watched = True
+            except PermissionError:
+                # a regular file can't be watched, but never blocks either:
+                # read it a chunk per turn of the loop instead
+                self.loop.call_soon(self.ready)
+
+    def detach(self, cpu):
+        """Stop sending keys to cpu; the last detach stops watching."""
+        self.machines.remove(cpu)
+        if not self.machines:
+            self.close()
+
+    def close(self):
+        if self.loop is not None:
+            if self.watched:
+                self.loop.remove_reader(self.fd)
+                self.watched = False
+            os.set_blocking(self.fd, True)
+            restore(self.fd, self.saved)
+            self.saved = None
+            self.loop = None
+        Input.readers.pop(self.fd, None)
+
+    def ready(self):
+        # called by the loop when the descriptor has data
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.closed = True
+            self.close()
+            return
+        self.feed(data)
+        if not self.watched and self.loop is not None:
+            self.loop.call_soon(self.ready)
+
+    def feed(self, data):
+        """Deliver data, one key press per byte, to every machine."""
+        self.received += len(data)
+        for cpu in self.machines:
+            interrupts = cpu.interrupts
+            for key in data:
+                interrupts.press(key)
+
+
+async def pump(reader, keys):
+    """Feed everything an asyncio StreamReader receives to Input keys."""
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            return
+        keys.feed(data)
+
+
+async def run_all(machines, keyboard=None, every=10000, max_cycles=None):
+    """
+    Run machines side by side on the running loop, with keyboard (an
+    Input) attached to all of them. Returns their RunResults; a machine
+    that faults returns its CPUFault instead.
+    """
+    if keyboard is not None:
+        for cpu in machines:
+            keyboard.attach(cpu)
+    try:
+        return await asyncio.gather(
+            *(cpu.run_async(max_cycles, every) for cpu in machines),
+            return_exceptions=True)
+    finally:
+        if keyboard is not None:
+            for cpu in machines:
+                keyboard.detach(cpu)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Run LS-8 programs on one event loop.")
+    parser.add_argument('programs', nargs='+')
+    parser.add_argument('--every', type=int, default=10000,
+                        help="instructions between yields to the loop")
+    parser.add_argument('--max-cycles', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    machines = []
+    for program in args.programs:
+        cpu = CPU(interrupts=True)
+        cpu.load_file(program)
+        machines.append(cpu)
+
+    async def session():
+        keyboard = Input.shared(sys.stdin) if sys.stdin is not None else None
+        return await run_all(machines, keyboard, args.every, args.max_cycles)
+
+    try:
+        results = asyncio.run(session())
+    except KeyboardInterrupt:
+        return 130
+    status = 0
+    for program, result in zip(args.programs, results):
+        if isinstance(result, CPUFault):
+            print(f"{program}: {result}", file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,53 @@
+"""Precomputed result and flag tables for the LS-8 ALU."""
+
+# Binary operations, indexed by (a << 8) | b
+BINARY = {
+    'ADD': lambda a, b: (a + b) & 0xFF,
+    'SUB': lambda a, b: (a - b) & 0xFF,
+    'MUL': lambda a, b: (a * b) & 0xFF,
+    'DIV': lambda a, b: a // b if b else 0, # callers check for 0 first
+    'MOD': lambda a, b: a % b if b else 0,
+    'AND': lambda a, b: a & b,
+    'OR': lambda a, b: a | b,
+    'XOR': lambda a, b: a ^ b,
+    'SHL': lambda a, b: (a << b) & 0xFF,
+    'SHR': lambda a, b: a >> b,
+    # FL after CMP a,b: 00000LGE
+    'CMP': lambda a, b: 0b100 if a < b else 0b001 if a == b else 0b010,
+}
+
+# Unary operations, indexed by a
+UNARY = {
+    'INC': lambda a: (a + 1) & 0xFF,
+    'DEC': lambda a: (a - 1) & 0xFF,
+    'NOT': lambda a: ~a & 0xFF,
+}
+
+
+class Tables:
+    """
+    ALU tables, built the first time each one is used.
+
+    Every table is a bytes object: 64 KiB for a binary operation and 256
+    bytes for a unary one, so all of them together take about 720 KiB and a
+    program only pays for the operations it actually runs.
+    """
+
+    def __getattr__(self, name):
+        if name in BINARY:
+            op = BINARY[name]
+            table = bytes(op(a, b) for a in range(256) for b in range(256))
+        elif name in UNARY:
+            op = UNARY[name]
+            table = bytes(op(a) for a in range(256))
+        else:
+            raise AttributeError(name)
+        # cache it so later lookups don't come back through __getattr__
+        setattr(self, name, table)
+        return table
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+TABLES = Tables()
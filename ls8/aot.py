@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+"""
+Ahead-of-time translator from LS-8 programs to Python modules.
+
+translate() walks the code reachable from the entry point and turns every
+block start it finds into a Python function, using the same statement
+templates as the JIT (jit.py) and the CPU's own exec_* handlers for
+everything else. The module ends in a 256-entry jump table, so running it
+is one list index and call per block with no decoding at all.
+
+Translated modules are cached on disk, keyed by a hash of the RAM image
+and entry point (LS8_AOT_CACHE, or __aot__ next to this file), so a
+program is translated once and later runs just import it.
+
+Jump targets are registers, so the walk can't be sure to find every block.
+Starts it missed are run one instruction at a time through CPU.decode(),
+and if the program ever writes into bytes that were translated, the rest
+of the run falls back to CPU.execute().
+
+Usage: aot.py [--check] program.ls8...
+
+Runs each program from its cached translation. With --check, runs each
+one on both CPU.run() and the translation and reports whether the
+output, final state and cycle count agree.
+"""
+
+import hashlib
+import importlib.util
+import os
+import sys
+import tempfile
+
+from cpu import *
+from devices import CaptureOutput
+from jit import INLINE, BRANCHES, MAX_BLOCK
+
+# Bump when the generated code changes, to retire old cache entries
+VERSION = 2
+
+CACHE = os.environ.get('LS8_AOT_CACHE') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '__aot__')
+
+JUMPS = {JMP, JEQ, JNE, JGT, JGE, JLT, JLE, CALL}
+# Instructions that end a block: control flow (IRET and INT included), and
+# writes to RAM, after which the block checks that it didn't just overwrite
+# translated code
+ENDS = set(BRANCHES) | {CALL, RET, ST, PUSH, INT, IRET}
+WRITES = {ST, PUSH, CALL}
+
+
+def size(IR):
+    return ((IR & 0b11000000) >> 6) + 1
+
+
+def walk(RAM, start):
+    """The (address, IR, a, b) instructions of the block at start."""
+    block = []
+    address = start
+    while len(block) < MAX_BLOCK:
+        IR = RAM[address]
+        if IR not in CPU.OPERATIONS:
+            break
+        block.append((address, IR, RAM[(address + 1) & 0xFF],
+                      RAM[(address + 2) & 0xFF]))
+        next_pc = address + size(IR)
+        if IR in ENDS or next_pc > 0xFF:
+            break
+        address = next_pc
+    return block
+
+
+def block_starts(RAM, entry):
+    """
+    Addresses that can start a block: the entry point, the instruction
+    after every conditional jump and CALL, and every LDI constant loaded
+    into a register that some reachable jump or CALL goes through.
+    """
+    starts = set()
+    constants = set() # (register, value) pairs from reachable LDIs
+    jump_registers = set()
+    pending = [entry]
+    while pending:
+        start = pending.pop()
+        if start in starts:
+            continue
+        starts.add(start)
+        block = walk(RAM, start)
+        for address, IR, a, b in block:
+            if IR == LDI:
+                constants.add((a, b))
+            elif IR in JUMPS:
+                jump_registers.add(a)
+        if block:
+            address, IR, a, b = block[-1]
+            next_pc = address + size(IR)
+            if IR not in (JMP, RET, IRET, HLT) and next_pc <= 0xFF:
+                pending.append(next_pc)
+        pending.extend(value for register, value in constants
+                       if register in jump_registers and value not in starts)
+    return sorted(starts)
+
+
+def translate(RAM, entry):
+    """Return the source of a Python module that runs the program in RAM."""
+    code = bytearray(256)
+    counts = [0] * 256
+    functions = []
+    for start in block_starts(RAM, entry):
+        block = walk(RAM, start)
+        if not block:
+            continue
+        last = block[-1][0]
+        lines = [
+            f"def block_{start:02X}(cpu, REG, RAM):",
+            f"    if cpu.SP <= {last + 1}:",
+            "        return -1 # in the stack's way: let decode() decide",
+            "    n = 0",
+            "    try:",
+        ]
+        body = []
+        next_pc = start
+        for count, (address, IR, a, b) in enumerate(block):
+            next_pc = (address + size(IR)) & 0xFF
+            for covered in range(address, address + size(IR)):
+                code[covered & 0xFF] = 1
+            fields = {'a': a, 'b': b, 'next': next_pc}
+            if IR in INLINE:
+                body.extend(line.format(**fields) for line in INLINE[IR])
+            elif IR in BRANCHES:
+                body.extend(line.format(**fields) for line in BRANCHES[IR])
+            else:
+                # run it through the CPU's handler, which may fault
+                name = CPU.OPERATIONS[IR].__name__
+                body.append(f"n = {count}")
+                body.append(f"cpu.PC = {address}")
+                if IR == ST:
+                    body.append(f"written = REG[{a}]")
+                if IR in WRITES:
+                    body.append(f"pc = cpu.{name}({a}, {b}, {next_pc})")
+                    if IR != ST:
+                        body.append("written = cpu.SP")
+                    body.append("if CODE[written]:")
+                    body.append("    cpu.PC = pc")
+                    body.append("    raise SelfModified(written)")
+                    body.append("return pc")
+                elif IR in ENDS:
+                    body.append(f"return cpu.{name}({a}, {b}, {next_pc})")
+                else:
+                    body.append(f"cpu.{name}({a}, {b}, {next_pc})")
+        if block[-1][1] not in ENDS:
+            body.append(f"return {next_pc}")
+        lines.extend("        " + line for line in body)
+        lines.extend([
+            "    except CPUFault:",
+            "        cpu.cycles += n",
+            "        raise",
+        ])
+        functions.append("\n".join(lines))
+        counts[start] = len(block)
+
+    table = ", ".join(f"block_{start:02X}" if counts[start] else "None"
+                      for start in range(256))
+    return "\n".join([
+        '"""LS-8 program translated by aot.py. Do not edit."""',
+        "",
+        "from cpu import CPUFault",
+        "",
+        f"VERSION = {VERSION}",
+        f"ENTRY = {entry}",
+        "# 1 for every byte of RAM that was translated",
+        f"CODE = bytes.fromhex('{code.hex()}')",
+        "",
+        "",
+        "class SelfModified(Exception):",
+        '    """The program wrote into its own translated code."""',
+        "",
+        "",
+        "\n\n\n".join(functions),
+        "",
+        "",
+        "# block function and instruction count per start address",
+        f"TABLE = [{table}]",
+        f"COUNTS = {counts}",
+        "",
+    ])
+
+
+def load(RAM, entry):
+    """The translated module for a RAM image, from the cache if possible."""
+    key = hashlib.sha256(bytes([VERSION, entry]) + bytes(RAM)).hexdigest()[:32]
+    path = os.path.join(CACHE, f"ls8_{key}.py")
+    if not os.path.exists(path):
+        os.makedirs(CACHE, exist_ok=True)
+        source = translate(RAM, entry)
+        # write to a temporary file and rename, so a reader never sees half
+        # a module
+        fd, temporary = tempfile.mkstemp(dir=CACHE, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            file.write(source)
+        os.replace(temporary, path)
+    spec = importlib.util.spec_from_file_location(f"ls8_aot_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def step(cpu):
+    """Run one instruction through the CPU's plain handlers."""
+    handler, a, b, next_pc, _ = cpu.decode(cpu.PC, False)
+    cpu.PC = handler(cpu, a, b, next_pc)
+
+
+def run(cpu, program, max_cycles=None):
+    """
+    Run a loaded CPU on a translated module from load(), until HLT or
+    max_cycles instructions. Returns a RunResult, like CPU.run().
+    """
+    table = program.TABLE
+    counts = program.COUNTS
+    REG = cpu.REG
+    RAM = cpu.RAM
+    before = cpu.cycles
+    limit = -1 if max_cycles is None else max_cycles
+    cycles = 0
+    modified = False
+    cpu.running = not cpu.halted
+    try:
+        while cpu.running and cycles != limit:
+            start = cpu.PC
+            block = table[start]
+            if block is None or (limit >= 0 and cycles + counts[start] > limit):
+                # not a known block start, or the end of the budget
+                step(cpu)
+                cycles += 1
+                continue
+            try:
+                pc = block(cpu, REG, RAM)
+            except program.SelfModified:
+                cycles += counts[start]
+                modified = True
+                break
+            if pc < 0:
+                step(cpu)
+                cycles += 1
+                continue
+            cpu.PC = pc
+            cycles += counts[start]
+    finally:
+        cpu.cycles += cycles
+        if not modified:
+            cpu.output.flush()
+    if modified:
+        # the translation no longer matches RAM: interpret the rest
+        cpu.run(None if max_cycles is None else max_cycles - cycles)
+    return RunResult(cpu.halted, cpu.cycles - before, cpu.PC)
+
+
+def check(path, max_cycles=100000):
+    """True if program runs the same on CPU.run() and its translation."""
+    results = []
+    for translated in (False, True):
+        cpu = CPU(output=CaptureOutput())
+        cpu.load_file(path)
+        fault = None
+        try:
+            if translated:
+                run(cpu, load(cpu.RAM, cpu.PC), max_cycles)
+            else:
+                cpu.run(max_cycles)
+        except CPUFault as e:
+            fault = str(e)
+        results.append((cpu.output.getvalue(), fault, cpu.cycles, cpu.PC,
+                        cpu.FL, cpu.SP, bytes(cpu.REG), bytes(cpu.RAM)))
+    return results[0] == results[1]
+
+
+def main(argv):
+    args = argv[1:]
+    checking = bool(args) and args[0] == '--check'
+    if checking:
+        args = args[1:]
+    if not args:
+        print("usage: aot.py [--check] program.ls8...", file=sys.stderr)
+        return 1
+    status = 0
+    for path in args:
+        if checking:
+            same = check(path)
+            print(f"{path}: {'matches' if same else 'DIFFERS'}")
+            status |= not same
+            continue
+        cpu = CPU()
+        cpu.load_file(path)
+        try:
+            run(cpu, load(cpu.RAM, cpu.PC))
+        except CPUFault as fault:
+            print(fault)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+Run many .ls8 programs across a pool of worker processes.
+
+Usage: batch.py [options] PATH...
+
+Each PATH is a .ls8 file, a directory (every *.ls8 in it is run) or a
+manifest ending in .jsonl, one run per line:
+
+    {"program": "examples/mult.ls8", "registers": [0, 3], "memory": {"240": 9}}
+
+"registers" and "memory" are optional and are applied after the program is
+loaded. Results are written to stdout as JSON lines, in input order.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU, CPUFault
+from devices import CaptureOutput
+
+# Per-worker state: one CPU reused for every run, and the RAM image and
+# entry point of every program this worker has already parsed
+worker_cpu = None
+worker_images = {}
+
+
+def init_worker():
+    global worker_cpu
+    worker_cpu = CPU(output=CaptureOutput())
+
+
+def image(program):
+    """
+    The 256-byte RAM image of a program file and the PC it starts at,
+    parsed once per worker.
+    """
+    if program not in worker_images:
+        cpu = CPU()
+        cpu.load_file(program)
+        worker_images[program] = (bytes(cpu.RAM), cpu.PC)
+    return worker_images[program]
+
+
+def run_job(job, max_cycles=None):
+    """Run one job dict in this worker and return its result dict."""
+    cpu = worker_cpu
+    if cpu is None:
+        init_worker()
+        cpu = worker_cpu
+    cpu.reset()
+    result = {'program': job.get('program')}
+    # a bad entry gets an error result rather than sinking the whole batch
+    try:
+        cpu.RAM[:], cpu.PC = image(job['program'])
+        registers = job.get('registers', ())
+        if len(registers) > 8:
+            raise ValueError(f"{len(registers)} registers given, there are 8")
+        for i, value in enumerate(registers):
+            cpu.REG[i] = value
+        for address, value in job.get('memory', {}).items():
+            address = int(address, 0) if isinstance(address, str) else address
+            if not 0 <= address < 256:
+                raise ValueError(f"no memory address {address}")
+            cpu.RAM[address] = value
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        result.update(halt='error', error=f"{type(e).__name__}: {e}")
+        return result
+    cpu.output.clear()
+    began = time.perf_counter()
+    halt = 'HLT'
+    try:
+        if not cpu.run(max_cycles).halted:
+            halt = 'cycle limit'
+    except CPUFault as fault:
+        halt = 'fault'
+        result['fault'] = str(fault)
+    elapsed = time.perf_counter() - began
+    result.update(
+        output=cpu.output.getvalue(),
+        halt=halt,
+        cycles=cpu.cycles,
+        wall_time=elapsed,
+        pc=cpu.PC,
+        registers=list(cpu.REG),
+    )
+    return result
+
+
+def run_chunk(jobs, max_cycles=None):
+    return [run_job(job, max_cycles) for job in jobs]
+
+
+def collect_jobs(paths):
+    """Turn .ls8 files, directories and .jsonl manifests into job dicts."""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.ls8'):
+                    jobs.append({'program': os.path.join(path, name)})
+        elif path.endswith('.jsonl'):
+            with open(path) as manifest:
+                for line in manifest:
+                    if line.strip():
+                        jobs.append(json.loads(line))
+        else:
+            jobs.append({'program': path})
+    return jobs
+
+
+def run_batch(jobs, workers=None, chunksize=16, max_cycles=None):
+    """Yield a result dict per job, in order, as the pool finishes them."""
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        for results in pool.map(run_chunk, chunks, [max_cycles] * len(chunks)):
+            yield from results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Run many LS-8 programs and print JSON lines.")
+    parser.add_argument('paths', nargs='+',
+                        help=".ls8 files, directories or .jsonl manifests")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help="programs sent to a worker at a time")
+    parser.add_argument('--max-cycles', type=int, default=1000000,
+                        help="stop a program after this many instructions")
+    args = parser.parse_args(argv[1:])
+
+    jobs = collect_jobs(args.paths)
+    for result in run_batch(jobs, args.workers, args.chunksize,
+                            args.max_cycles):
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
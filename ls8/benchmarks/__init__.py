@@ -0,0 +1 @@
+"""Benchmarks for the LS-8 emulator. Run them from the ls8 directory."""
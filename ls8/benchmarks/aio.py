@@ -0,0 +1,76 @@
+"""
+Throughput of CPU.run_async() against the synchronous run().
+
+Usage: python -m benchmarks.aio [machines]
+
+Runs the interrupt-free loop from benchmarks.interrupts on run(), then on
+run_async() with a few slice sizes, then as many machines side by side on
+one event loop sharing one Input on a pipe.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aio import Input, run_all
+from benchmarks.interrupts import PROGRAM
+from cpu import CPU
+from devices import NullOutput
+
+
+def machine():
+    cpu = CPU(output=NullOutput(), interrupts=True)
+    cpu.load_bytes(PROGRAM)
+    return cpu
+
+
+def synchronous(count):
+    """Instructions per second running count machines one after another."""
+    machines = [machine() for _ in range(count)]
+    began = time.perf_counter()
+    for cpu in machines:
+        cpu.run()
+    return sum(cpu.cycles for cpu in machines) / (time.perf_counter() - began)
+
+
+def asynchronous(count, every):
+    """Instructions per second running count machines on one loop."""
+    machines = [machine() for _ in range(count)]
+    read, write = os.pipe()
+
+    async def session():
+        keyboard = Input.shared(read)
+        began = time.perf_counter()
+        await run_all(machines, keyboard, every)
+        return time.perf_counter() - began
+
+    try:
+        elapsed = asyncio.run(session())
+    finally:
+        os.close(read)
+        os.close(write)
+    return sum(cpu.cycles for cpu in machines) / elapsed
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 50
+    # the first few runs of the interpreter loop are slower than the rest
+    for _ in range(10):
+        synchronous(1)
+    baseline = max(synchronous(1) for _ in range(5))
+    print(f"{'run()':28} {baseline / 1e6:6.2f} M instructions/s")
+    for every in (1000, 10000, 100000):
+        rate = max(asynchronous(1, every) for _ in range(5))
+        print(f"{f'run_async(every={every})':28} {rate / 1e6:6.2f} M "
+              f"instructions/s ({rate / baseline:6.1%})")
+    rate = synchronous(count)
+    print(f"{f'{count} machines, run()':28} {rate / 1e6:6.2f} M instructions/s")
+    shared = asynchronous(count, 10000)
+    print(f"{f'{count} machines, one loop':28} {shared / 1e6:6.2f} M "
+          f"instructions/s ({shared / rate:6.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
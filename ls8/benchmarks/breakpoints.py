@@ -0,0 +1,74 @@
+"""
+Cost of breakpoints and watchpoints.
+
+Usage: python -m benchmarks.breakpoints [trials]
+
+Runs the interrupt-free loop from benchmarks.interrupts on a plain CPU and
+on one whose breakpoints were set and then all removed, which should run
+at the same speed, then with points armed that the loop never triggers: a
+breakpoint off the loop, a watch on RAM (the loop stores nothing), a
+conditional watch on the outer counter R3, checked once per outer
+iteration, and a conditional breakpoint on the inner loop's head, checked
+every iteration. The conditions never hold, so every run goes to the end.
+"""
+
+import sys
+import time
+
+from benchmarks.interrupts import PROGRAM
+from breakpoints import Breakpoints, condition
+from cpu import CPU
+from devices import NullOutput
+
+INNER = 0x0C # head of the inner loop
+# CMP leaves FL at 1, 2 or 4, so this never holds
+NEVER = "FL == 8"
+
+
+def disarmed(points):
+    points.add(INNER)
+    points.watch_register(0)
+    points.clear()
+
+
+def rate(arm=None):
+    """Instructions per second of a fresh machine running PROGRAM."""
+    cpu = CPU(output=NullOutput())
+    cpu.load_bytes(PROGRAM)
+    if arm is not None:
+        arm(Breakpoints(cpu))
+    began = time.perf_counter()
+    cpu.run()
+    elapsed = time.perf_counter() - began
+    assert cpu.halted
+    return cpu.cycles / elapsed
+
+
+def main(argv):
+    trials = int(argv[1]) if len(argv) > 1 else 5
+    configurations = [
+        ("no breakpoints", None),
+        ("set, then removed", disarmed),
+        ("breakpoint off the loop", lambda points: points.add(0x80)),
+        ("watch on RAM", lambda points: points.watch_memory(0xF0)),
+        ("watch on R3", lambda points: points.watch_register(
+            3, condition(NEVER))),
+        ("conditional on the loop", lambda points: points.add(
+            INNER, condition(NEVER))),
+    ]
+    # the first few runs of the interpreter loop are slower than the rest
+    for _ in range(10):
+        rate()
+    # take turns, so drift in the machine's speed hits every one alike
+    best = [0] * len(configurations)
+    for _ in range(trials):
+        for index, (name, arm) in enumerate(configurations):
+            best[index] = max(best[index], rate(arm))
+    for (name, arm), fastest in zip(configurations, best):
+        print(f"{name:24} {fastest / 1e6:6.2f} M instructions/s "
+              f"({fastest / best[0]:6.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
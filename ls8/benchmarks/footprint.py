@@ -0,0 +1,41 @@
+"""
+Memory footprint and construction time of CPU instances.
+
+Usage: python -m benchmarks.footprint [count]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from cpu import CPU
+
+
+def measure(count):
+    """Build count idle CPUs; return (bytes per instance, seconds)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    began = time.perf_counter()
+    machines = [CPU() for _ in range(count)]
+    elapsed = time.perf_counter() - began
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # don't count the list holding them
+    held = after - before - sys.getsizeof(machines)
+    return held / count, elapsed
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+    per_instance, elapsed = measure(count)
+    cpu = CPU()
+    print(f"{count} machines in {elapsed:.3f} s "
+          f"({elapsed / count * 1e6:.2f} us each)")
+    print(f"traced memory per machine: {per_instance:.0f} bytes")
+    print(f"  instance {sys.getsizeof(cpu)}, RAM {sys.getsizeof(cpu.RAM)}, "
+          f"REG {sys.getsizeof(cpu.REG)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,73 @@
+"""
+Cost of forking a machine at a checkpoint against re-running to it.
+
+Usage: python -m benchmarks.fork [checkpoint]
+
+Runs the loop from benchmarks.interrupts to the checkpoint (an instruction
+count), then times CPU.fork(), restore() of the checkpoint into a machine
+that has run on past it, a serialization round trip, and building a fresh
+CPU and re-running the program from address 0 to the same point.
+"""
+
+import sys
+import time
+
+from benchmarks.interrupts import PROGRAM
+from cpu import CPU
+from devices import NullOutput
+from snapshot import Snapshot
+
+
+def per_call(function, repeats):
+    """Best time per call of function over a few trials."""
+    best = None
+    for _ in range(5):
+        began = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        elapsed = (time.perf_counter() - began) / repeats
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def fresh(checkpoint):
+    cpu = CPU(output=NullOutput())
+    cpu.load_bytes(PROGRAM)
+    cpu.run(checkpoint)
+    return cpu
+
+
+def main(argv):
+    checkpoint = int(argv[1]) if len(argv) > 1 else 100000
+    parent = fresh(checkpoint)
+    snapshot = parent.snapshot()
+
+    def explore():
+        # run on past the checkpoint, writing nothing, then go back
+        parent.run(100)
+        parent.restore(snapshot)
+
+    blob = snapshot.to_bytes()
+    results = [
+        ("fork()", per_call(parent.fork, 10000)),
+        ("run 100 + restore()", per_call(explore, 10000)),
+        ("snapshot()", per_call(parent.snapshot, 10000)),
+        ("to_bytes + from_bytes", per_call(
+            lambda: Snapshot.from_bytes(snapshot.to_bytes()), 10000)),
+        (f"new CPU, re-run {checkpoint}", per_call(
+            lambda: fresh(checkpoint), 3)),
+    ]
+    slowest = results[-1][1]
+    for name, seconds in results:
+        print(f"{name:28} {seconds * 1e6:10.1f} us "
+              f"({slowest / seconds:9.0f}x re-running)")
+    print(f"snapshot size: {len(blob)} bytes")
+    child = parent.fork()
+    child.run()
+    parent.run()
+    assert child.snapshot() == parent.snapshot()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
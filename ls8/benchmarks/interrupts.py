@@ -0,0 +1,92 @@
+"""
+Cost of the interrupt controller on programs that don't use interrupts.
+
+Usage: python -m benchmarks.interrupts [trials]
+
+Runs an interrupt-free loop of about 200,000 instructions on a CPU without
+a controller, on one with a controller and no devices, with the wall-clock
+timer attached (which never fires within a run this short) and with a
+cycle timer firing into a masked line, which makes run() look at IM again
+every interrupts.RECHECK instructions. Then runs interrupts.ls8 on a cycle
+timer to show the cost of actually taking interrupts.
+"""
+
+import os
+import sys
+import time
+
+from cpu import CPU
+from devices import NullOutput
+from interrupts import Timer
+
+# Two nested countdown loops, 256 x 256 iterations, then HLT
+PROGRAM = bytes([
+    0x82, 0x01, 0x00, # LDI R1,0
+    0x82, 0x02, 0x0C, # LDI R2,Inner
+    0x82, 0x04, 0x09, # LDI R4,Outer
+    0x82, 0x00, 0x00, # Outer: LDI R0,0
+    0x66, 0x00,       # Inner: DEC R0
+    0xA7, 0x00, 0x01, # CMP R0,R1
+    0x56, 0x02,       # JNE R2
+    0x66, 0x03,       # DEC R3
+    0xA7, 0x03, 0x01, # CMP R3,R1
+    0x56, 0x04,       # JNE R4
+    0x01,             # HLT
+])
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'examples', 'interrupts.ls8')
+
+
+def machine(interrupts=False, timer=None):
+    cpu = CPU(output=NullOutput(), interrupts=interrupts)
+    if timer is not None:
+        cpu.interrupts.attach(timer)
+    return cpu
+
+
+def rate(make):
+    """Instructions per second of a fresh machine running PROGRAM."""
+    cpu = make()
+    cpu.load_bytes(PROGRAM)
+    began = time.perf_counter()
+    cpu.run()
+    elapsed = time.perf_counter() - began
+    if cpu.interrupts is not None:
+        cpu.interrupts.close()
+    return cpu.cycles / elapsed
+
+
+def main(argv):
+    trials = int(argv[1]) if len(argv) > 1 else 5
+    configurations = [
+        ("no controller", lambda: machine()),
+        ("controller, no devices", lambda: machine(True)),
+        ("wall-clock timer", lambda: machine(True, Timer())),
+        ("masked cycle timer", lambda: machine(True, Timer(cycles=10000))),
+    ]
+    # the first few runs of the interpreter loop are slower than the rest
+    for _ in range(10):
+        rate(configurations[0][1])
+    # take turns, so drift in the machine's speed hits every one alike
+    best = [0] * len(configurations)
+    for _ in range(trials):
+        for index, (name, make) in enumerate(configurations):
+            best[index] = max(best[index], rate(make))
+    for (name, make), fastest in zip(configurations, best):
+        print(f"{name:24} {fastest / 1e6:6.2f} M instructions/s "
+              f"({fastest / best[0]:6.1%})")
+
+    cpu = machine(True, Timer(cycles=1000))
+    cpu.load_file(EXAMPLE)
+    began = time.perf_counter()
+    cpu.run(1000000)
+    elapsed = time.perf_counter() - began
+    taken = cpu.interrupts.delivered[0]
+    print(f"interrupts.ls8: {taken} interrupts in {cpu.cycles} instructions, "
+          f"{cpu.cycles / elapsed / 1e6:.2f} M instructions/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
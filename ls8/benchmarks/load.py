@@ -0,0 +1,55 @@
+"""
+Load time of the text .ls8 parser against the binary image loader.
+
+Usage: python -m benchmarks.load [repeats]
+
+Uses a program that fills all 256 bytes of RAM, the largest image the LS-8
+can hold.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import image
+from cpu import CPU
+
+
+def best_of(function, repeats, trials=5):
+    """Best time per call of function over a few trials of repeats calls."""
+    best = None
+    for _ in range(trials):
+        began = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        elapsed = (time.perf_counter() - began) / repeats
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else 2000
+    program = image.Image(bytes(random.randrange(256) for _ in range(256)))
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, 'big.ls8')
+        binary_path = os.path.join(directory, 'big.ls8b')
+        with open(text_path, 'w') as file:
+            file.write(image.render_text(program))
+        with open(binary_path, 'wb') as file:
+            file.write(image.pack(program))
+
+        cpu = CPU()
+        text = best_of(lambda: cpu.load(text_path), repeats)
+        binary = best_of(lambda: cpu.load_image(binary_path), repeats)
+        assert bytes(cpu.RAM) == program.code
+
+    print(f"text parser:   {text * 1e6:8.1f} us per 256-byte program")
+    print(f"binary image:  {binary * 1e6:8.1f} us per 256-byte program")
+    print(f"speedup:       {text / binary:8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,240 @@
+"""
+Benchmark suite: every program in examples/ on every engine.
+
+Usage: python -m benchmarks.suite [options]
+
+Runs each .ls8 program in examples/ (among them the CPU-heavy workloads
+assembled from asm/: sort, sieve, fib, memcpy and recursion) on each
+engine: CPU.run() plain, with the JIT, with fusion, with fusion and loop
+fast-forward, on the bitwise ALU, from an aot.py translation, and on the
+old interpret() loop. Programs that don't halt are cut off at
+--max-cycles; interpret() has no budget, so it only runs the ones that
+halt within it.
+
+After warm-up runs, every program and engine takes turns for --trials
+trials, so drift in the machine's speed hits them alike. A trial repeats
+the program on fresh CPUs for at least --min-time seconds, which gives
+its instructions per second and wall time per run. Peak memory is the
+tracemalloc peak of one more run, from creating the CPU to the end.
+
+--json writes the results. With --baseline, the median instructions per
+second of each program and engine are compared with a stored results
+file and any that fell by more than --threshold are listed as
+regressions, which makes the exit status 1; --save writes this run as
+the new baseline.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import aot
+from cpu import CPU, CPUFault
+from devices import NullOutput
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'examples')
+
+# name -> CPU() arguments; 'aot' and 'interpret' run their own loops
+ENGINES = {
+    'run': {},
+    'jit': {'jit': True},
+    'fuse': {'fuse': True},
+    'fast-forward': {'fuse': True, 'fast_forward': True},
+    'bitwise': {'alu': 'bitwise'},
+    'aot': {},
+    'interpret': {},
+}
+
+
+class Program:
+    """A program's RAM image, parsed once, and how far it runs."""
+
+    def __init__(self, path, max_cycles):
+        cpu = CPU(output=NullOutput())
+        cpu.load_file(path)
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.code = bytes(cpu.RAM)
+        self.entry = cpu.PC
+        self.max_cycles = max_cycles
+        try:
+            cpu.run(max_cycles)
+        except CPUFault:
+            pass
+        self.halts = cpu.halted
+        self.cycles = cpu.cycles
+        self.translation = None # aot module, made on first use
+
+    def run(self, engine):
+        """Run once on engine; returns the instructions run."""
+        cpu = CPU(output=NullOutput(), **ENGINES[engine])
+        cpu.load_bytes(self.code)
+        cpu.PC = self.entry
+        try:
+            if engine == 'aot':
+                if self.translation is None:
+                    self.translation = aot.load(cpu.RAM, cpu.PC)
+                aot.run(cpu, self.translation, self.max_cycles)
+            elif engine == 'interpret':
+                # interpret() doesn't count: it runs what run() ran
+                cpu.interpret()
+                return self.cycles
+            else:
+                cpu.run(self.max_cycles)
+        except CPUFault:
+            pass
+        return cpu.cycles
+
+
+def trial(program, engine, min_time):
+    """Instructions per second and seconds per run over min_time."""
+    cycles = runs = 0
+    elapsed = 0.0
+    while elapsed < min_time:
+        began = time.perf_counter()
+        cycles += program.run(engine)
+        elapsed += time.perf_counter() - began
+        runs += 1
+    return cycles / elapsed, elapsed / runs
+
+
+def peak_memory(program, engine):
+    """Peak bytes allocated during one run."""
+    tracemalloc.start()
+    try:
+        program.run(engine)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summary(values):
+    return {
+        'mean': statistics.fmean(values),
+        'median': statistics.median(values),
+        'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def measure(programs, engines, trials, min_time, warmup):
+    """A result dict per program and engine."""
+    pairs = [(program, engine) for program in programs for engine in engines
+             if engine != 'interpret' or program.halts]
+    for program, engine in pairs:
+        for _ in range(warmup):
+            program.run(engine)
+    rates = {pair: [] for pair in pairs}
+    walls = {pair: [] for pair in pairs}
+    for _ in range(trials):
+        for pair in pairs:
+            rate, wall = trial(*pair, min_time)
+            rates[pair].append(rate)
+            walls[pair].append(wall)
+    results = []
+    for program, engine in pairs:
+        results.append({
+            'program': program.name,
+            'engine': engine,
+            'cycles': program.run(engine),
+            'ips': summary(rates[program, engine]),
+            'wall': summary(walls[program, engine]),
+            'peak_bytes': peak_memory(program, engine),
+        })
+    return results
+
+
+def compare(results, baseline, threshold):
+    """The results whose median rate fell more than threshold below baseline."""
+    before = {(result['program'], result['engine']): result['ips']['median']
+              for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = before.get((result['program'], result['engine']))
+        if old is not None:
+            change = result['ips']['median'] / old - 1
+            if change < -threshold:
+                regressions.append((result, change))
+    return regressions
+
+
+def report(results):
+    print(f"{'program':16} {'engine':13} {'M instr/s':>10} {'stdev':>7} "
+          f"{'ms/run':>8} {'peak KiB':>9}")
+    for result in results:
+        ips = result['ips']
+        print(f"{result['program']:16} {result['engine']:13} "
+              f"{ips['median'] / 1e6:10.2f} {ips['stdev'] / ips['mean']:7.1%} "
+              f"{result['wall']['median'] * 1e3:8.3f} "
+              f"{result['peak_bytes'] / 1024:9.1f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.suite',
+        description="Benchmark the example programs on every engine.")
+    parser.add_argument('programs', nargs='*',
+                        help="programs to run (default: examples/*.ls8)")
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help="comma-separated engines")
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=3,
+                        help="untimed runs of each program and engine")
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help="seconds of runs per trial")
+    parser.add_argument('--max-cycles', type=int, default=200000)
+    parser.add_argument('--json', help="write the results here")
+    parser.add_argument('--baseline', help="results file to compare with")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown that counts as a regression")
+    parser.add_argument('--save', action='store_true',
+                        help="write the results to --baseline instead")
+    args = parser.parse_args(argv[1:])
+
+    engines = args.engines.split(',')
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine {engine}")
+    paths = args.programs or sorted(glob.glob(os.path.join(EXAMPLES, '*.ls8')))
+    programs = [Program(path, args.max_cycles) for path in paths]
+    results = measure(programs, engines, args.trials, args.min_time,
+                      args.warmup)
+    report(results)
+
+    document = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'trials': args.trials,
+        'max_cycles': args.max_cycles,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(document, file, indent=1)
+    if args.baseline is None:
+        return 0
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump(document, file, indent=1)
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold)
+    for result, change in regressions:
+        print(f"REGRESSION {result['program']} on {result['engine']}: "
+              f"{change:.1%}")
+    if not regressions:
+        print(f"no regressions beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
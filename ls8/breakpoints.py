@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Breakpoints and watchpoints for the LS-8 CPU.
+
+    points = Breakpoints(cpu)
+    points.add(0x1A) # stop before the instruction at 0x1A
+    points.add(0x20, condition("FL == 1")) # only when FL is 1
+    points.watch_register(0) # stop after R0 changes
+    points.watch_memory(0xF0, condition("[F0] > 9"))
+    cpu.run() # returns at the first one hit
+    points.hit # what stopped it, a Hit
+
+Nothing is checked on the normal run() loop. Instead, while any point is
+set, decode() hands each entry to instrument(), which wraps only the
+entries that need it: the instruction at a breakpoint's address, the
+stores (ST, PUSH, CALL) while memory is watched, and the instructions that
+write a watched register. Every other address runs its plain handler.
+Once the last point is removed the CPU is exactly as it was.
+
+A hit raises BreakpointHit from inside the loop, which run() catches and
+returns on, so no flag has to be polled. A breakpoint stops before its
+instruction runs; the next run() carries on from it. A watchpoint stops
+after the instruction that changed the value, with PC at the next one.
+Conditions are callables taking the CPU; condition() builds one from text
+such as "R0 >= 10".
+
+The JIT, fusion and fast-forward engines are set aside while points are
+set, since they run many instructions per entry, and come back after.
+Writes made by the interrupt controller rather than an instruction (the
+registers it pushes and the IS bit it clears) aren't watched.
+
+Usage: see ls8.py -h.
+"""
+
+import operator
+import re
+from collections import namedtuple
+
+from cpu import *
+
+# What stopped the CPU: kind is 'break', 'register' or 'memory'; pc is the
+# address of the instruction; target is the register or RAM address
+# watched, with its value before and after
+Hit = namedtuple('Hit', 'kind pc target old new')
+
+# Instructions that write REG[a]
+WRITES_A = {LDI, LD, POP} | (set(ALU_NAMES) - {CMP})
+
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+CONDITION = re.compile(
+    r'\s*(R[0-7]|FL|SP|PC|\[[0-9A-Fa-f]{1,2}\])\s*'
+    r'(==|!=|<=|>=|<|>)\s*(\w+)\s*$')
+
+
+def condition(text):
+    """
+    A condition from text of the form "NAME OP VALUE", where NAME is a
+    register (R0-R7), FL, SP, PC or a RAM cell in hex ([F0]), OP is a
+    comparison and VALUE a number (0x.. and 0b.. too).
+    """
+    match = CONDITION.match(text)
+    if match is None:
+        raise ValueError(f"bad condition {text!r}")
+    name, comparison, value = match.groups()
+    compare = COMPARISONS[comparison]
+    value = int(value, 0)
+    if name[0] == 'R':
+        register = int(name[1])
+        return lambda cpu: compare(cpu.REG[register], value)
+    if name[0] == '[':
+        address = int(name[1:-1], 16)
+        return lambda cpu: compare(cpu.RAM[address], value)
+    return lambda cpu: compare(getattr(cpu, name), value)
+
+
+def break_before(cpu, entry, points, address):
+    # Decoded entry for a breakpoint address: stop unless this is the
+    # instruction run() was stopped at, then run the wrapped entry.
+    if points.resume != address:
+        for test in points.breakpoints[address]:
+            if test is None or test(cpu):
+                points.resume = address
+                points.stop(Hit('break', address, None, None, None))
+    points.resume = None
+    handler, a, b, next_pc, _ = entry
+    return handler(cpu, a, b, next_pc)
+
+
+def watch_after(cpu, entry, points, address):
+    # Decoded entry for an instruction that may write something watched:
+    # run it, then stop if a watched value changed and its condition holds.
+    handler, a, b, next_pc, _ = entry
+    IR = cpu.RAM[address]
+    target = WRITES[IR](cpu, a, b) if IR in WRITES else None
+    old = cpu.RAM[target] if target is not None else None
+    before = bytes(cpu.REG)
+    pc = handler(cpu, a, b, next_pc)
+    points.resume = None
+    hit = None
+    if target in points.memory and cpu.RAM[target] != old:
+        test = points.memory[target]
+        if test is None or test(cpu):
+            hit = Hit('memory', address, target, old, cpu.RAM[target])
+    if hit is None:
+        REG = cpu.REG
+        for register, test in points.registers.items():
+            if REG[register] != before[register] and (test is None
+                                                      or test(cpu)):
+                hit = Hit('register', address, register, before[register],
+                          REG[register])
+                break
+    if hit is not None:
+        # the instruction has run: count it and move past it
+        cpu.PC = pc
+        cpu.cycles += 1
+        points.stop(hit)
+    return pc
+
+
+class Breakpoints:
+    """The breakpoints and watchpoints of one CPU."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.breakpoints = {} # address -> conditions, None for always
+        self.registers = {} # register -> condition or None
+        self.memory = {} # RAM address -> condition or None
+        self.hit = None # the last Hit
+        self.hits = 0
+        self.resume = None # breakpoint address to run past once
+        self.engines = None # (jit, fusion, loops) set aside while armed
+
+    def __bool__(self):
+        return bool(self.breakpoints or self.registers or self.memory)
+
+    def add(self, address, condition=None):
+        """Stop before the instruction at address, if condition(cpu)."""
+        self.breakpoints.setdefault(address, []).append(condition)
+        self.changed(address)
+
+    def remove(self, address):
+        """Remove every breakpoint at address."""
+        self.breakpoints.pop(address, None)
+        self.changed(address)
+
+    def watch_register(self, register, condition=None):
+        """Stop after an instruction changes register, if condition(cpu)."""
+        self.registers[register] = condition
+        self.changed()
+
+    def watch_memory(self, address, condition=None):
+        """Stop after an instruction changes RAM[address], if condition(cpu)."""
+        self.memory[address] = condition
+        self.changed()
+
+    def unwatch_register(self, register):
+        self.registers.pop(register, None)
+        self.changed()
+
+    def unwatch_memory(self, address):
+        self.memory.pop(address, None)
+        self.changed()
+
+    def clear(self):
+        """Remove every breakpoint and watchpoint."""
+        self.breakpoints.clear()
+        self.registers.clear()
+        self.memory.clear()
+        self.changed()
+
+    def changed(self, address=None):
+        # Arm or disarm the CPU and drop the decoded entries affected:
+        # just the one at address for a breakpoint, all of them otherwise
+        cpu = self.cpu
+        if self:
+            if cpu.breakpoints is None:
+                self.engines = (cpu.jit, cpu.fusion, cpu.loops)
+                cpu.jit = cpu.fusion = cpu.loops = None
+                cpu.breakpoints = self
+                cpu.decoded = None
+            elif address is not None and cpu.decoded is not None:
+                cpu.decoded[address] = None
+            else:
+                cpu.decoded = None
+        elif cpu.breakpoints is not None:
+            cpu.breakpoints = None
+            cpu.jit, cpu.fusion, cpu.loops = self.engines
+            self.engines = None
+            self.resume = None
+            cpu.invalidate_all()
+
+    def instrument(self, address, entry):
+        """Called by decode(): entry, wrapped if anything here is watched."""
+        IR = self.cpu.RAM[address]
+        if (IR in WRITES and self.memory) or (self.registers and (
+                IR == IRET or (IR == INT and 6 in self.registers)
+                or (IR in WRITES_A and entry[1] in self.registers))):
+            entry = (watch_after, entry, self, address, 1)
+        if address in self.breakpoints:
+            entry = (break_before, entry, self, address, 1)
+        return entry
+
+    def stop(self, hit):
+        self.hit = hit
+        self.hits += 1
+        raise BreakpointHit(hit)
+
+    def describe(self, hit=None):
+        """A line about hit, by default the last one."""
+        hit = hit or self.hit
+        if hit is None:
+            return "no breakpoint hit"
+        if hit.kind == 'break':
+            return f"breakpoint at {hit.pc:02X}"
+        name = f"R{hit.target}" if hit.kind == 'register' \
+            else f"[{hit.target:02X}]"
+        return (f"{name} changed from {hit.old:02X} to {hit.new:02X} "
+                f"at {hit.pc:02X}")
@@ -1,115 +1,333 @@
 """CPU functionality."""
 
+import mmap
 import sys
+import time
+from collections import namedtuple
+from itertools import repeat
 from os import path
 
-class CPU:
-    """Main CPU class."""
+from alu import TABLES, BINARY, UNARY
+from devices import STDOUT
+import image
+
+# Opcodes
+LDI = 0b10000010
+LD = 0b10000011
+PRN = 0b01000111
+MUL = 0b10100010
+ADD = 0b10100000
+ADDI = 0b10101110
+AND = 0b10101000
+CALL = 0b01010000
+CMP = 0b10100111
+DEC = 0b01100110
+DIV = 0b10100011
+HLT = 0b00000001
+INC = 0b01100101
+INT = 0b01010010
+IRET = 0b00010011
+JEQ = 0b01010101
+JGE = 0b01011010
+JGT = 0b01010111
+JLE = 0b01011001
+JLT = 0b01011000
+JMP = 0b01010100
+JNE = 0b01010110
+MOD = 0b10100100
+NOT = 0b01101001
+NOP = 0b00000000
+OR = 0b10101010
+POP = 0b01000110
+PRA = 0b01001000
+PUSH = 0b01000101
+RET = 0b00010001
+SHL = 0b10101100
+SHR = 0b10101101
+ST = 0b10000100
+SUB = 0b10100001
+XOR = 0b10101011
+
+# ALU operation names, by opcode
+ALU_NAMES = {
+    ADD: 'ADD',
+    ADDI: 'ADDI',
+    AND: 'AND',
+    CMP: 'CMP',
+    DEC: 'DEC',
+    DIV: 'DIV',
+    INC: 'INC',
+    MOD: 'MOD',
+    MUL: 'MUL',
+    NOT: 'NOT',
+    OR: 'OR',
+    SHL: 'SHL',
+    SHR: 'SHR',
+    SUB: 'SUB',
+    XOR: 'XOR',
+}
+
+# RAM cell each memory instruction reads or writes, from the state before
+# it runs
+READS = {
+    LD: lambda cpu, a, b: cpu.REG[b],
+    POP: lambda cpu, a, b: cpu.SP,
+    RET: lambda cpu, a, b: cpu.SP,
+}
+WRITES = {
+    ST: lambda cpu, a, b: cpu.REG[a],
+    PUSH: lambda cpu, a, b: (cpu.SP - 1) & 0xFF,
+    CALL: lambda cpu, a, b: (cpu.SP - 1) & 0xFF,
+}
+
+class CPUFault(Exception):
+    """
+    A fault raised by a running program. Carries the PC of the faulting
+    instruction and a copy of the registers, FL and SP at that point.
+    """
+
+    message = 'CPU fault'
+
+    def __init__(self, cpu, message=None, pc=None):
+        super().__init__(message or self.message)
+        self.pc = cpu.PC if pc is None else pc
+        self.registers = bytes(cpu.REG)
+        self.FL = cpu.FL
+        self.SP = cpu.SP
+
+
+class DivideByZero(CPUFault):
+    message = 'Cannot divide by 0.'
+
+
+class StackOverflow(CPUFault):
+    message = 'Stack overflow!'
+
+
+class StackUnderflow(CPUFault):
+    message = 'Stack is empty!'
+
+
+class UnknownInstruction(CPUFault):
+
+    def __init__(self, cpu, opcode, pc):
+        super().__init__(cpu, f'Unknown instruction {opcode} at address {pc}', pc)
+        self.opcode = opcode
+
+
+class BreakpointHit(Exception):
+    """
+    Raised from inside the run loop by a breakpoint or watchpoint (see
+    breakpoints.py) to end run(). Carries the breakpoints.Hit.
+    """
+
+    def __init__(self, hit):
+        super().__init__(hit)
+        self.hit = hit
+
+
+# What run() returns: whether the program halted, how many instructions this
+# call ran and where the PC ended up
+RunResult = namedtuple('RunResult', 'halted cycles pc')
+
 
-    def __init__(self):
-        """Construct a new CPU."""
-        self.RAM = [0] * 256
-        self.REG = [0] * 8
+class CPU:
+    """
+    Main CPU class.
+
+    RAM and the registers are bytearrays and the dispatch tables live on the
+    class, so an idle machine is small: about 590 bytes for the instance,
+    its RAM and its registers (see benchmarks/footprint.py). run() adds a
+    2 KiB decode table the first time it is called.
+    """
+
+    __slots__ = (
+        'RAM', 'REG', 'PC', 'IR', 'MAR', 'MDR', 'FL', 'SP',
+        'running', 'halted', 'cycles', 'alu_backend', 'operations',
+        'decoded', 'jit', 'fusion', 'loops', 'interrupts', 'output',
+        'base', 'dirty', 'breakpoints',
+    )
+
+    def __init__(self, jit=False, alu='table', output=None, fuse=False,
+                 fast_forward=False, interrupts=False):
+        """
+        Construct a new CPU. With jit=True, run() compiles basic blocks to
+        Python functions (see jit.py) instead of dispatching per instruction.
+        With fuse=True, run() dispatches common instruction sequences as a
+        single superinstruction (see fusion.py). With fast_forward=True,
+        run() skips straight to the end of simple counting loops (see
+        loops.py). With interrupts=True, run() takes interrupts from the
+        devices attached to cpu.interrupts (see interrupts.py); without it,
+        INT only sets the bit in IS.
+
+        alu picks the ALU behind run() and interpret(): 'table' looks every
+        result up in the precomputed tables from alu.py, 'bitwise' uses the
+        bitwise_* helpers.
+
+        output is the device PRN and PRA write to (see devices.py); by
+        default the BufferedOutput on stdout that every CPU shares.
+        """
+        self.RAM = bytearray(256)
+        self.REG = bytearray(8)
         self.PC = 0 # Program Counter
         self.IR = 0 # Instruction Register
         self.MAR = 0 # Memory Address Register
         self.MDR = 0 # Memory Data Register
         self.FL = 0
-        self.IM = 0
-        self.IS = 0
         self.SP = 0xF4  # 244
         self.running = False
-        self.instructions = {
-            0b10000010: self.handle_LDI,
-            0b10000011: self.handle_LD,
-            0b01000111: self.handle_PRN,
-            0b10100010: self.handle_MUL,
-            0b10100000: self.handle_ADD,
-            0b10101110: self.handle_ADDI,
-            0b10101000: self.handle_AND,
-            0b01010000: self.handle_CALL,            
-            0b10100111: self.handle_CMP,
-            0b01100110: self.handle_DEC,
-            0b10100011: self.handle_DIV,
-            0b00000001: self.handle_HLT,
-            0b01100101: self.handle_INC,
-            0b01010010: self.handle_INT,
-            0b01010101: self.handle_JEQ,
-            0b01011010: self.handle_JGE,
-            0b01010111: self.handle_JGT,
-            0b01011001: self.handle_JLE,
-            0b01011000: self.handle_JLT,
-            0b01010100: self.handle_JMP,
-            0b01010110: self.handle_JNE,
-            0b10100100: self.handle_MOD,
-            0b01101001: self.handle_NOT,
-            0b00000000: self.handle_NOP,
-            0b10101010: self.handle_OR,
-            0b01000110: self.handle_POP,
-            0b01001000: self.handle_PRA,
-            0b01000101: self.handle_PUSH,
-            0b00010001: self.handle_RET,
-            0b10101100: self.handle_SHL,
-            0b10101101: self.handle_SHR,
-            0b10000100: self.handle_ST,
-            0b10100001: self.handle_SUB,
-            0b10101011: self.handle_XOR,
-        }
-        self.alu_operations = {
-            'MUL': self.ALU_MUL,
-            'ADD': self.ALU_ADD,
-            'AND': self.ALU_AND,
-            'CMP': self.ALU_CMP,
-            'DEC': self.ALU_DEC,
-            'DIV': self.ALU_DIV,
-            'INC': self.ALU_INC,
-            'MOD': self.ALU_MOD,
-            'NOT': self.ALU_NOT,
-            'OR': self.ALU_OR,
-            'SHL': self.ALU_SHL,
-            'SHR': self.ALU_SHR,
-            'SUB': self.ALU_SUB,
-            'XOR': self.ALU_XOR,
-        }
-
-    def load(self):
-        """Load a program into memory."""
-
+        self.halted = False # set by HLT
+        self.cycles = 0 # instructions run so far
+        self.output = output if output is not None else STDOUT
+        self.alu_backend = alu
+        if alu == 'table':
+            self.operations = CPU.OPERATIONS
+        elif alu == 'bitwise':
+            self.operations = CPU.BITWISE_OPERATIONS
+        else:
+            raise ValueError(f"Unknown ALU {alu!r}")
+        # One (handler, operand_a, operand_b, next_pc, count) entry per
+        # address, allocated by run() and filled in lazily by decode()
+        self.decoded = None
+        self.jit = None
+        if jit:
+            from jit import JIT
+            self.jit = JIT(self)
+        self.fusion = None
+        if fuse:
+            from fusion import Fusion
+            self.fusion = Fusion(self)
+        self.loops = None
+        if fast_forward:
+            from loops import Loops
+            self.loops = Loops(self)
+        self.interrupts = None
+        if interrupts:
+            from interrupts import Interrupts
+            self.interrupts = Interrupts(self)
+        # The snapshot RAM last matched (see snapshot.py) and a bit per
+        # 16-byte page written since
+        self.base = None
+        self.dirty = 0
+        # The breakpoints.Breakpoints, while it has any points set
+        self.breakpoints = None
+
+    def reset(self):
+        """Power the CPU back on: clear RAM, registers and the caches."""
+        self.RAM[:] = bytes(256)
+        self.REG[:] = bytes(8)
+        self.PC = 0
+        self.IR = 0
         self.MAR = 0
+        self.MDR = 0
+        self.FL = 0
+        self.SP = 0xF4
+        self.running = False
+        self.halted = False
+        self.cycles = 0
+        self.invalidate_all()
+        if self.interrupts is not None:
+            self.interrupts.reset()
 
-        program = sys.argv[1]
-
+    def invalidate_all(self):
+        """
+        Forget every decoded instruction and compiled block. Call it after
+        changing RAM other than through ram_write().
+        """
+        self.decoded = None
+        self.base = None
+        if self.jit is not None:
+            from jit import JIT
+            self.jit = JIT(self)
+        if self.fusion is not None:
+            from fusion import Fusion
+            self.fusion = Fusion(self)
+        if self.loops is not None:
+            from loops import Loops
+            self.loops = Loops(self)
+
+    # The interrupt mask and status are R5 and R6, as in the spec, so
+    # programs set them with LDI like any other register
+    @property
+    def IM(self):
+        return self.REG[5]
+
+    @IM.setter
+    def IM(self, value):
+        self.REG[5] = value
+
+    @property
+    def IS(self):
+        return self.REG[6]
+
+    @IS.setter
+    def IS(self, value):
+        self.REG[6] = value
+
+    @property
+    def memory(self):
+        """RAM as a memoryview, for reading or patching it without copies."""
+        return memoryview(self.RAM)
+
+    @property
+    def registers(self):
+        """The registers as a memoryview."""
+        return memoryview(self.REG)
+
+    def load(self, program=None):
+        """Load a program into memory. program defaults to sys.argv[1]."""
+        if program is None:
+            program = sys.argv[1]
+        return self.load_file(program)
+
+    def load_file(self, program):
+        """
+        Load a text .ls8 file or a binary image into memory. Returns the
+        program's symbol table, if it has one.
+        """
+        if image.is_image(program):
+            return self.load_image(program)
         with open(program) as file:
-            for line in file:
-                line = line.split("#")
-                try:
-                    self.MDR = int(line[0], 2)
-                except ValueError:
-                    continue
-                self.ram_write(self.MDR, self.MAR)
-                self.MAR += 1
-        # For now, we've just hardcoded a program:
-
-        # program = [
-        #     # From print8.ls8
-        #     0b10000010, # LDI R0,8
-        #     0b00000000,
-        #     0b00001000,
-        #     0b01000111, # PRN R0
-        #     0b00000000,
-        #     0b00000001, # HLT
-        # ]
-
-        # while self.MAR < len(program):
-        #     self.MDR = program[self.MAR]
-        #     self.ram_write(self.MDR, self.MAR)
-        #     self.MAR += 1
+            parsed = image.parse_text(file)
+        self.load_bytes(parsed.code)
+        return parsed.symbols
 
+    def load_bytes(self, program, address=0):
+        """
+        Copy program (bytes or any buffer) into RAM at address and get
+        ready to run it from address 0. A halted CPU can run again after
+        loading a new program; registers, FL and SP are kept (reset()
+        clears them). Raises ValueError if program doesn't fit in RAM from
+        address.
+        """
+        if address < 0 or address + len(program) > 256:
+            raise ValueError(f"{len(program)} bytes at {address:02X} don't "
+                             f"fit in RAM")
+        self.RAM[address:address + len(program)] = program
+        self.invalidate_all()
+        self.PC = 0
+        self.halted = False
+
+    def load_image(self, program):
+        """
+        Load a binary image (see image.py): map the file and copy its code
+        straight into RAM, then start at its entry point.
+        """
+        with open(program, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                entry, load, length, symbols, offset = image.header(mapped)
+                self.RAM[load:load + length] = mapped[offset:offset + length]
+        self.invalidate_all()
+        self.PC = entry
+        self.halted = False
+        return symbols
 
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
-        if op in self.alu_operations:
-            self.alu_operations[op](reg_a, reg_b)
+        if self.alu_backend == 'table' and (op in BINARY or op in UNARY):
+            self.ALU_lookup(op, reg_a, reg_b)
+        elif op in self.alu_operations:
+            self.alu_operations[op](self, reg_a, reg_b)
         else:
             raise Exception("Unsupported ALU operation")
 
@@ -123,7 +341,8 @@ class CPU:
         if num2 <= 0:
             return num1
         else:
-            return self.bitwise_subtraction(num1 ^ num2, (~num1 & num2) << 1)
+            # borrows out of the top bit are dropped, as in an 8-bit register
+            return self.bitwise_subtraction(num1 ^ num2, ((~num1 & num2) << 1) & 0xFF)
 
     def bitwise_multiplication(self, num1, num2):
         product = 0
@@ -151,6 +370,23 @@ class CPU:
                 quotient |= 1 << i
         return sign * quotient
 
+    def ALU_lookup(self, op, reg_a, reg_b):
+        """Run an ALU operation as a single table lookup."""
+        self.MAR = self.ram_read(reg_a)
+        if op in UNARY:
+            self.REG[self.MAR] = TABLES[op][self.REG[self.MAR]]
+            return
+        self.MDR = self.REG[self.ram_read(reg_b)]
+        if self.MDR == 0 and op == 'DIV':
+            raise DivideByZero(self)
+        if self.MDR == 0 and op == 'MOD':
+            raise DivideByZero(self, 'Cannot MOD by 0.')
+        self.MDR = TABLES[op][self.REG[self.MAR] << 8 | self.MDR]
+        if op == 'CMP':
+            self.FL = self.MDR
+        else:
+            self.REG[self.MAR] = self.MDR
+
     def ALU_ADD(self, reg_a, reg_b):
         self.MAR = self.ram_read(reg_b)
         self.MDR = self.REG[self.MAR]
@@ -204,8 +440,7 @@ class CPU:
         self.MAR = self.ram_read(reg_b)
         self.MDR = self.REG[self.MAR]
         if self.MDR == 0:
-            print('Cannot divide by 0.')
-            sys.exit(1)
+            raise DivideByZero(self)
         self.MAR = self.ram_read(reg_a)
         self.MDR = self.bitwise_division(self.REG[self.MAR], self.MDR)
         self.MDR = self.MDR & 0xFF # keep values under maximum (255)
@@ -215,8 +450,7 @@ class CPU:
         self.MAR = self.ram_read(reg_b)
         self.MDR = self.REG[self.MAR]
         if self.MDR == 0:
-            print('Cannot MOD by 0.')
-            sys.exit(1)
+            raise DivideByZero(self, 'Cannot MOD by 0.')
         self.MAR = self.ram_read(reg_a)
         self.MDR = self.REG[self.MAR] % self.MDR # floor division?
         self.MDR = self.MDR & 0xFF # keep values under maximum (255)
@@ -234,6 +468,7 @@ class CPU:
         self.MAR = self.ram_read(reg)
         self.MDR = self.REG[self.MAR]
         self.MDR = ~self.MDR
+        self.MDR = self.MDR & 0xFF # keep values under maximum (255)
         self.REG[self.MAR] = self.MDR
 
     def ALU_OR(self, reg_a, reg_b):
@@ -294,20 +529,228 @@ class CPU:
 
         print()
 
-    def run(self):
-        """Run the CPU."""
+    def decode(self, address, fuse=True):
+        """
+        Decode the instruction at address into a (handler, operand_a,
+        operand_b, next_pc, count) entry and cache it for run(). count is
+        the number of instructions the entry runs: 1, or more for a fused
+        sequence. With fuse=False the plain entry is returned and not
+        cached.
+        """
+        if self.SP <= address + 1:
+            raise StackOverflow(self, pc=address)
+        if self.decoded is None:
+            self.decoded = [None] * 256
+        IR = self.RAM[address]
+        if IR not in self.operations:
+            raise UnknownInstruction(self, IR, address)
+        entry = (
+            self.operations[IR],
+            self.RAM[(address + 1) & 0xFF],
+            self.RAM[(address + 2) & 0xFF],
+            (address + ((IR & 0b11000000) >> 6) + 1) & 0xFF,
+            1,
+        )
+        if not fuse:
+            return entry
+        loop = self.loops.find(address) if self.loops is not None else None
+        if loop is not None:
+            from loops import enter_loop
+            entry = (enter_loop, loop, None, address, 0)
+        elif self.fusion is not None:
+            entry = self.fusion.fuse(address, entry)
+        if self.breakpoints is not None:
+            entry = self.breakpoints.instrument(address, entry)
+        self.decoded[address] = entry
+        return entry
+
+    def run(self, max_cycles=None, profile=None, trace=None):
+        """
+        Run the program until HLT or until max_cycles instructions have run,
+        and return a RunResult. Faults are raised as CPUFault subclasses.
+        Once the program has halted this does nothing until reset() or the
+        next load. It also returns at a breakpoint or watchpoint, leaving
+        the hit in cpu.breakpoints.hit.
+
+        profile, a profiler.Profiler, runs the program through the
+        profiler's own loop and collects its counts; trace, a
+        recorder.Recorder, records every instruction the same way. Neither
+        takes interrupts.
+        """
+        before = self.cycles
+        if self.halted:
+            return RunResult(True, 0, self.PC)
+        if profile is not None:
+            return profile.run(self, max_cycles)
+        if trace is not None:
+            return trace.run(self, max_cycles)
+        try:
+            if self.interrupts is not None:
+                self.interrupts.run(max_cycles)
+            else:
+                self.run_slice(max_cycles)
+        except BreakpointHit:
+            pass
+        finally:
+            self.output.flush()
+        return RunResult(self.halted, self.cycles - before, self.PC)
+
+    def run_slice(self, max_cycles=None):
+        """
+        The body of run(): run on the JIT or the decode table until HLT,
+        until max_cycles instructions have run or until an interrupt is
+        raised.
+        """
+        if self.jit is not None:
+            self.jit.run(max_cycles)
+            return
+        before = self.cycles
+        self.execute(max_cycles)
+        # execute() stops at the head of a loop it can skip
+        while self.loops is not None and self.loops.pending:
+            if max_cycles is None:
+                self.loops.fast_forward()
+                self.execute()
+            else:
+                left = max_cycles - (self.cycles - before)
+                self.loops.fast_forward(left)
+                self.execute(max_cycles - (self.cycles - before))
+
+    def step(self):
+        """Run a single instruction, unless the program has halted."""
+        return self.run_for(1)
+
+    def run_for(self, cycles):
+        """
+        Run at most cycles instructions and return a RunResult. The CPU can
+        be resumed with another call.
+        """
+        return self.run(cycles)
+
+    def run_until(self, predicate=None, deadline=None, every=1):
+        """
+        Run until HLT, until predicate(cpu) is true, or until
+        time.monotonic() passes deadline. Both are checked every `every`
+        instructions; raise it to make the checks cheaper.
+        """
+        before = self.cycles
+        while not self.halted:
+            if predicate is not None and predicate(self):
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.run_for(every)
+        return RunResult(self.halted, self.cycles - before, self.PC)
+
+    def snapshot(self):
+        """
+        Capture the machine's state as an immutable snapshot.Snapshot, to
+        hand to restore() or save to disk.
+        """
+        from snapshot import take
+        return take(self)
+
+    def restore(self, snapshot):
+        """Put the machine back in the state of a snapshot."""
+        from snapshot import restore
+        restore(self, snapshot)
+
+    def fork(self, output=None):
+        """
+        A new CPU, configured like this one, that carries on from this
+        one's current state. It shares output unless given its own.
+        """
+        from snapshot import fork
+        return fork(self, output)
+
+    async def run_async(self, max_cycles=None, every=10000):
+        """
+        Coroutine version of run(): runs `every` instructions at a time and
+        yields to the event loop in between, so other machines and the
+        readers in aio.py get a turn. Returns a RunResult.
+        """
+        import asyncio
+        before = self.cycles
+        while not self.halted:
+            cycles = every
+            if max_cycles is not None:
+                cycles = min(every, max_cycles - (self.cycles - before))
+                if cycles <= 0:
+                    break
+            self.run(cycles)
+            await asyncio.sleep(0)
+        return RunResult(self.halted, self.cycles - before, self.PC)
+
+    def execute(self, max_cycles=None):
+        """
+        Run the CPU using the pre-decoded instruction table, until HLT or
+        until max_cycles instructions have run. running is still True
+        afterwards if the budget ran out first.
+
+        Each address is decoded once; after that a cycle is a single list
+        index and handler call. The stack overflow check is done in decode()
+        and in the handlers that move SP: every push goes through
+        ram_write(), which drops the cached entries around the written
+        byte, so an address the stack has grown into is always re-decoded
+        (and re-checked) before it can run.
+
+        A fused entry runs several instructions at once, so near the end of
+        a budget the last few are run on the plain handlers instead.
+
+        A device raising an interrupt clears running, which is all it takes
+        to stop here; the flag is looked at again after setting running in
+        case the device got in first.
+        """
         self.running = True
-        while self.running:
-            if self.SP <= self.PC + 1:
-                print('Stack overflow!')
-                sys.exit(1)
-            self.IR = self.ram_read(self.PC)
-            if self.IR in self.instructions:
-                num_operations = ((self.IR & 0b11000000) >> 6) + 1
-                self.instructions[self.IR](num_operations)
+        if self.interrupts is not None and self.interrupts.raised:
+            self.running = False
+        if self.decoded is None:
+            self.decoded = [None] * 256
+        decoded = self.decoded
+        decode = self.decode
+        cycles = 0
+        try:
+            if max_cycles is None:
+                while self.running:
+                    handler, a, b, next_pc, count = (decoded[self.PC]
+                                                     or decode(self.PC))
+                    self.PC = handler(self, a, b, next_pc)
+                    cycles += count
+            elif self.fusion is None:
+                # every entry is one instruction, or stops the loop
+                for _ in repeat(None, max_cycles):
+                    if not self.running:
+                        break
+                    handler, a, b, next_pc, count = (decoded[self.PC]
+                                                     or decode(self.PC))
+                    self.PC = handler(self, a, b, next_pc)
+                    cycles += count
             else:
-                print(f'Unknown instruction {self.IR} at address {self.PC}')
-                sys.exit(1)
+                while self.running and cycles < max_cycles:
+                    handler, a, b, next_pc, count = (decoded[self.PC]
+                                                     or decode(self.PC))
+                    if count > max_cycles - cycles:
+                        handler, a, b, next_pc, count = decode(self.PC, False)
+                    self.PC = handler(self, a, b, next_pc)
+                    cycles += count
+        finally:
+            self.cycles += cycles
+
+    def interpret(self):
+        """Run the CPU one ram_read() and dispatch at a time."""
+        self.running = True
+        try:
+            while self.running:
+                if self.SP <= self.PC + 1:
+                    raise StackOverflow(self)
+                self.IR = self.ram_read(self.PC)
+                if self.IR in self.instructions:
+                    num_operations = ((self.IR & 0b11000000) >> 6) + 1
+                    self.instructions[self.IR](self, num_operations)
+                else:
+                    raise UnknownInstruction(self, self.IR, self.PC)
+        finally:
+            self.output.flush()
 
     def handle_LDI(self, ops):
         self.MAR = self.ram_read(self.PC + 1)
@@ -316,21 +759,22 @@ class CPU:
         self.PC = self.bitwise_addition(self.PC, ops)
 
     def handle_LD(self, ops):
-        self.MAR = self.REG[self.PC + 2]
+        self.MAR = self.REG[self.ram_read(self.PC + 2)]
         self.MDR = self.ram_read(self.MAR)
-        self.MAR = self.PC + 1
+        self.MAR = self.ram_read(self.PC + 1)
         self.REG[self.MAR] = self.MDR
+        self.PC = self.bitwise_addition(self.PC, ops)
 
     def handle_PRN(self, ops):
         self.MAR = self.ram_read(self.PC + 1)
-        print(self.REG[self.MAR])
+        self.output.prn(self.REG[self.MAR])
         self.PC = self.bitwise_addition(self.PC, ops)
 
     def handle_PRA(self, ops):
         self.MAR = self.ram_read(self.PC + 1)
         self.MDR = self.REG[self.MAR]
         # convert ascii to character and print
-        print(chr(self.MDR))
+        self.output.pra(self.MDR)
         self.PC = self.bitwise_addition(self.PC, ops)
 
     def handle_MUL(self, ops):
@@ -354,8 +798,7 @@ class CPU:
         # push address of next instruction to stack
         self.SP = self.bitwise_subtraction(self.SP, 1)
         if self.SP == self.PC:
-            print(f'Stack overflow!')
-            sys.exit(1)
+            raise StackOverflow(self)
         self.ram_write(self.MAR, self.SP)
         # set PC to address in given register
         self.MAR = self.ram_read(self.PC + 1)
@@ -377,7 +820,20 @@ class CPU:
         #get interrupt number from register
         self.MAR = self.PC + 1
         self.MDR = self.ram_read(self.MAR) # this is the reg number
-        self.IS = self.REG[self.MDR]
+        self.IS |= 1 << (self.REG[self.MDR] & 7)
+        self.PC = self.bitwise_addition(self.PC, ops)
+
+    def handle_IRET(self, ops):
+        # pop R6-R0, FL and the return address pushed by the interrupt
+        if self.SP > 0xF4 - 9:
+            raise StackUnderflow(self)
+        for register in range(6, -1, -1):
+            self.REG[register] = self.ram_read(self.SP)
+            self.SP = self.bitwise_addition(self.SP, 1)
+        self.FL = self.ram_read(self.SP)
+        self.SP = self.bitwise_addition(self.SP, 1)
+        self.PC = self.ram_read(self.SP)
+        self.SP = self.bitwise_addition(self.SP, 1)
 
     def handle_JEQ(self, ops):
         if self.FL == 1:
@@ -448,8 +904,7 @@ class CPU:
     def handle_POP(self, ops):
         # get value at current SP
         if self.SP == 0xF4:
-            print('Stack is empty!')
-            sys.exit(1)
+            raise StackUnderflow(self)
         self.MAR = self.SP
         self.MDR = self.ram_read(self.MAR)
         self.MAR = self.PC + 1
@@ -463,8 +918,7 @@ class CPU:
         # decrement Stack pointer
         self.SP = self.bitwise_subtraction(self.SP, 1)
         if self.SP <= self.PC + 1:
-            print('Stack overflow!')
-            sys.exit(1)
+            raise StackOverflow(self)
         # add value to stack
         self.MAR = self.ram_read(self.PC + 1)
         self.MDR = self.REG[self.MAR]
@@ -475,8 +929,7 @@ class CPU:
     def handle_RET(self, ops):
         # Pop the value from the top of the stack and store it in the `PC`.
         if self.SP == 0xF4:
-            print('Stack is empty!')
-            sys.exit(1)
+            raise StackUnderflow(self)
         self.PC = self.ram_read(self.SP)
         self.SP = self.bitwise_addition(self.SP, 1)
 
@@ -494,7 +947,7 @@ class CPU:
         self.MDR = self.ram_read(self.MAR)
         self.MDR = self.REG[self.MDR]
         # get address from register a
-        self.MAR = self.REG[self.PC + 1]
+        self.MAR = self.REG[self.ram_read(self.PC + 1)]
         self.ram_write(self.MDR, self.MAR)
         self.PC = self.bitwise_addition(self.PC, ops)
 
@@ -508,10 +961,300 @@ class CPU:
 
     def handle_HLT(self, ops):
         self.running = False
+        self.halted = True
         self.PC = self.bitwise_addition(self.PC, ops)
 
+    # Pre-decoded handlers. Each one gets its operand bytes and the address
+    # of the next instruction from decode() and returns the new PC.
+
+    def exec_LDI(self, a, b, next_pc):
+        self.REG[a] = b
+        return next_pc
+
+    def exec_LD(self, a, b, next_pc):
+        self.REG[a] = self.RAM[self.REG[b]]
+        return next_pc
+
+    def exec_ST(self, a, b, next_pc):
+        self.ram_write(self.REG[b], self.REG[a])
+        return next_pc
+
+    def exec_PRN(self, a, b, next_pc):
+        self.output.prn(self.REG[a])
+        return next_pc
+
+    def exec_PRA(self, a, b, next_pc):
+        self.output.pra(self.REG[a])
+        return next_pc
+
+    def exec_ADD(self, a, b, next_pc):
+        self.REG[a] = TABLES.ADD[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_ADDI(self, a, b, next_pc):
+        self.REG[a] = TABLES.ADD[self.REG[a] << 8 | b]
+        return next_pc
+
+    def exec_SUB(self, a, b, next_pc):
+        self.REG[a] = TABLES.SUB[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_MUL(self, a, b, next_pc):
+        self.REG[a] = TABLES.MUL[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_DIV(self, a, b, next_pc):
+        if self.REG[b] == 0:
+            raise DivideByZero(self)
+        self.REG[a] = TABLES.DIV[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_MOD(self, a, b, next_pc):
+        if self.REG[b] == 0:
+            raise DivideByZero(self, 'Cannot MOD by 0.')
+        self.REG[a] = TABLES.MOD[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_AND(self, a, b, next_pc):
+        self.REG[a] = TABLES.AND[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_OR(self, a, b, next_pc):
+        self.REG[a] = TABLES.OR[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_XOR(self, a, b, next_pc):
+        self.REG[a] = TABLES.XOR[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_NOT(self, a, b, next_pc):
+        self.REG[a] = TABLES.NOT[self.REG[a]]
+        return next_pc
+
+    def exec_SHL(self, a, b, next_pc):
+        self.REG[a] = TABLES.SHL[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_SHR(self, a, b, next_pc):
+        self.REG[a] = TABLES.SHR[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_INC(self, a, b, next_pc):
+        self.REG[a] = TABLES.INC[self.REG[a]]
+        return next_pc
+
+    def exec_DEC(self, a, b, next_pc):
+        self.REG[a] = TABLES.DEC[self.REG[a]]
+        return next_pc
+
+    def exec_CMP(self, a, b, next_pc):
+        self.FL = TABLES.CMP[self.REG[a] << 8 | self.REG[b]]
+        return next_pc
+
+    def exec_bitwise(self, a, b, next_pc):
+        # any ALU opcode, run through alu() and the bitwise_* helpers
+        self.alu(ALU_NAMES[self.RAM[self.PC]], self.PC + 1, self.PC + 2)
+        return next_pc
+
+    def exec_JMP(self, a, b, next_pc):
+        return self.REG[a]
+
+    def exec_JEQ(self, a, b, next_pc):
+        if self.FL == 1:
+            return self.REG[a]
+        return next_pc
+
+    def exec_JNE(self, a, b, next_pc):
+        if self.FL != 1:
+            return self.REG[a]
+        return next_pc
+
+    def exec_JGT(self, a, b, next_pc):
+        if self.FL == 2:
+            return self.REG[a]
+        return next_pc
+
+    def exec_JGE(self, a, b, next_pc):
+        if self.FL == 2 or self.FL == 1:
+            return self.REG[a]
+        return next_pc
+
+    def exec_JLT(self, a, b, next_pc):
+        if self.FL == 4:
+            return self.REG[a]
+        return next_pc
+
+    def exec_JLE(self, a, b, next_pc):
+        if self.FL == 4 or self.FL == 1:
+            return self.REG[a]
+        return next_pc
+
+    def exec_CALL(self, a, b, next_pc):
+        self.SP -= 1
+        if self.SP == self.PC:
+            raise StackOverflow(self)
+        self.ram_write(next_pc, self.SP)
+        return self.REG[a]
+
+    def exec_RET(self, a, b, next_pc):
+        if self.SP == 0xF4:
+            raise StackUnderflow(self)
+        pc = self.RAM[self.SP]
+        self.SP += 1
+        return pc
+
+    def exec_PUSH(self, a, b, next_pc):
+        self.SP -= 1
+        if self.SP <= self.PC + 1:
+            raise StackOverflow(self)
+        self.ram_write(self.REG[a], self.SP)
+        return next_pc
+
+    def exec_POP(self, a, b, next_pc):
+        if self.SP == 0xF4:
+            raise StackUnderflow(self)
+        self.REG[a] = self.RAM[self.SP]
+        self.SP += 1
+        return next_pc
+
+    def exec_INT(self, a, b, next_pc):
+        line = self.REG[a] & 7
+        self.REG[6] |= 1 << line
+        if self.interrupts is not None:
+            self.interrupts.signal(line)
+        return next_pc
+
+    def exec_IRET(self, a, b, next_pc):
+        if self.SP > 0xF4 - 9:
+            raise StackUnderflow(self)
+        RAM = self.RAM
+        SP = self.SP
+        self.REG[:7] = RAM[SP:SP + 7][::-1]
+        self.FL = RAM[SP + 7]
+        self.SP = SP + 9
+        if self.interrupts is not None:
+            self.interrupts.resume()
+        return RAM[SP + 8]
+
+    def exec_NOP(self, a, b, next_pc):
+        return next_pc
+
+    def exec_HLT(self, a, b, next_pc):
+        self.running = False
+        self.halted = True
+        return next_pc
+
     def ram_read(self, memory_address):
         return self.RAM[memory_address]
 
     def ram_write(self, memory_data, memory_address):
         self.RAM[memory_address] = memory_data
+        self.dirty |= 1 << (memory_address >> 4)
+        # forget any decoded instruction that covers this byte
+        decoded = self.decoded
+        if decoded is not None:
+            decoded[memory_address] = None
+            decoded[memory_address - 1] = None
+            decoded[memory_address - 2] = None
+        if self.jit is not None:
+            self.jit.invalidate(memory_address)
+        if self.fusion is not None and self.fusion.cover[memory_address]:
+            self.fusion.disable()
+
+    # Dispatch tables, shared by every instance
+    instructions = {
+        LDI: handle_LDI,
+        LD: handle_LD,
+        PRN: handle_PRN,
+        MUL: handle_MUL,
+        ADD: handle_ADD,
+        ADDI: handle_ADDI,
+        AND: handle_AND,
+        CALL: handle_CALL,
+        CMP: handle_CMP,
+        DEC: handle_DEC,
+        DIV: handle_DIV,
+        HLT: handle_HLT,
+        INC: handle_INC,
+        INT: handle_INT,
+        IRET: handle_IRET,
+        JEQ: handle_JEQ,
+        JGE: handle_JGE,
+        JGT: handle_JGT,
+        JLE: handle_JLE,
+        JLT: handle_JLT,
+        JMP: handle_JMP,
+        JNE: handle_JNE,
+        MOD: handle_MOD,
+        NOT: handle_NOT,
+        NOP: handle_NOP,
+        OR: handle_OR,
+        POP: handle_POP,
+        PRA: handle_PRA,
+        PUSH: handle_PUSH,
+        RET: handle_RET,
+        SHL: handle_SHL,
+        SHR: handle_SHR,
+        ST: handle_ST,
+        SUB: handle_SUB,
+        XOR: handle_XOR,
+    }
+    alu_operations = {
+        'MUL': ALU_MUL,
+        'ADD': ALU_ADD,
+        'ADDI': ALU_ADDI,
+        'AND': ALU_AND,
+        'CMP': ALU_CMP,
+        'DEC': ALU_DEC,
+        'DIV': ALU_DIV,
+        'INC': ALU_INC,
+        'MOD': ALU_MOD,
+        'NOT': ALU_NOT,
+        'OR': ALU_OR,
+        'SHL': ALU_SHL,
+        'SHR': ALU_SHR,
+        'SUB': ALU_SUB,
+        'XOR': ALU_XOR,
+    }
+    # Pre-decoded instruction handlers, used by run()
+    OPERATIONS = {
+        LDI: exec_LDI,
+        LD: exec_LD,
+        PRN: exec_PRN,
+        MUL: exec_MUL,
+        ADD: exec_ADD,
+        ADDI: exec_ADDI,
+        AND: exec_AND,
+        CALL: exec_CALL,
+        CMP: exec_CMP,
+        DEC: exec_DEC,
+        DIV: exec_DIV,
+        HLT: exec_HLT,
+        INC: exec_INC,
+        INT: exec_INT,
+        IRET: exec_IRET,
+        JEQ: exec_JEQ,
+        JGE: exec_JGE,
+        JGT: exec_JGT,
+        JLE: exec_JLE,
+        JLT: exec_JLT,
+        JMP: exec_JMP,
+        JNE: exec_JNE,
+        MOD: exec_MOD,
+        NOT: exec_NOT,
+        NOP: exec_NOP,
+        OR: exec_OR,
+        POP: exec_POP,
+        PRA: exec_PRA,
+        PUSH: exec_PUSH,
+        RET: exec_RET,
+        SHL: exec_SHL,
+        SHR: exec_SHR,
+        ST: exec_ST,
+        SUB: exec_SUB,
+        XOR: exec_XOR,
+    }
+    BITWISE_OPERATIONS = dict(OPERATIONS)
+    for opcode in ALU_NAMES:
+        BITWISE_OPERATIONS[opcode] = exec_bitwise
+    del opcode
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+Reverse-execution debugger for the LS-8 CPU.
+
+    debugger = Debugger(cpu)
+    debugger.breakpoints.add(0x1A)
+    debugger.run() # forward to the breakpoint, HLT or a fault
+    debugger.reverse_step() # one instruction back
+    debugger.goto(1000) # the machine as it was after 1000 instructions
+
+The debugger runs the program one instruction at a time on the plain
+handlers, and before each one appends an undo record to a journal: PC, FL
+and SP, the register the instruction changed and its old value, and the
+RAM byte it wrote and its old value (RECORD.size bytes in all). Undoing
+the last record puts the machine back one instruction. Instructions that
+change several registers (IRET) keep the old registers on the side.
+
+Every interval instructions the journal starts a new segment with a full
+snapshot of the machine (see snapshot.py). goto() restores the nearest
+snapshot at or before the cycle it is asked for and runs forward from
+there, or steps back if that is shorter, so it takes time in proportion
+to the distance from a checkpoint rather than from the start. Once the
+journal holds more than budget bytes, whole segments are dropped from the
+oldest end when the next one starts; the earliest cycle still reachable
+is `earliest`.
+
+Output already printed isn't taken back, and interrupts aren't taken
+while debugging.
+
+Usage: debugger.py program.ls8
+
+Commands: s/step [n], c/continue, rs/reverse-step [n],
+rc/reverse-continue, b/break ADDR, d/delete ADDR, g/goto CYCLE, i/info,
+q/quit. Addresses are hex.
+"""
+
+import struct
+import sys
+from collections import deque
+
+from cpu import *
+from snapshot import HEADER
+
+# Undo record: PC, FL, SP, flags, register, its old value, the RAM address
+# written and its old value
+RECORD = struct.Struct("<8B")
+
+# Record flags
+REGISTER = 1 # one register changed
+MEMORY = 2 # one RAM byte written
+REGISTERS = 4 # several registers changed; old ones kept in overflow
+
+# Approximate size of a checkpoint, for the budget
+CHECKPOINT_SIZE = HEADER.size + 8 + 256
+
+
+class Segment:
+    """A checkpoint and the undo records of the instructions after it."""
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.start = checkpoint.cycles
+        self.journal = bytearray()
+        self.overflow = {} # record number -> old registers
+
+    def size(self):
+        return CHECKPOINT_SIZE + len(self.journal) + 8 * len(self.overflow)
+
+
+class Debugger:
+    """Forward and reverse execution of one CPU."""
+
+    def __init__(self, cpu, interval=4096, budget=1 << 20):
+        self.cpu = cpu
+        self.interval = interval # instructions between checkpoints
+        self.budget = budget # bytes of journal and checkpoints to keep
+        self.breakpoints = set()
+        self.segments = deque()
+        self.evicted = 0 # segments dropped to stay in budget
+        self.checkpoint()
+
+    @property
+    def earliest(self):
+        """The first cycle the debugger can still go back to."""
+        return self.segments[0].start
+
+    def size(self):
+        """Bytes held in journals and checkpoints."""
+        return sum(segment.size() for segment in self.segments)
+
+    def checkpoint(self):
+        """Start a new segment at the current state."""
+        self.segments.append(Segment(self.cpu.snapshot()))
+        total = self.size()
+        while total > self.budget and len(self.segments) > 1:
+            total -= self.segments.popleft().size()
+            self.evicted += 1
+
+    def step(self, count=1):
+        """
+        Run up to count instructions forward, journaling each one. Stops
+        early at HLT. A fault is raised with the machine left as it was
+        before the faulting instruction. Returns the number run.
+        """
+        cpu = self.cpu
+        RAM = cpu.RAM
+        REG = cpu.REG
+        pack = RECORD.pack
+        ran = 0
+        while ran < count and not cpu.halted:
+            segment = self.segments[-1]
+            if cpu.cycles - segment.start >= self.interval:
+                self.checkpoint()
+                segment = self.segments[-1]
+            pc = cpu.PC
+            FL = cpu.FL
+            SP = cpu.SP
+            before = bytes(REG)
+            try:
+                handler, a, b, next_pc, _ = cpu.decode(pc, False)
+                IR = RAM[pc]
+                address = WRITES[IR](cpu, a, b) if IR in WRITES else None
+                old = RAM[address] if address is not None else 0
+                cpu.PC = handler(cpu, a, b, next_pc)
+            except Exception:
+                # handlers can move SP before they fault
+                cpu.PC = pc
+                cpu.FL = FL
+                cpu.SP = SP
+                REG[:] = before
+                raise
+            flags = 0
+            register = value = 0
+            if address is not None:
+                flags = MEMORY
+            if REG != before:
+                changed = [n for n in range(8) if REG[n] != before[n]]
+                if len(changed) == 1:
+                    flags |= REGISTER
+                    register = changed[0]
+                    value = before[register]
+                else:
+                    flags |= REGISTERS
+                    segment.overflow[len(segment.journal) // RECORD.size] = before
+            segment.journal += pack(pc, FL, SP, flags, register, value,
+                                    address or 0, old)
+            cpu.cycles += 1
+            ran += 1
+        return ran
+
+    def run(self, max_cycles=None):
+        """
+        Step forward until a breakpoint, HLT or max_cycles instructions.
+        Returns the number run.
+        """
+        cpu = self.cpu
+        breakpoints = self.breakpoints
+        ran = 0
+        while not cpu.halted and ran != max_cycles:
+            ran += self.step()
+            if cpu.PC in breakpoints:
+                break
+        return ran
+
+    def reverse_step(self, count=1):
+        """
+        Undo up to count instructions. Stops early at the earliest cycle
+        still journaled. Returns the number undone.
+        """
+        cpu = self.cpu
+        REG = cpu.REG
+        size = RECORD.size
+        undone = 0
+        while undone < count:
+            segment = self.segments[-1]
+            if not segment.journal:
+                if len(self.segments) == 1:
+                    break
+                # at the checkpoint: carry on in the segment before
+                self.segments.pop()
+                continue
+            record = len(segment.journal) - size
+            pc, FL, SP, flags, register, value, address, old = \
+                RECORD.unpack_from(segment.journal, record)
+            del segment.journal[record:]
+            if flags & MEMORY:
+                cpu.ram_write(old, address)
+            if flags & REGISTER:
+                REG[register] = value
+            elif flags & REGISTERS:
+                REG[:] = segment.overflow.pop(record // size)
+            cpu.PC = pc
+            cpu.FL = FL
+            cpu.SP = SP
+            cpu.halted = False
+            cpu.cycles -= 1
+            undone += 1
+        return undone
+
+    def reverse_continue(self):
+        """
+        Step back until a breakpoint or the earliest journaled cycle.
+        Returns the number of instructions undone.
+        """
+        breakpoints = self.breakpoints
+        undone = 0
+        while self.reverse_step():
+            undone += 1
+            if self.cpu.PC in breakpoints:
+                break
+        return undone
+
+    def goto(self, cycle):
+        """Put the machine in its state after cycle instructions."""
+        cpu = self.cpu
+        if cycle < self.earliest:
+            raise ValueError(f"cycle {cycle} is before the earliest one kept "
+                             f"({self.earliest})")
+        if cycle >= cpu.cycles:
+            self.step(cycle - cpu.cycles)
+            return
+        start = max(segment.start for segment in self.segments
+                    if segment.start <= cycle)
+        if cpu.cycles - cycle <= cycle - start:
+            self.reverse_step(cpu.cycles - cycle)
+            return
+        while self.segments[-1].start > cycle:
+            self.segments.pop()
+        segment = self.segments[-1]
+        cpu.restore(segment.checkpoint)
+        segment.journal.clear()
+        segment.overflow.clear()
+        self.step(cycle - segment.start)
+
+    def info(self):
+        """A line about the journal."""
+        return (f"cycle {self.cpu.cycles}, earliest {self.earliest}, "
+                f"{len(self.segments)} segments, {self.size()} bytes, "
+                f"{self.evicted} evicted")
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: debugger.py program.ls8", file=sys.stderr)
+        return 1
+    cpu = CPU()
+    cpu.load_file(argv[1])
+    debugger = Debugger(cpu)
+    cpu.trace()
+    for line in sys.stdin:
+        words = line.split()
+        if not words:
+            continue
+        command, args = words[0], words[1:]
+        try:
+            if command in ('s', 'step'):
+                debugger.step(int(args[0]) if args else 1)
+            elif command in ('c', 'continue'):
+                debugger.run()
+            elif command in ('rs', 'reverse-step'):
+                debugger.reverse_step(int(args[0]) if args else 1)
+            elif command in ('rc', 'reverse-continue'):
+                debugger.reverse_continue()
+            elif command in ('b', 'break'):
+                debugger.breakpoints.add(int(args[0], 16))
+            elif command in ('d', 'delete'):
+                debugger.breakpoints.discard(int(args[0], 16))
+            elif command in ('g', 'goto'):
+                debugger.goto(int(args[0]))
+            elif command in ('i', 'info'):
+                print(debugger.info())
+            elif command in ('q', 'quit'):
+                break
+            else:
+                print(f"unknown command {command}")
+                continue
+        except CPUFault as fault:
+            print(fault)
+        except (ValueError, IndexError) as error:
+            print(error)
+        cpu.output.flush()
+        cpu.trace()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+"""Output devices for PRN and PRA."""
+
+import sys
+
+# Text for every byte value, computed once
+NUMBERS = tuple(f"{value}\n" for value in range(256))
+CHARACTERS = tuple(chr(value) + "\n" for value in range(256))
+RAW_CHARACTERS = tuple(chr(value) for value in range(256))
+
+
+class BufferedOutput:
+    """
+    Collects PRN/PRA text and writes it to a stream in one go: when
+    threshold writes are pending, and whenever the CPU halts or faults.
+
+    With raw=True, PRA prints the bare character without a newline, so a
+    string comes out as one line of text. stream defaults to whatever
+    sys.stdout is at flush time.
+    """
+
+    def __init__(self, stream=None, threshold=4096, raw=False):
+        self.stream = stream
+        self.threshold = threshold
+        self.characters = RAW_CHARACTERS if raw else CHARACTERS
+        self.pending = []
+
+    def prn(self, value):
+        self.pending.append(NUMBERS[value])
+        if len(self.pending) >= self.threshold:
+            self.flush()
+
+    def pra(self, value):
+        self.pending.append(self.characters[value])
+        if len(self.pending) >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self.pending))
+            stream.flush()
+            self.pending.clear()
+
+
+# The default device, shared by every CPU that isn't given one of its own so
+# an idle machine doesn't carry a buffer around
+STDOUT = BufferedOutput()
+
+
+class CaptureOutput:
+    """Keeps everything printed in memory, for batch runs and tests."""
+
+    def __init__(self, raw=False):
+        self.characters = RAW_CHARACTERS if raw else CHARACTERS
+        self.pending = []
+
+    def prn(self, value):
+        self.pending.append(NUMBERS[value])
+
+    def pra(self, value):
+        self.pending.append(self.characters[value])
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """Everything printed so far, as one string."""
+        return "".join(self.pending)
+
+    def clear(self):
+        self.pending.clear()
+
+
+class NullOutput:
+    """Throws all output away, for benchmarking."""
+
+    def prn(self, value):
+        pass
+
+    def pra(self, value):
+        pass
+
+    def flush(self):
+        pass
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""
+Superinstruction fusion for the LS-8 CPU.
+
+Most of what our programs run is a few fixed sequences: load a jump target
+and jump (or call) through it, compare and branch, and step a counter and
+test it at the bottom of a loop. When CPU.decode() reaches the first
+instruction of one of these, it installs a single fused handler for the
+whole sequence, so run() dispatches once for it instead of once per
+instruction. A fused entry counts as every instruction it covers and leaves
+the machine exactly as the plain handlers would.
+
+Fused entries are only trusted while the code under them is unchanged: the
+first write to a byte covered by one drops every fused entry, and fusion
+stays off until the next load() or reset().
+
+Usage: fusion.py program.ls8...
+
+Checks each program's fused run against a plain run at every instruction
+boundary and prints the fusion rate.
+"""
+
+import sys
+
+from alu import TABLES
+from cpu import *
+from devices import CaptureOutput
+
+# Which FL values take each jump, as a table indexed by FL. FL is 0 until
+# the first CMP, so these follow the exec_J* handlers exactly.
+CONDITIONS = {
+    JMP: lambda FL: True,
+    JEQ: lambda FL: FL == 1,
+    JNE: lambda FL: FL != 1,
+    JGT: lambda FL: FL == 2,
+    JGE: lambda FL: FL == 2 or FL == 1,
+    JLT: lambda FL: FL == 4,
+    JLE: lambda FL: FL == 4 or FL == 1,
+}
+TAKEN = {op: bytes(bool(cond(FL)) for FL in range(256))
+         for op, cond in CONDITIONS.items()}
+BRANCHES = set(CONDITIONS) - {JMP}
+
+# Longest sequence that is fused, in instructions. run() finishes a cycle
+# budget on the plain handlers once fewer than this many are left.
+MAX_FUSED = 3
+
+
+# Fused handlers. They take the same (cpu, a, b, next_pc) arguments as the
+# exec_* handlers; a holds the operands of the whole sequence and next_pc
+# is the address after its last instruction.
+
+def fused_LDI_jump(cpu, a, b, next_pc):
+    # LDI Rx,target / JMP (or Jxx) Rx
+    register, value, taken = a
+    cpu.REG[register] = value
+    cpu.fusion.executed += 2
+    if taken[cpu.FL]:
+        return value
+    return next_pc
+
+
+def fused_LDI_CALL(cpu, a, b, next_pc):
+    # LDI Rx,target / CALL Rx
+    register, value, call_pc = a
+    cpu.REG[register] = value
+    cpu.PC = call_pc
+    try:
+        pc = cpu.exec_CALL(register, 0, next_pc)
+    except CPUFault:
+        cpu.cycles += 1 # the LDI still ran
+        raise
+    cpu.fusion.executed += 2
+    return pc
+
+
+def fused_CMP_jump(cpu, a, b, next_pc):
+    # CMP Ra,Rb / Jxx Rc
+    x, y, target, taken = a
+    REG = cpu.REG
+    FL = cpu.FL = TABLES.CMP[REG[x] << 8 | REG[y]]
+    cpu.fusion.executed += 2
+    if taken[FL]:
+        return REG[target]
+    return next_pc
+
+
+def fused_CMP_LDI_jump(cpu, a, b, next_pc):
+    # CMP Ra,Rb / LDI Rx,target / Jxx Rx
+    x, y, register, value, taken = a
+    REG = cpu.REG
+    FL = cpu.FL = TABLES.CMP[REG[x] << 8 | REG[y]]
+    REG[register] = value
+    cpu.fusion.executed += 3
+    if taken[FL]:
+        return value
+    return next_pc
+
+
+def fused_step_CMP_jump(cpu, a, b, next_pc):
+    # INC or DEC Rn / CMP Ra,Rb / Jxx Rc
+    step, n, x, y, target, taken = a
+    REG = cpu.REG
+    REG[n] = step[REG[n]]
+    FL = cpu.FL = TABLES.CMP[REG[x] << 8 | REG[y]]
+    cpu.fusion.executed += 3
+    if taken[FL]:
+        return REG[target]
+    return next_pc
+
+
+class Fusion:
+    """Finds fusable sequences for one CPU and keeps count of them."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # the fused handlers use the ALU tables, so the bitwise ALU runs
+        # unfused
+        self.enabled = cpu.alu_backend == 'table'
+        # 1 for every byte of RAM under a fused entry
+        self.cover = bytearray(256)
+        self.sites = {} # start address -> pattern name
+        self.executed = 0 # instructions run inside fused entries
+        self.fallbacks = 0
+
+    def match(self, address):
+        """
+        Return (handler, operands, next_pc, count, pattern) for a fusable
+        sequence starting at address, or None.
+        """
+        cpu = self.cpu
+        RAM = cpu.RAM
+        ops = []
+        pc = address
+        for _ in range(MAX_FUSED):
+            IR = RAM[pc]
+            # stop at the end of RAM, an unknown opcode or anything that
+            # decode() would refuse because the stack has grown into it
+            if IR not in cpu.operations or cpu.SP <= pc + 1:
+                break
+            next_pc = pc + ((IR & 0b11000000) >> 6) + 1
+            if next_pc > 0xFF:
+                break
+            ops.append((IR, RAM[(pc + 1) & 0xFF], RAM[(pc + 2) & 0xFF],
+                        pc, next_pc))
+            pc = next_pc
+        codes = [op[0] for op in ops]
+
+        if codes[:2] == [LDI, CALL] and ops[1][1] == ops[0][1]:
+            (_, register, value, _, _), (_, _, _, call_pc, end) = ops[:2]
+            return (fused_LDI_CALL, (register, value, call_pc), end, 2,
+                    'LDI+CALL')
+        if len(codes) >= 2 and codes[0] == LDI and codes[1] in TAKEN \
+                and ops[1][1] == ops[0][1]:
+            (_, register, value, _, _), (jump, _, _, _, end) = ops[:2]
+            return (fused_LDI_jump, (register, value, TAKEN[jump]), end, 2,
+                    'LDI+JMP' if jump == JMP else 'LDI+Jxx')
+        if len(codes) == 3 and codes[0] == CMP and codes[1] == LDI \
+                and codes[2] in BRANCHES and ops[2][1] == ops[1][1]:
+            (_, x, y, _, _), (_, register, value, _, _), (jump, _, _, _, end) = ops
+            return (fused_CMP_LDI_jump, (x, y, register, value, TAKEN[jump]),
+                    end, 3, 'CMP+LDI+Jxx')
+        if len(codes) == 3 and codes[0] in (INC, DEC) and codes[1] == CMP \
+                and codes[2] in BRANCHES:
+            (step, n, _, _, _), (_, x, y, _, _), (jump, target, _, _, end) = ops
+            table = TABLES.INC if step == INC else TABLES.DEC
+            return (fused_step_CMP_jump, (table, n, x, y, target, TAKEN[jump]),
+                    end, 3, ALU_NAMES[step] + '+CMP+Jxx')
+        if len(codes) >= 2 and codes[0] == CMP and codes[1] in BRANCHES:
+            (_, x, y, _, _), (jump, target, _, _, end) = ops[:2]
+            return (fused_CMP_jump, (x, y, target, TAKEN[jump]), end, 2,
+                    'CMP+Jxx')
+        return None
+
+    def fuse(self, address, entry):
+        """
+        Called by CPU.decode(): the fused entry for address if a pattern
+        starts there, otherwise the plain entry unchanged.
+        """
+        if not self.enabled:
+            return entry
+        found = self.match(address)
+        if found is None:
+            return entry
+        handler, operands, end, count, pattern = found
+        for covered in range(address, end):
+            self.cover[covered] = 1
+        self.sites[address] = pattern
+        return (handler, operands, None, end, count)
+
+    def disable(self):
+        """
+        Code under a fused entry was written to: drop every fused entry so
+        run() goes back to the plain handlers.
+        """
+        self.enabled = False
+        self.fallbacks += 1
+        self.cover[:] = bytes(256)
+        decoded = self.cpu.decoded
+        if decoded is not None:
+            for address in self.sites:
+                decoded[address] = None
+
+    def rate(self):
+        """Fraction of the instructions run so far that ran fused."""
+        cycles = self.cpu.cycles
+        return self.executed / cycles if cycles else 0.0
+
+    def report(self):
+        """Return a summary of the fused sites and the fusion rate."""
+        lines = ["start  pattern"]
+        for address, pattern in sorted(self.sites.items()):
+            lines.append(f"   {address:02X}  {pattern}")
+        lines.append(f"{len(self.sites)} sites fused, {self.executed} of "
+                     f"{self.cpu.cycles} instructions ran fused "
+                     f"({self.rate():.1%}), {self.fallbacks} fallbacks")
+        return "\n".join(lines)
+
+
+def state(cpu):
+    """The architectural state compared at instruction boundaries."""
+    return (cpu.PC, cpu.FL, cpu.SP, bytes(cpu.REG), bytes(cpu.RAM),
+            len(cpu.output.pending))
+
+
+def compare(program, max_cycles=100000):
+    """
+    Run program once on the plain handlers, one instruction at a time, and
+    once with fusion. Returns the cycle numbers at which the fused run
+    reached an instruction boundary in a different state (empty if the
+    traces match), and the fused CPU.
+    """
+    plain = CPU(output=CaptureOutput())
+    plain.load_file(program)
+    trace = [state(plain)]
+    plain_fault = None
+    try:
+        while not plain.halted and plain.cycles < max_cycles:
+            plain.step()
+            trace.append(state(plain))
+    except CPUFault as fault:
+        plain_fault = (plain.cycles, str(fault))
+
+    cpu = CPU(output=CaptureOutput(), fuse=True)
+    cpu.load_file(program)
+    cpu.decoded = [None] * 256
+    cpu.running = True
+    mismatched = []
+    fused_fault = None
+    try:
+        while cpu.running and cpu.cycles < max_cycles:
+            handler, a, b, next_pc, count = (cpu.decoded[cpu.PC]
+                                             or cpu.decode(cpu.PC))
+            if count > max_cycles - cpu.cycles:
+                # finish the budget on the plain handlers, as execute() does
+                handler, a, b, next_pc, count = cpu.decode(cpu.PC, False)
+            cpu.PC = handler(cpu, a, b, next_pc)
+            cpu.cycles += count
+            if cpu.cycles >= len(trace) or state(cpu) != trace[cpu.cycles]:
+                mismatched.append(cpu.cycles)
+    except CPUFault as fault:
+        fused_fault = (cpu.cycles, str(fault))
+    if fused_fault != plain_fault or (
+            cpu.output.getvalue() != plain.output.getvalue()):
+        mismatched.append(cpu.cycles)
+    return mismatched, cpu
+
+
+if __name__ == "__main__":
+    for program in sys.argv[1:]:
+        mismatched, cpu = compare(program)
+        verdict = "traces match" if not mismatched else \
+            f"traces differ at cycles {mismatched[:5]}"
+        print(f"{program}: {verdict}, {cpu.fusion.rate():.1%} fused")
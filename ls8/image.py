@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+Binary LS-8 program images.
+
+Layout (little-endian):
+
+    magic        4 bytes   b"LS8\\x00"
+    version      1 byte
+    entry        1 byte    initial PC
+    load         1 byte    address the code is copied to
+    reserved     1 byte
+    length       2 bytes   number of code bytes
+    symbols      2 bytes   number of symbol entries
+    symbol table           per symbol: address (1 byte), name length
+                           (1 byte), name (ASCII)
+    code         length bytes
+
+Usage: image.py [-d] infile outfile
+
+Converts a text .ls8 file to a binary image, or back with -d.
+"""
+
+import re
+import struct
+import sys
+
+MAGIC = b"LS8\x00"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBBHH")
+
+# Label comments written by asm.py, e.g. "# Loop (address 9):"
+LABEL_COMMENT = re.compile(r"#\s*(\w+) \(address (\d+)\):")
+
+
+class Image:
+    """A decoded program image."""
+
+    def __init__(self, code, entry=0, load=0, symbols=None):
+        self.code = bytes(code)
+        self.entry = entry
+        self.load = load
+        self.symbols = dict(symbols or {})
+
+
+def pack(image):
+    """Return the binary form of an Image."""
+    if image.load + len(image.code) > 256:
+        raise ValueError("program does not fit in 256 bytes of RAM")
+    parts = [HEADER.pack(MAGIC, VERSION, image.entry, image.load, 0,
+                         len(image.code), len(image.symbols))]
+    for name, address in image.symbols.items():
+        encoded = name.encode('ascii')
+        parts.append(bytes((address, len(encoded))) + encoded)
+    parts.append(image.code)
+    return b"".join(parts)
+
+
+def header(buffer):
+    """
+    Check and decode the header of an image held in buffer (bytes, mmap or
+    memoryview). Returns (entry, load, length, symbols, offset of the code).
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError("not an LS-8 image: too short")
+    magic, version, entry, load, _, length, count = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("not an LS-8 image: bad magic")
+    if version != VERSION:
+        raise ValueError(f"unsupported LS-8 image version {version}")
+    offset = HEADER.size
+    symbols = {}
+    for _ in range(count):
+        address, size = buffer[offset], buffer[offset + 1]
+        symbols[bytes(buffer[offset + 2:offset + 2 + size]).decode('ascii')] = address
+        offset += 2 + size
+    if offset + length > len(buffer) or load + length > 256:
+        raise ValueError("LS-8 image is truncated or too large")
+    return entry, load, length, symbols, offset
+
+
+def unpack(buffer):
+    """Decode a binary image into an Image."""
+    entry, load, length, symbols, offset = header(buffer)
+    return Image(buffer[offset:offset + length], entry, load, symbols)
+
+
+def is_image(path):
+    """True if the file at path starts with the image magic number."""
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def parse_text(lines):
+    """Read a text .ls8 program (binary digits, # comments) into an Image."""
+    code = bytearray()
+    symbols = {}
+    for line in lines:
+        if line[:1] == "#":
+            label = LABEL_COMMENT.match(line)
+            if label:
+                symbols[label.group(1)] = int(label.group(2))
+            continue
+        try:
+            code.append(int(line.split("#")[0], 2))
+        except ValueError:
+            continue
+    return Image(code, symbols=symbols)
+
+
+def render_text(image):
+    """The text .ls8 form of an Image, one byte per line."""
+    labels = {}
+    for name, address in image.symbols.items():
+        labels.setdefault(address, []).append(name)
+    # text programs always load at 0, so pad up to the load address
+    lines = ["00000000"] * image.load
+    for i, byte in enumerate(image.code):
+        address = image.load + i
+        for name in labels.get(address, ()):
+            lines.append(f"# {name} (address {address}):")
+        lines.append("{:08b}".format(byte))
+    return "".join(line + "\n" for line in lines)
+
+
+def main(argv):
+    decode = len(argv) > 1 and argv[1] == '-d'
+    args = argv[2:] if decode else argv[1:]
+    if len(args) != 2:
+        print("usage: image.py [-d] infile outfile", file=sys.stderr)
+        return 1
+    infile, outfile = args
+    if decode:
+        with open(infile, 'rb') as file:
+            image = unpack(file.read())
+        with open(outfile, 'w') as file:
+            file.write(render_text(image))
+    else:
+        with open(infile) as file:
+            image = parse_text(file)
+        with open(outfile, 'wb') as file:
+            file.write(pack(image))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,269 @@
+"""
+Interrupt controller for the LS-8 CPU.
+
+    cpu = CPU(interrupts=True)
+    cpu.interrupts.attach(Timer())
+    cpu.interrupts.attach(Keyboard(sys.stdin))
+
+As the spec has it, IM is R5 and IS is R6, and the vectors live at
+0xF8-0xFF. Devices raise a line by calling signal() (or press() for a key),
+from any thread: that queues the line, sets the raised flag and clears
+cpu.running, so execute() stops after the instruction it is on and run()
+hands control to service(). Nothing looks at IM & IS between instructions,
+so a program no device is interrupting runs exactly as fast as on a CPU
+without a controller.
+
+service() latches the queued lines into IS and, if interrupts are enabled
+and IM & IS has a bit set, dispatches the lowest one: interrupts are
+disabled, the bit cleared, PC, FL and R0-R6 pushed and PC set from the
+vector. IRET pops them back and enables interrupts again.
+
+A line that stays masked in IS can't raise anything when the program
+later sets its IM bit, so while one is waiting run() also comes back to
+service() every RECHECK instructions.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from cpu import *
+
+VECTORS = 0xF8 # vector for interrupt n is at VECTORS + n
+KEY = 0xF4 # where the keyboard leaves the last key pressed
+
+TIMER = 0 # interrupt numbers
+KEYBOARD = 1
+
+# How often run() looks at IM again while a masked line waits in IS
+RECHECK = 1024
+
+
+class Interrupts:
+    """The interrupt controller of one CPU."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.devices = []
+        self.enabled = True # cleared while a handler runs, until IRET
+        self.raised = False # set by signal(): run() must call service()
+        self.events = deque() # lines signalled and not yet latched
+        self.keys = deque() # keys pressed and not yet delivered
+        self.pending = 0 # lines taken off events, waiting to go into IS
+        self.tick = None # cycle count of the next tick of a cycle timer
+        self.period = None # instructions between those ticks
+        self.recheck = None # cycle count at which to look at IM again
+        self.delivered = [0] * 8 # interrupts dispatched, per line
+
+    def attach(self, device):
+        """Connect a device (Timer, Keyboard) and start it."""
+        self.devices.append(device)
+        device.start(self)
+        return device
+
+    def close(self):
+        """Stop every device."""
+        for device in self.devices:
+            device.stop()
+        self.devices.clear()
+
+    def reset(self):
+        """Power on: interrupts enabled, nothing pending."""
+        self.enabled = True
+        self.events.clear()
+        self.keys.clear()
+        self.pending = 0
+        self.recheck = None
+        if self.period is not None:
+            self.tick = self.cpu.cycles + self.period
+
+    def signal(self, line):
+        """Raise interrupt line. Safe to call from any thread."""
+        self.events.append(line)
+        self.raised = True
+        self.cpu.running = False
+
+    def press(self, key):
+        """A key was pressed: deliver it at KEY with the keyboard line."""
+        self.keys.append(key & 0xFF)
+        self.signal(KEYBOARD)
+
+    def resume(self):
+        """Called by IRET: enable interrupts and look for the next one."""
+        self.enabled = True
+        if self.pending or self.events or self.keys or self.cpu.REG[6]:
+            self.raised = True
+            self.cpu.running = False
+
+    def deadline(self):
+        """The cycle count by which run() must call service() again."""
+        if self.tick is None:
+            return self.recheck
+        if self.recheck is None:
+            return self.tick
+        return min(self.tick, self.recheck)
+
+    def service(self):
+        """Latch raised lines into IS and dispatch one if IM lets it."""
+        cpu = self.cpu
+        REG = cpu.REG
+        self.raised = False
+        self.recheck = None
+        events = self.events
+        while events:
+            self.pending |= 1 << events.popleft()
+        if self.tick is not None and cpu.cycles >= self.tick:
+            self.pending |= 1 << TIMER
+            self.tick += self.period * (
+                (cpu.cycles - self.tick) // self.period + 1)
+        if not self.enabled:
+            # IRET restores R6, so lines are latched once the handler is done
+            return
+        if self.keys and not REG[6] & (1 << KEYBOARD):
+            cpu.ram_write(self.keys.popleft(), KEY)
+            REG[6] |= 1 << KEYBOARD
+        REG[6] |= self.pending & ~(1 << KEYBOARD)
+        self.pending = 0
+        masked = REG[5] & REG[6]
+        if masked:
+            self.dispatch((masked & -masked).bit_length() - 1)
+        elif REG[6] or self.keys:
+            self.recheck = cpu.cycles + RECHECK
+
+    def dispatch(self, line):
+        """Enter the handler for line."""
+        cpu = self.cpu
+        REG = cpu.REG
+        self.enabled = False
+        REG[6] &= ~(1 << line) & 0xFF
+        self.push(cpu.PC)
+        self.push(cpu.FL)
+        for register in range(7):
+            self.push(REG[register])
+        cpu.PC = cpu.RAM[VECTORS + line]
+        self.delivered[line] += 1
+
+    def push(self, value):
+        cpu = self.cpu
+        cpu.SP -= 1
+        if cpu.SP <= cpu.PC + 1:
+            raise StackOverflow(cpu)
+        cpu.ram_write(value, cpu.SP)
+
+    def run(self, max_cycles=None):
+        """
+        Called by CPU.run(): run in slices, servicing interrupts between
+        them, until HLT or max_cycles instructions.
+        """
+        cpu = self.cpu
+        before = cpu.cycles
+        while True:
+            self.service()
+            if cpu.halted:
+                break
+            budget = None
+            if max_cycles is not None:
+                budget = max_cycles - (cpu.cycles - before)
+                if budget <= 0:
+                    break
+            deadline = self.deadline()
+            if deadline is not None:
+                wait = max(deadline - cpu.cycles, 1)
+                budget = wait if budget is None else min(budget, wait)
+            cpu.run_slice(budget)
+            if cpu.halted:
+                break
+
+
+class Timer:
+    """
+    Interrupt 0. Fires once every period seconds of wall-clock time, timed
+    against time.monotonic() on a thread of its own, or with cycles=N once
+    every N instructions of the CPU's own count, which is repeatable.
+    """
+
+    def __init__(self, period=1.0, cycles=None):
+        self.period = period
+        self.cycles = cycles
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, interrupts):
+        self.interrupts = interrupts
+        if self.cycles is not None:
+            interrupts.period = self.cycles
+            interrupts.tick = interrupts.cpu.cycles + self.cycles
+            return
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def listen(self):
+        deadline = time.monotonic() + self.period
+        while not self.stopped.wait(max(0.0, deadline - time.monotonic())):
+            deadline += self.period
+            self.interrupts.signal(TIMER)
+
+    def stop(self):
+        self.stopped.set()
+        if self.cycles is not None:
+            self.interrupts.period = self.interrupts.tick = None
+
+
+class Keyboard:
+    """
+    Interrupt 1. Reads keys from stream (a file with a fileno()) on a
+    thread of its own. A terminal is put in cbreak mode while attached, so
+    keys arrive as they are pressed.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.saved = None # terminal settings to restore
+        self.thread = None
+
+    def start(self, interrupts):
+        self.interrupts = interrupts
+        fd = self.stream.fileno()
+        self.saved = cbreak(fd)
+        self.thread = threading.Thread(target=self.listen, args=(fd,),
+                                       daemon=True)
+        self.thread.start()
+
+    def listen(self, fd):
+        while True:
+            try:
+                data = os.read(fd, 64)
+            except OSError:
+                return
+            if not data:
+                return
+            for key in data:
+                self.interrupts.press(key)
+
+    def stop(self):
+        restore(self.stream.fileno(), self.saved)
+        self.saved = None
+
+
+def cbreak(fd):
+    """
+    Put a terminal in cbreak mode, so reads return each key as it is
+    pressed. Returns the settings for restore(), or None if fd isn't a
+    terminal.
+    """
+    if not os.isatty(fd):
+        return None
+    import termios
+    import tty
+    saved = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+    return saved
+
+
+def restore(fd, saved):
+    """Undo cbreak()."""
+    if saved is not None:
+        import termios
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
@@ -0,0 +1,227 @@
+"""Basic-block JIT for the LS-8 CPU."""
+
+import time
+
+from cpu import *
+
+# Longest run of instructions compiled into one block
+MAX_BLOCK = 64
+
+# Instructions that are translated straight into Python statements
+INLINE = {
+    LDI: ["REG[{a}] = {b}"],
+    LD: ["REG[{a}] = RAM[REG[{b}]]"],
+    PRN: ["cpu.output.prn(REG[{a}])"],
+    PRA: ["cpu.output.pra(REG[{a}])"],
+    ADD: ["REG[{a}] = (REG[{a}] + REG[{b}]) & 0xFF"],
+    ADDI: ["REG[{a}] = (REG[{a}] + {b}) & 0xFF"],
+    SUB: ["REG[{a}] = (REG[{a}] - REG[{b}]) & 0xFF"],
+    MUL: ["REG[{a}] = (REG[{a}] * REG[{b}]) & 0xFF"],
+    AND: ["REG[{a}] = REG[{a}] & REG[{b}]"],
+    OR: ["REG[{a}] = REG[{a}] | REG[{b}]"],
+    XOR: ["REG[{a}] = REG[{a}] ^ REG[{b}]"],
+    NOT: ["REG[{a}] = ~REG[{a}] & 0xFF"],
+    SHL: ["REG[{a}] = (REG[{a}] << REG[{b}]) & 0xFF"],
+    SHR: ["REG[{a}] = REG[{a}] >> REG[{b}]"],
+    INC: ["REG[{a}] = (REG[{a}] + 1) & 0xFF"],
+    DEC: ["REG[{a}] = (REG[{a}] - 1) & 0xFF"],
+    CMP: [
+        "if REG[{b}] > REG[{a}]:",
+        "    cpu.FL = 0b00000100",
+        "elif REG[{b}] == REG[{a}]:",
+        "    cpu.FL = 0b00000001",
+        "else:",
+        "    cpu.FL = 0b00000010",
+    ],
+    NOP: [],
+}
+
+# Control flow that ends a block
+BRANCHES = {
+    JMP: ["return REG[{a}]"],
+    JEQ: ["if cpu.FL == 1:", "    return REG[{a}]", "return {next}"],
+    JNE: ["if cpu.FL != 1:", "    return REG[{a}]", "return {next}"],
+    JGT: ["if cpu.FL == 2:", "    return REG[{a}]", "return {next}"],
+    JGE: ["if cpu.FL == 2 or cpu.FL == 1:", "    return REG[{a}]", "return {next}"],
+    JLT: ["if cpu.FL == 4:", "    return REG[{a}]", "return {next}"],
+    JLE: ["if cpu.FL == 4 or cpu.FL == 1:", "    return REG[{a}]", "return {next}"],
+    HLT: ["cpu.running = False", "cpu.halted = True", "return {next}"],
+}
+
+# Instructions that move SP or write to RAM. They are run through the CPU's
+# own handler and end the block, so the next block is decoded (and checked
+# for stack overflow) against the memory they leave behind. INT ends one too,
+# so an interrupt it raises is taken straight after it.
+DELEGATED_ENDS = {CALL, RET, PUSH, ST, INT, IRET}
+
+# Instructions whose operand b is a value rather than a register
+IMMEDIATE_B = {LDI, ADDI}
+
+
+def registers_exist(IR, a, b):
+    """Whether the register operands of IR a, b are R0-R7."""
+    operands = IR >> 6
+    return (operands < 1 or a < 8) and (
+        operands < 2 or IR in IMMEDIATE_B or b < 8)
+
+
+class Block:
+    """A compiled run of instructions starting at one address."""
+
+    def __init__(self, start, end, count, source, function, compile_time):
+        self.start = start
+        self.end = end # last byte covered by the block
+        self.count = count # number of instructions
+        self.source = source
+        self.function = function
+        self.compile_time = compile_time
+        self.hits = 0
+
+
+class JIT:
+    """Compiles basic blocks of LS-8 code into Python closures."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = [None] * 256
+        # block start addresses covering each byte of RAM
+        self.owners = [set() for _ in range(256)]
+        self.compiled = [] # every block ever compiled, for the report
+        self.invalidations = 0
+        # instructions a block had finished when it called a handler
+        self.retired = 0
+
+    def translate(self, start):
+        """Generate Python source for the block starting at start."""
+        cpu = self.cpu
+        lines = []
+        address = start
+        count = 0
+        while True:
+            if count == 0:
+                # let decode() report faults on the first instruction
+                handler, a, b, next_pc, _ = cpu.decode(address, False)
+            else:
+                IR = cpu.RAM[address]
+                # end the block before anything that faults, so it faults
+                # as the first instruction of the next one, with PC and
+                # cycles up to date; a register operand past R7 raises
+                # IndexError straight from the inline code
+                if (IR not in cpu.operations or cpu.SP <= address + 1
+                        or not registers_exist(
+                            IR, cpu.RAM[(address + 1) & 0xFF],
+                            cpu.RAM[(address + 2) & 0xFF])):
+                    lines.append(f"return {address}")
+                    break
+                handler, a, b, next_pc, _ = cpu.decode(address, False)
+            IR = cpu.RAM[address]
+            size = ((IR & 0b11000000) >> 6) + 1
+            fields = {'a': a, 'b': b, 'next': next_pc}
+            count += 1
+            end = (address + size - 1) & 0xFF
+            if IR in INLINE:
+                lines.extend(line.format(**fields) for line in INLINE[IR])
+            elif IR in BRANCHES:
+                lines.extend(line.format(**fields) for line in BRANCHES[IR])
+                break
+            else:
+                name = handler.__name__
+                # the handler may fault: record where, and how many
+                # instructions of the block have finished before it
+                lines.append(f"cpu.PC = {address}")
+                lines.append(f"jit.retired = {count - 1}")
+                if IR in DELEGATED_ENDS:
+                    lines.append(f"return cpu.{name}({a}, {b}, {next_pc})")
+                    break
+                lines.append(f"cpu.{name}({a}, {b}, {next_pc})")
+            if count == MAX_BLOCK or next_pc < address:
+                lines.append(f"return {next_pc}")
+                break
+            address = next_pc
+        body = "\n".join("        " + line for line in lines) or "        pass"
+        source = (
+            f"def make(cpu, REG, RAM, jit):\n"
+            f"    def block_{start:02X}():\n"
+            f"{body}\n"
+            f"    return block_{start:02X}\n"
+        )
+        return source, end, count
+
+    def compile(self, start):
+        """Compile and cache the block starting at start."""
+        began = time.perf_counter()
+        source, end, count = self.translate(start)
+        namespace = {}
+        exec(compile(source, f"<ls8 block {start:02X}>", "exec"), namespace)
+        function = namespace['make'](self.cpu, self.cpu.REG, self.cpu.RAM,
+                                     self)
+        block = Block(start, end, count, source, function,
+                      time.perf_counter() - began)
+        self.blocks[start] = block
+        self.compiled.append(block)
+        address = start
+        while True:
+            self.owners[address].add(start)
+            if address == end:
+                break
+            address = (address + 1) & 0xFF
+        return block
+
+    def invalidate(self, memory_address):
+        """Drop every block that covers memory_address or the byte before."""
+        for address in (memory_address, (memory_address - 1) & 0xFF):
+            for start in list(self.owners[address]):
+                block = self.blocks[start]
+                self.blocks[start] = None
+                self.invalidations += 1
+                covered = block.start
+                while True:
+                    self.owners[covered].discard(start)
+                    if covered == block.end:
+                        break
+                    covered = (covered + 1) & 0xFF
+
+    def run(self, max_cycles=None):
+        """Run the CPU one compiled block at a time."""
+        cpu = self.cpu
+        blocks = self.blocks
+        cpu.running = True
+        if cpu.interrupts is not None and cpu.interrupts.raised:
+            cpu.running = False
+        limit = -1 if max_cycles is None else max_cycles
+        cycles = 0
+        try:
+            while cpu.running and cycles != limit:
+                block = blocks[cpu.PC] or self.compile(cpu.PC)
+                if limit >= 0 and cycles + block.count > limit:
+                    # finish the budget one instruction at a time
+                    handler, a, b, next_pc, _ = cpu.decode(cpu.PC, False)
+                    cpu.PC = handler(cpu, a, b, next_pc)
+                    cycles += 1
+                    continue
+                block.hits += 1
+                try:
+                    cpu.PC = block.function()
+                except CPUFault:
+                    # count what ran before the faulting instruction
+                    cycles += self.retired
+                    raise
+                cycles += block.count
+        finally:
+            cpu.cycles += cycles
+
+    def report(self):
+        """Return a table of compiled blocks, their hit counts and cost."""
+        lines = ["start  end  instrs       hits  compile(us)"]
+        for block in sorted(self.compiled, key=lambda b: -b.hits):
+            lines.append("   %02X   %02X  %6d %10d  %11.1f" % (
+                block.start,
+                block.end,
+                block.count,
+                block.hits,
+                block.compile_time * 1e6,
+            ))
+        total = sum(block.compile_time for block in self.compiled)
+        lines.append(f"{len(self.compiled)} blocks compiled in "
+                     f"{total * 1e3:.3f} ms, {self.invalidations} invalidated")
+        return "\n".join(lines)
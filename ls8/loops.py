@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""
+Closed-form fast-forward for simple counting loops.
+
+A loop here is a straight run of code that ends in a conditional jump back
+to its first instruction, where the body only moves registers around:
+
+    Loop:
+        INC R0          ; INC, DEC, ADDI, or ADD/SUB of an unchanging register
+        LDI R2,Loop     ; LDI of a constant
+        CMP R0,R1       ; exactly one CMP
+        JNE R2          ; any conditional jump back to Loop
+
+With CPU(fast_forward=True), decode() marks the first instruction of each
+such loop. When run() reaches it, every register the body changes moves by
+the same amount each time round, so the iteration the jump falls through
+on is found arithmetically (all values wrap at 8 bits), and the registers,
+FL, PC and cycle count are set to what running the loop one instruction at
+a time would have left. A cycle budget that ends inside the loop stops it
+after the last whole iteration that fits; the remainder runs normally.
+
+Usage: loops.py program.ls8...
+
+Checks each program against a plain run and prints the loops it skipped.
+"""
+
+import sys
+from math import gcd
+
+from alu import TABLES
+from cpu import *
+from devices import CaptureOutput
+from fusion import TAKEN, BRANCHES
+
+# Longest loop body looked at, in instructions
+MAX_BODY = 32
+
+# Register updates a body may contain, as the amount they add
+STEPS = {INC, DEC, ADDI, ADD, SUB}
+BODY = STEPS | {LDI, CMP, NOP}
+
+
+class Loop:
+    """A counting loop found by Loops.find()."""
+
+    def __init__(self, head, code, body, exit_pc):
+        self.head = head
+        self.code = code # the bytes of the loop, to spot changes
+        self.body = body # (IR, a, b, pc) per instruction
+        self.exit_pc = exit_pc
+        self.length = len(body)
+        self.entered = 0
+        self.iterations = 0
+
+
+def enter_loop(cpu, loop, b, head):
+    # Decoded entry for a loop head: leave execute() so run() can hand the
+    # loop to Loops.fast_forward() with what is left of the cycle budget.
+    cpu.loops.pending = loop
+    cpu.running = False
+    return head
+
+
+class Loops:
+    """Finds counting loops for one CPU and fast-forwards through them."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.found = {} # head address -> Loop
+        # heads found whose jump went elsewhere when reached: the middle of
+        # a bigger loop, most likely, so not looked at again
+        self.rejected = set()
+        self.pending = None # loop whose head run() has just reached
+        self.skipped = 0 # instructions not run one at a time
+
+    def find(self, head):
+        """Return a Loop if the code at head is a counting loop, else None."""
+        if head in self.rejected:
+            return None
+        cpu = self.cpu
+        RAM = cpu.RAM
+        body = []
+        pc = head
+        for _ in range(MAX_BODY):
+            IR = RAM[pc]
+            next_pc = pc + ((IR & 0b11000000) >> 6) + 1
+            body.append((IR, RAM[(pc + 1) & 0xFF], RAM[(pc + 2) & 0xFF], pc))
+            if IR in BRANCHES:
+                break
+            if IR not in BODY or next_pc > 0xFF:
+                return None
+            pc = next_pc
+        else:
+            return None
+        if [op[0] for op in body].count(CMP) != 1:
+            return None
+
+        # Registers set by LDI hold one constant; every other register the
+        # body writes is an induction variable. A constant must be set
+        # before anything in the body reads it, and ADD/SUB may only add a
+        # register that is constant or not written at all.
+        constants = {op[1]: op[2] for op in body if op[0] == LDI}
+        induction = {op[1] for op in body if op[0] in STEPS}
+        if len(constants) != sum(op[0] == LDI for op in body) or \
+                induction & set(constants):
+            return None
+        known = set()
+        for IR, a, b, _ in body:
+            if IR == LDI:
+                known.add(a)
+                continue
+            reads = {CMP: (a, b), ADD: (b,), SUB: (b,)}.get(IR, ())
+            if IR in BRANCHES:
+                reads = (a,)
+            for register in reads:
+                if register in constants and register not in known:
+                    return None
+            if IR in (ADD, SUB) and (b == a or b in induction):
+                return None
+        target = body[-1][1]
+        if target in induction or constants.get(target, head) != head:
+            return None
+        loop = Loop(head, bytes(RAM[head:next_pc]), body, next_pc & 0xFF)
+        self.found[head] = loop
+        return loop
+
+    def fast_forward(self, budget=None):
+        """
+        Run the pending loop: as many whole iterations as it takes to fall
+        through (or as fit in budget) in one go. Falls back to running one
+        instruction normally when the loop can't be skipped.
+        """
+        loop = self.pending
+        self.pending = None
+        cpu = self.cpu
+        REG = cpu.REG
+        head = loop.head
+        last_pc = loop.body[-1][3]
+        if cpu.RAM[head:head + len(loop.code)] != loop.code:
+            # the code has changed since it was analysed
+            cpu.decoded[head] = None
+            return self.single_step()
+        target = loop.body[-1][1]
+        if REG[target] != head and target not in (
+                op[1] for op in loop.body if op[0] == LDI):
+            self.rejected.add(head)
+            cpu.decoded[head] = None
+            return self.single_step()
+        if cpu.SP <= last_pc + 1:
+            # let the plain handlers raise the stack overflow
+            return self.single_step()
+
+        # value of every register the body changes, relative to the start
+        # of an iteration: constants, and how much each induction variable
+        # has moved before the CMP and over a whole iteration
+        constants = {}
+        before = {}
+        total = {}
+        compared = None
+        for IR, a, b, _ in loop.body:
+            if IR == LDI:
+                constants[a] = b
+            elif IR == CMP:
+                compared = (a, b)
+                before = dict(total)
+            elif IR in STEPS:
+                if IR == INC:
+                    step = 1
+                elif IR == DEC:
+                    step = -1
+                elif IR == ADDI:
+                    step = b
+                else:
+                    step = constants.get(b, REG[b])
+                    if IR == SUB:
+                        step = -step
+                total[a] = (total.get(a, 0) + step) & 0xFF
+
+        def value(register, k):
+            # register as the CMP in iteration k (counting from 0) sees it
+            if register in constants:
+                return constants[register]
+            return (REG[register] + before.get(register, 0)
+                    + k * total.get(register, 0)) & 0xFF
+
+        # the iteration whose jump falls through
+        jump = loop.body[-1][0]
+        taken = TAKEN[jump]
+        x, y = compared
+        exit_at = None
+        if jump == JNE:
+            # falls through once x == y: solve x0 - y0 + k * D == 0 mod 256
+            d0 = (value(x, 0) - value(y, 0)) & 0xFF
+            D = (value(x, 1) - value(y, 1) - d0) & 0xFF
+            if d0 == 0:
+                exit_at = 0
+            elif D:
+                g = gcd(D, 256)
+                if d0 % g == 0:
+                    m = 256 // g
+                    exit_at = ((256 - d0) // g * pow(D // g, -1, m)) % m
+        else:
+            # the compared values repeat every 256 iterations at most
+            for k in range(256):
+                if not taken[TABLES.CMP[value(x, k) << 8 | value(y, k)]]:
+                    exit_at = k
+                    break
+
+        iterations = None if exit_at is None else exit_at + 1
+        if budget is not None:
+            fits = budget // loop.length
+            if iterations is None or iterations > fits:
+                iterations = fits
+        if not iterations:
+            # an endless loop with no budget, or less than one iteration
+            # of budget left
+            return self.single_step()
+
+        k = iterations - 1
+        cpu.FL = TABLES.CMP[value(x, k) << 8 | value(y, k)]
+        for register, step in total.items():
+            REG[register] = (REG[register] + iterations * step) & 0xFF
+        for register, constant in constants.items():
+            REG[register] = constant
+        cpu.PC = loop.exit_pc if k == exit_at else head
+        cpu.cycles += iterations * loop.length
+        self.skipped += iterations * loop.length
+        loop.entered += 1
+        loop.iterations += iterations
+
+    def single_step(self):
+        """Run the instruction at PC with its plain handler."""
+        cpu = self.cpu
+        handler, a, b, next_pc, _ = cpu.decode(cpu.PC, False)
+        cpu.PC = handler(cpu, a, b, next_pc)
+        cpu.cycles += 1
+
+    def report(self):
+        """Return a table of the loops found and how often they were skipped."""
+        lines = ["start  exit  instrs  entered  iterations"]
+        for head, loop in sorted(self.found.items()):
+            lines.append("   %02X    %02X  %6d  %7d  %10d" % (
+                head, loop.exit_pc, loop.length, loop.entered,
+                loop.iterations))
+        lines.append(f"{self.skipped} of {self.cpu.cycles} instructions "
+                     f"fast-forwarded")
+        return "\n".join(lines)
+
+
+def compare(program, max_cycles=1000000):
+    """
+    Run program with and without fast-forward. Returns True if both end
+    in the same state with the same output, and the fast-forward CPU.
+    """
+    results = []
+    for fast_forward in (False, True):
+        cpu = CPU(output=CaptureOutput(), fast_forward=fast_forward)
+        cpu.load_file(program)
+        fault = None
+        try:
+            cpu.run(max_cycles)
+        except CPUFault as e:
+            fault = str(e)
+        results.append((cpu.output.getvalue(), fault, cpu.cycles, cpu.PC,
+                        cpu.FL, cpu.SP, bytes(cpu.REG), bytes(cpu.RAM)))
+    return results[0] == results[1], cpu
+
+
+if __name__ == "__main__":
+    for program in sys.argv[1:]:
+        same, cpu = compare(program)
+        print(f"{program}: {'matches' if same else 'DIFFERS'}")
+        if cpu.loops.found:
+            print(cpu.loops.report())
@@ -1,11 +1,137 @@
 #!/usr/bin/env python3
 
-"""Main."""
+"""
+Main.
 
+Usage: ls8.py [-b ADDR[:COND]]... [-w WHAT[:COND]]... program.ls8
+
+-b stops before the instruction at ADDR (hex), -w after an instruction
+changes WHAT, a register (R0) or a RAM cell ([F0]). COND is a condition
+such as "FL == 1" or "R0 > 9" (see breakpoints.py). At a stop the state is
+traced and commands are read from stdin: c (continue), s [n] (step), b
+and w (as above), d ADDR|WHAT (delete) and q (quit). With breakpoints,
+stdin is for these commands rather than the keyboard.
+"""
+
+import argparse
 import sys
 from cpu import *
+from devices import BufferedOutput
+from interrupts import Timer, Keyboard
+
+# Instructions run between flushes of the output, so a program that never
+# halts still shows what it prints when stdout isn't a terminal
+FLUSH_CYCLES = 100000
+
+
+def register(name):
+    number = int(name[1:])
+    if not 0 <= number < 8:
+        raise ValueError(f"no register {name}")
+    return number
+
+
+def arm(points, kind, text):
+    """Add the breakpoint (kind 'b') or watchpoint ('w') text describes."""
+    from breakpoints import condition
+    where, _, test = text.partition(':')
+    where = where.strip().upper()
+    test = condition(test) if test.strip() else None
+    if kind == 'b':
+        points.add(int(where, 16), test)
+    elif where.startswith('R'):
+        points.watch_register(register(where), test)
+    else:
+        points.watch_memory(int(where.strip('[]'), 16), test)
+
+
+def disarm(points, text):
+    where = text.strip().upper()
+    if where.startswith('R'):
+        points.unwatch_register(register(where))
+    elif where.startswith('['):
+        points.unwatch_memory(int(where.strip('[]'), 16))
+    else:
+        points.remove(int(where, 16))
+
+
+def run(cpu, points=None):
+    """Run cpu until HLT or a stop at points, flushing output as it goes."""
+    hits = points.hits if points is not None else 0
+    while not cpu.halted and (points is None or points.hits == hits):
+        cpu.run(FLUSH_CYCLES)
+        cpu.output.flush()
+
+
+def debug(cpu, points):
+    """Run cpu, stopping at points for commands from stdin."""
+    hits = 0
+    run(cpu, points)
+    while not cpu.halted:
+        if points.hits != hits:
+            hits = points.hits
+            print(points.describe())
+        cpu.trace()
+        for line in sys.stdin:
+            command, _, rest = line.strip().partition(' ')
+            try:
+                if command in ('c', 'continue'):
+                    run(cpu, points)
+                    break
+                elif command in ('s', 'step'):
+                    cpu.run(int(rest) if rest else 1)
+                    break
+                elif command in ('b', 'break', 'w', 'watch'):
+                    arm(points, command[0], rest)
+                elif command in ('d', 'delete'):
+                    disarm(points, rest)
+                elif command in ('q', 'quit'):
+                    return
+                elif command:
+                    print(f"unknown command {command}")
+            except ValueError as error:
+                print(error)
+        else:
+            return
+
+
+parser = argparse.ArgumentParser(description="Run an LS-8 program.")
+parser.add_argument('program')
+parser.add_argument('-b', '--break', dest='breakpoints', action='append',
+                    default=[], metavar='ADDR[:COND]')
+parser.add_argument('-w', '--watch', dest='watchpoints', action='append',
+                    default=[], metavar='WHAT[:COND]')
+args = parser.parse_args()
 
-cpu = CPU()
+# On a terminal, show output as soon as it's printed
+cpu = CPU(output=BufferedOutput(threshold=1 if sys.stdout.isatty() else 4096),
+          interrupts=True)
 
-cpu.load()
-cpu.run()
\ No newline at end of file
+cpu.load(args.program)
+points = None
+if args.breakpoints or args.watchpoints:
+    from breakpoints import Breakpoints
+    points = Breakpoints(cpu)
+    try:
+        for text in args.breakpoints:
+            arm(points, 'b', text)
+        for text in args.watchpoints:
+            arm(points, 'w', text)
+    except ValueError as error:
+        parser.error(str(error))
+# the timer (I0) and the keyboard on stdin (I1)
+cpu.interrupts.attach(Timer())
+if sys.stdin is not None and points is None:
+    cpu.interrupts.attach(Keyboard(sys.stdin))
+try:
+    if points is None:
+        run(cpu)
+    else:
+        debug(cpu, points)
+except CPUFault as fault:
+    print(fault)
+    sys.exit(1)
+except KeyboardInterrupt:
+    sys.exit(130)
+finally:
+    cpu.interrupts.close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+Execution profiler for the LS-8 CPU.
+
+    profile = Profiler(symbols=cpu.load_file(path))
+    cpu.run(profile=profile)
+    profile.to_json(), profile.collapsed()
+
+In the default exact mode every instruction is counted: per opcode, per
+PC, the ALU mix, reads and writes of each RAM cell and the deepest the
+stack got. With every=N, the CPU runs on its normal fast loop and is
+sampled once every N instructions instead, each sample standing for N
+instructions; memory traffic isn't seen in that mode.
+
+Both modes track calls by wrapping the CALL and RET handlers, and count
+instructions per call stack for flame graphs (collapsed() gives the
+"frame;frame count" lines flamegraph.pl reads). A subroutine is named
+after the label at its address if symbols were given, else by address.
+
+None of this is in the normal run() loop: a CPU that isn't being
+profiled runs exactly as before.
+
+Usage: profiler.py [-s N] [-o profile.json] [-c stacks.txt] program.ls8
+"""
+
+import argparse
+import json
+import sys
+
+import cpu as cpu_module
+from cpu import *
+from devices import NullOutput
+
+# Mnemonic of every opcode the CPU runs
+NAMES = {value: name for name, value in vars(cpu_module).items()
+         if name.isupper() and isinstance(value, int)
+         and value in CPU.OPERATIONS}
+
+class Profiler:
+    """Counters for one profiled run, kept in preallocated lists."""
+
+    def __init__(self, every=None, symbols=None):
+        self.every = every # None for exact counts, else the sampling period
+        self.names = {address: name
+                      for name, address in (symbols or {}).items()}
+        self.opcodes = [0] * 256
+        self.pcs = [0] * 256
+        self.reads = [0] * 256
+        self.writes = [0] * 256
+        self.low_SP = None # lowest SP seen
+        self.cycles = 0
+        self.samples = 0
+        self.frames = []
+        self.stack = ''
+        self.stacks = {} # "frame;frame" -> instructions
+
+    def frame(self, address):
+        return self.names.get(address, f"sub_{address:02X}")
+
+    def enter(self, address):
+        self.frames.append(self.frame(address))
+        self.stack = ";".join(self.frames)
+
+    def leave(self):
+        if len(self.frames) > 1:
+            self.frames.pop()
+            self.stack = ";".join(self.frames)
+
+    def instrument(self, cpu):
+        """Operations table for cpu with CALL and RET tracking the stack."""
+        operations = dict(cpu.operations)
+        call = operations[CALL]
+        ret = operations[RET]
+        profiler = self
+
+        def profiled_CALL(cpu, a, b, next_pc):
+            pc = call(cpu, a, b, next_pc)
+            profiler.enter(pc)
+            return pc
+
+        def profiled_RET(cpu, a, b, next_pc):
+            pc = ret(cpu, a, b, next_pc)
+            profiler.leave()
+            return pc
+
+        operations[CALL] = profiled_CALL
+        operations[RET] = profiled_RET
+        return operations
+
+    def run(self, cpu, max_cycles=None):
+        """
+        Called by CPU.run(profile=...): run cpu like run() would and
+        count what it does.
+        """
+        if not self.frames:
+            self.frames = [self.names.get(cpu.PC, 'main')]
+            self.stack = self.frames[0]
+        if self.low_SP is None:
+            self.low_SP = cpu.SP
+        # profile the plain dispatch path, with the wrapped handlers
+        saved = (cpu.operations, cpu.jit, cpu.fusion, cpu.loops)
+        cpu.operations = self.instrument(cpu)
+        cpu.jit = cpu.fusion = cpu.loops = None
+        cpu.decoded = None
+        before = cpu.cycles
+        try:
+            if self.every is None:
+                self.count(cpu, max_cycles)
+            else:
+                self.sample(cpu, max_cycles)
+        finally:
+            cpu.operations, cpu.jit, cpu.fusion, cpu.loops = saved
+            cpu.decoded = None
+            self.cycles += cpu.cycles - before
+            cpu.output.flush()
+        return RunResult(cpu.halted, cpu.cycles - before, cpu.PC)
+
+    def count(self, cpu, max_cycles):
+        """Exact mode: one instruction at a time."""
+        RAM = cpu.RAM
+        opcodes = self.opcodes
+        pcs = self.pcs
+        reads = self.reads
+        writes = self.writes
+        stacks = self.stacks
+        low_SP = self.low_SP
+        limit = -1 if max_cycles is None else max_cycles
+        cycles = 0
+        cpu.running = True
+        try:
+            while cpu.running and cycles != limit:
+                pc = cpu.PC
+                handler, a, b, next_pc, _ = cpu.decode(pc, False)
+                IR = RAM[pc]
+                if IR in READS:
+                    reads[READS[IR](cpu, a, b)] += 1
+                elif IR in WRITES:
+                    writes[WRITES[IR](cpu, a, b)] += 1
+                stack = self.stack
+                cpu.PC = handler(cpu, a, b, next_pc)
+                cycles += 1
+                opcodes[IR] += 1
+                pcs[pc] += 1
+                stacks[stack] = stacks.get(stack, 0) + 1
+                if cpu.SP < low_SP:
+                    low_SP = cpu.SP
+        finally:
+            cpu.cycles += cycles
+            self.low_SP = low_SP
+
+    def sample(self, cpu, max_cycles):
+        """Sampling mode: run every instructions at a time, then look."""
+        every = self.every
+        left = max_cycles
+        while not cpu.halted and left != 0:
+            chunk = every if left is None else min(every, left)
+            before = cpu.cycles
+            try:
+                cpu.execute(chunk)
+            finally:
+                ran = cpu.cycles - before
+                if left is not None:
+                    left -= ran
+                if ran:
+                    self.samples += 1
+                    self.pcs[cpu.PC] += ran
+                    self.opcodes[cpu.RAM[cpu.PC]] += ran
+                    stack = self.stack
+                    self.stacks[stack] = self.stacks.get(stack, 0) + ran
+                    self.low_SP = min(self.low_SP, cpu.SP)
+
+    def to_json(self):
+        """The profile as a dict ready for json.dump()."""
+        def named(counts):
+            return {NAMES.get(op, f"{op:#04x}"): n
+                    for op, n in enumerate(counts) if n}
+
+        def by_address(counts):
+            return {f"{address:02X}": n
+                    for address, n in enumerate(counts) if n}
+
+        low_SP = self.low_SP if self.low_SP is not None else 0xF4
+        return {
+            'mode': ('exact' if self.every is None
+                     else f"sampled every {self.every}"),
+            'cycles': self.cycles,
+            'samples': self.samples,
+            'opcodes': named(self.opcodes),
+            'alu': {name: n for name, n in named(self.opcodes).items()
+                    if name in ALU_NAMES.values()},
+            'pcs': by_address(self.pcs),
+            'memory': None if self.every is not None else {
+                'reads': sum(self.reads),
+                'writes': sum(self.writes),
+                'read_addresses': by_address(self.reads),
+                'write_addresses': by_address(self.writes),
+            },
+            'stack_high_water': 0xF4 - low_SP,
+            'stacks': dict(self.stacks),
+        }
+
+    def collapsed(self):
+        """Collapsed stacks for flamegraph.pl, one "a;b;c count" per line."""
+        return "".join(f"{stack} {n}\n" for stack, n in
+                       sorted(self.stacks.items()) if n)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Profile an LS-8 program.")
+    parser.add_argument('program')
+    parser.add_argument('-s', '--every', type=int, default=None,
+                        help="sample every N instructions instead of "
+                             "counting every one")
+    parser.add_argument('-o', '--output', default=None,
+                        help="write the JSON profile here (default: stdout)")
+    parser.add_argument('-c', '--collapsed', default=None,
+                        help="write collapsed stacks for flamegraph.pl here")
+    parser.add_argument('--max-cycles', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    cpu = CPU(output=NullOutput())
+    profile = Profiler(args.every, cpu.load_file(args.program))
+    try:
+        cpu.run(args.max_cycles, profile=profile)
+    except CPUFault as fault:
+        print(fault, file=sys.stderr)
+    text = json.dumps(profile.to_json(), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.collapsed:
+        with open(args.collapsed, 'w') as file:
+            file.write(profile.collapsed())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
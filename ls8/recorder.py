@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""
+Binary execution trace recorder for the LS-8 CPU.
+
+CPU.trace() formats and prints a line per instruction. The Recorder
+instead packs one fixed-width record per instruction into a preallocated
+buffer: the machine as trace() would show it before the instruction
+(PC, FL, the instruction bytes, SP and the registers), plus the one
+register or RAM cell the instruction changed. The buffer is a ring that
+keeps the last capacity records, or, given a file, is written out each
+time it fills, so a whole run can be kept.
+
+Record layout (little-endian, RECORD.size bytes):
+
+    cycle        4 bytes   instructions run before this one
+    PC, FL, IR, operand a, operand b, SP         1 byte each
+    registers    8 bytes
+    change       1 byte    NOTHING, REGISTER, MEMORY or FAULT
+    where        1 byte    register number or RAM address
+    value        1 byte    the value written
+
+A trace file is HEADER followed by records, oldest first.
+
+Usage:
+    recorder.py record program.ls8 out.trace [max_cycles]
+    recorder.py show file.trace [from_cycle [count]]
+    recorder.py diff a.trace b.trace
+"""
+
+import struct
+import sys
+
+from cpu import *
+from devices import NullOutput
+
+MAGIC = b"LS8T"
+VERSION = 1
+HEADER = struct.Struct("<4sBB")
+RECORD = struct.Struct("<I6B8s3B")
+
+# What a record's change field means
+NOTHING = 0
+REGISTER = 1
+MEMORY = 2
+FAULT = 3 # the instruction faulted; nothing changed
+
+# Instructions that write register a
+REGISTER_WRITES = {LDI, LD, POP, ADDI} | (set(ALU_NAMES) - {CMP})
+
+
+class Recorder:
+    """
+    Records every instruction of a run. Pass it to CPU.run(trace=...).
+    """
+
+    def __init__(self, capacity=65536, file=None):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.index = 0 # next slot in the buffer
+        self.count = 0 # records written since the start
+        self.file = file # binary file to stream to, or None for a ring
+        if file is not None:
+            file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def run(self, cpu, max_cycles=None):
+        """Run cpu like CPU.run() would, recording each instruction."""
+        RAM = cpu.RAM
+        REG = cpu.REG
+        buffer = self.buffer
+        pack = RECORD.pack_into
+        size = RECORD.size
+        limit = -1 if max_cycles is None else max_cycles
+        before = cpu.cycles
+        cycles = 0
+        cpu.running = True
+        try:
+            while cpu.running and cycles != limit:
+                pc = cpu.PC
+                IR = RAM[pc]
+                a = RAM[(pc + 1) & 0xFF]
+                b = RAM[(pc + 2) & 0xFF]
+                offset = self.index * size
+                state = (before + cycles, pc, cpu.FL, IR, a, b, cpu.SP,
+                         bytes(REG))
+                try:
+                    handler, a, b, next_pc, _ = cpu.decode(pc, False)
+                    if IR == ST:
+                        change = (MEMORY, REG[a], REG[b])
+                    cpu.PC = handler(cpu, a, b, next_pc)
+                except CPUFault:
+                    pack(buffer, offset, *state, FAULT, 0, 0)
+                    self.advance()
+                    raise
+                if IR in REGISTER_WRITES:
+                    change = (REGISTER, a, REG[a])
+                elif IR == PUSH or IR == CALL:
+                    change = (MEMORY, cpu.SP, RAM[cpu.SP])
+                elif IR != ST:
+                    change = (NOTHING, 0, 0)
+                pack(buffer, offset, *state, *change)
+                self.advance()
+                cycles += 1
+        finally:
+            cpu.cycles += cycles
+            cpu.output.flush()
+            if self.file is not None:
+                self.flush()
+        return RunResult(cpu.halted, cycles, cpu.PC)
+
+    def advance(self):
+        self.index += 1
+        self.count += 1
+        if self.index == self.capacity:
+            if self.file is not None:
+                self.file.write(self.buffer)
+            self.index = 0
+
+    def flush(self):
+        """Write the records not yet in the file."""
+        self.file.write(memoryview(self.buffer)[:self.index * RECORD.size])
+        self.index = 0
+        self.file.flush()
+
+    def records(self):
+        """The records still in the ring, oldest first, as bytes."""
+        size = RECORD.size
+        if self.count <= self.capacity:
+            return bytes(self.buffer[:self.index * size])
+        split = self.index * size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def save(self, path):
+        """Write the records still in the ring to a trace file."""
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            file.write(self.records())
+
+
+class Trace:
+    """Read access to a trace file or the records of a Recorder."""
+
+    def __init__(self, data):
+        if data[:len(MAGIC)] == MAGIC:
+            magic, version, size = HEADER.unpack_from(data)
+            if version != VERSION or size != RECORD.size:
+                raise ValueError("unsupported trace version")
+            data = data[HEADER.size:]
+        self.data = memoryview(data)
+        self.first = RECORD.unpack_from(data)[0] if len(data) else 0
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as file:
+            return cls(file.read())
+
+    def __len__(self):
+        return len(self.data) // RECORD.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return RECORD.unpack_from(self.data, index * RECORD.size)
+
+    def seek(self, cycle):
+        """Index of the record for cycle. Records are one per cycle, in order."""
+        index = cycle - self.first
+        if not 0 <= index < len(self):
+            raise IndexError(f"cycle {cycle} is not in the trace")
+        return index
+
+    def lines(self, start=0, count=None):
+        """TRACE text lines, as CPU.trace() prints them, from index start."""
+        stop = len(self) if count is None else min(len(self), start + count)
+        for index in range(start, stop):
+            yield render(self[index])
+
+
+def render(record):
+    """The TRACE line for a record, as CPU.trace() prints it."""
+    cycle, PC, FL, IR, a, b, SP, registers, change, where, value = record
+    return "TRACE: %02X | %02X %02X %02X %02X |" % (PC, FL, IR, a, b) + \
+        "".join(" %02X" % register for register in registers)
+
+
+def diff(first, second):
+    """
+    The first cycle at which two traces differ, or None if they are the
+    same. Both must start at the same cycle; if one stops early, they
+    differ at the first cycle only the other has.
+    """
+    size = RECORD.size
+    length = min(len(first), len(second))
+    a = first.data
+    b = second.data
+    # compare a few thousand records at a time, then find the record
+    chunk = 4096
+    for start in range(0, length, chunk):
+        stop = min(start + chunk, length)
+        if a[start * size:stop * size] != b[start * size:stop * size]:
+            for index in range(start, stop):
+                if first[index] != second[index]:
+                    return first[index][0]
+    if len(first) != len(second):
+        return first.first + length
+    return None
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__.split("Usage:")[1].rstrip(), file=sys.stderr)
+        return 1
+    command = argv[1]
+    if command == 'record':
+        program, path = argv[2], argv[3]
+        max_cycles = int(argv[4]) if len(argv) > 4 else None
+        cpu = CPU(output=NullOutput())
+        cpu.load_file(program)
+        with open(path, 'wb') as file:
+            recorder = Recorder(file=file)
+            try:
+                cpu.run(max_cycles, trace=recorder)
+            except CPUFault as fault:
+                print(fault, file=sys.stderr)
+        print(f"{recorder.count} records written to {path}", file=sys.stderr)
+    elif command == 'show':
+        trace = Trace.open(argv[2])
+        start = trace.seek(int(argv[3])) if len(argv) > 3 else 0
+        count = int(argv[4]) if len(argv) > 4 else None
+        for line in trace.lines(start, count):
+            print(line)
+    elif command == 'diff':
+        cycle = diff(Trace.open(argv[2]), Trace.open(argv[3]))
+        if cycle is None:
+            print("no difference")
+            return 0
+        print(f"first difference at cycle {cycle}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
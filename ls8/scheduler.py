@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Time-slice many CPUs in one process.
+
+Usage: scheduler.py [quantum] program.ls8...
+"""
+
+import sys
+import time
+from collections import deque
+
+from cpu import CPU, CPUFault
+
+
+class Task:
+    """One machine under the scheduler, with its budget and accounting."""
+
+    def __init__(self, cpu, name, budget=None):
+        self.cpu = cpu
+        self.name = name
+        self.budget = budget # most instructions this task may run
+        self.status = 'ready' # then 'halted', 'faulted' or 'over budget'
+        self.fault = None
+        self.cycles = 0
+        self.slices = 0
+
+
+class Scheduler:
+    """
+    Round-robin scheduler: each ready task runs for up to quantum
+    instructions, then goes to the back of the queue. Tasks leave the queue
+    when they halt, fault or use up their budget.
+    """
+
+    def __init__(self, quantum=1000):
+        self.quantum = quantum
+        self.tasks = []
+        self.ready = deque()
+
+    def add(self, cpu, name=None, budget=None):
+        task = Task(cpu, name if name is not None else len(self.tasks), budget)
+        self.tasks.append(task)
+        self.ready.append(task)
+        return task
+
+    def run(self, deadline=None):
+        """
+        Run tasks until none are ready, or until time.monotonic() passes
+        deadline. Returns the number of tasks still ready.
+        """
+        ready = self.ready
+        quantum = self.quantum
+        while ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            task = ready.popleft()
+            cycles = quantum
+            if task.budget is not None:
+                cycles = min(cycles, task.budget - task.cycles)
+            before = task.cpu.cycles
+            try:
+                result = task.cpu.run_for(cycles)
+            except CPUFault as fault:
+                task.cycles += task.cpu.cycles - before
+                task.slices += 1
+                task.status = 'faulted'
+                task.fault = fault
+                continue
+            task.cycles += result.cycles
+            task.slices += 1
+            if result.halted:
+                task.status = 'halted'
+            elif task.budget is not None and task.cycles >= task.budget:
+                task.status = 'over budget'
+            else:
+                ready.append(task)
+        return len(ready)
+
+    def report(self):
+        """One line per task: status, instructions run and time slices."""
+        lines = []
+        for task in self.tasks:
+            line = f"{task.name}: {task.status}, {task.cycles} cycles in {task.slices} slices"
+            if task.fault is not None:
+                line += f" ({task.fault})"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    quantum = int(args.pop(0)) if args and args[0].isdigit() else 1000
+    scheduler = Scheduler(quantum)
+    for program in args:
+        cpu = CPU()
+        cpu.load_file(program)
+        scheduler.add(cpu, program, budget=100000)
+    scheduler.run()
+    print(scheduler.report(), file=sys.stderr)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+Snapshots of a machine's state, for restoring and forking.
+
+    checkpoint = cpu.snapshot()
+    ...
+    cpu.restore(checkpoint) # back to the checkpoint
+    child = cpu.fork() # a new CPU carrying on from here
+
+A Snapshot holds RAM, the registers (IM and IS are R5 and R6), PC, FL, SP,
+whether the CPU has halted, its cycle count and the state of its interrupt
+controller: whether interrupts are enabled, lines waiting, undelivered
+keys and the cycle timer. Devices and output aren't part of it.
+
+RAM is kept as PAGES immutable pages of PAGE bytes. The CPU remembers the
+snapshot it last took or restored and which pages ram_write() has touched
+since, so a new snapshot copies only the dirty pages and shares the rest
+with the last one, and restoring copies only the pages that differ from
+what the CPU holds. Forks of one checkpoint therefore share every page
+none of them has written.
+
+Snapshot.to_bytes() is the serialized form; save() and load() keep it in a
+file.
+
+Usage: snapshot.py program.ls8 cycles out.snap
+
+Runs program for cycles instructions and saves a snapshot of the machine.
+"""
+
+import os
+import struct
+import sys
+import tempfile
+
+from cpu import *
+
+MAGIC = b"LS8S"
+VERSION = 1
+
+PAGE = 16 # bytes per RAM page
+PAGES = 256 // PAGE
+CLEAN = 0 # no pages dirty
+ALL_DIRTY = (1 << PAGES) - 1
+
+# magic, version, PC, FL, SP, halted, cycles, then the interrupt
+# controller: present, enabled, pending lines, timer tick and period (-1
+# for none) and the number of undelivered keys, which follow the header
+HEADER = struct.Struct("<4sBBBB?Q??Bqqh")
+
+
+class Snapshot:
+    """The state of a CPU at one instruction boundary. Immutable."""
+
+    __slots__ = ('pages', 'registers', 'PC', 'FL', 'SP', 'halted', 'cycles',
+                 'interrupts')
+
+    def __init__(self, pages, registers, PC, FL, SP, halted, cycles,
+                 interrupts=None):
+        self.pages = pages # tuple of PAGES bytes objects
+        self.registers = registers # bytes
+        self.PC = PC
+        self.FL = FL
+        self.SP = SP
+        self.halted = halted
+        self.cycles = cycles
+        # (enabled, pending, keys, tick, period) or None without a controller
+        self.interrupts = interrupts
+
+    @property
+    def RAM(self):
+        return b"".join(self.pages)
+
+    @property
+    def IM(self):
+        return self.registers[5]
+
+    @property
+    def IS(self):
+        return self.registers[6]
+
+    def __eq__(self, other):
+        if not isinstance(other, Snapshot):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def to_bytes(self):
+        """The snapshot as a self-describing blob."""
+        interrupts = self.interrupts
+        if interrupts is None:
+            enabled, pending, keys, tick, period = True, 0, b'', None, None
+        else:
+            enabled, pending, keys, tick, period = interrupts
+        header = HEADER.pack(
+            MAGIC, VERSION, self.PC, self.FL, self.SP, self.halted,
+            self.cycles, interrupts is not None, enabled, pending,
+            -1 if tick is None else tick, -1 if period is None else period,
+            len(keys))
+        return b"".join((header, keys, self.registers) + self.pages)
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, version, PC, FL, SP, halted, cycles, controller, enabled,
+         pending, tick, period, key_count) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not an LS-8 snapshot")
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version {version}")
+        offset = HEADER.size
+        keys = bytes(data[offset:offset + key_count])
+        offset += key_count
+        registers = bytes(data[offset:offset + 8])
+        offset += 8
+        if len(data) != offset + 256:
+            raise ValueError("truncated snapshot")
+        pages = tuple(bytes(data[start:start + PAGE])
+                      for start in range(offset, offset + 256, PAGE))
+        interrupts = None
+        if controller:
+            interrupts = (enabled, pending, keys,
+                          None if tick < 0 else tick,
+                          None if period < 0 else period)
+        return cls(pages, registers, PC, FL, SP, halted, cycles, interrupts)
+
+    def save(self, path):
+        """Write the snapshot to path, atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(self.to_bytes())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+def take(cpu):
+    """Called by CPU.snapshot()."""
+    base = cpu.base
+    dirty = cpu.dirty if base is not None else ALL_DIRTY
+    RAM = cpu.RAM
+    if dirty == CLEAN:
+        pages = base.pages
+    else:
+        pages = tuple(
+            bytes(RAM[start:start + PAGE]) if dirty >> page & 1
+            else base.pages[page]
+            for page, start in enumerate(range(0, 256, PAGE)))
+    interrupts = None
+    controller = cpu.interrupts
+    if controller is not None:
+        interrupts = (controller.enabled, controller.pending,
+                      bytes(controller.keys), controller.tick,
+                      controller.period)
+    snapshot = Snapshot(pages, bytes(cpu.REG), cpu.PC, cpu.FL, cpu.SP,
+                        cpu.halted, cpu.cycles, interrupts)
+    cpu.base = snapshot
+    cpu.dirty = CLEAN
+    return snapshot
+
+
+def restore(cpu, snapshot):
+    """Called by CPU.restore()."""
+    base = cpu.base
+    dirty = cpu.dirty if base is not None else ALL_DIRTY
+    RAM = cpu.RAM
+    changed = []
+    for page, start in enumerate(range(0, 256, PAGE)):
+        content = snapshot.pages[page]
+        if dirty >> page & 1 or base.pages[page] is not content:
+            if RAM[start:start + PAGE] != content:
+                RAM[start:start + PAGE] = content
+                changed.append(start)
+    if changed:
+        if cpu.jit is not None or cpu.fusion is not None \
+                or cpu.loops is not None:
+            cpu.invalidate_all()
+        elif cpu.decoded is not None:
+            decoded = cpu.decoded
+            for start in changed:
+                # and the two addresses before, whose operands may be here
+                for address in range(start - 2, start + PAGE):
+                    decoded[address] = None
+    cpu.REG[:] = snapshot.registers
+    cpu.PC = snapshot.PC
+    cpu.FL = snapshot.FL
+    cpu.SP = snapshot.SP
+    cpu.halted = snapshot.halted
+    cpu.running = False
+    cpu.cycles = snapshot.cycles
+    controller = cpu.interrupts
+    if controller is not None:
+        controller.events.clear()
+        controller.raised = False
+        controller.recheck = None
+        controller.keys.clear()
+        if snapshot.interrupts is None:
+            controller.reset()
+        else:
+            enabled, pending, keys, tick, period = snapshot.interrupts
+            controller.enabled = enabled
+            controller.pending = pending
+            controller.keys.extend(keys)
+            controller.tick = tick
+            controller.period = period
+    cpu.base = snapshot
+    cpu.dirty = CLEAN
+
+
+def fork(cpu, output=None):
+    """Called by CPU.fork()."""
+    snapshot = take(cpu)
+    child = CPU(jit=cpu.jit is not None, alu=cpu.alu_backend,
+                output=output if output is not None else cpu.output,
+                fuse=cpu.fusion is not None, fast_forward=cpu.loops is not None,
+                interrupts=cpu.interrupts is not None)
+    restore(child, snapshot)
+    if cpu.decoded is not None and cpu.jit is None and cpu.fusion is None \
+            and cpu.loops is None and cpu.breakpoints is None:
+        # the same code at the same SP decodes the same way
+        child.decoded = cpu.decoded.copy()
+    return child
+
+
+def main(argv):
+    if len(argv) != 4:
+        print("usage: snapshot.py program.ls8 cycles out.snap",
+              file=sys.stderr)
+        return 1
+    cpu = CPU()
+    cpu.load_file(argv[1])
+    try:
+        cpu.run(int(argv[2]))
+    except CPUFault as fault:
+        print(fault, file=sys.stderr)
+    cpu.snapshot().save(argv[3])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The ls8 modules import each other by plain name, as when run from ls8/
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
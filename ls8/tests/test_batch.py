@@ -0,0 +1,26 @@
+import os
+
+import batch
+
+MULT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'examples', 'mult.ls8')
+
+
+def test_bad_entries_get_error_results():
+    jobs = [
+        {'program': MULT},
+        {'program': MULT, 'registers': [0] * 9},
+        {'program': MULT, 'registers': [300]},
+        {'program': MULT, 'registers': ['x']},
+        {'program': MULT, 'memory': {'300': 1}},
+        {'program': MULT, 'memory': {'0xF0': 256}},
+        {'program': MULT, 'memory': {'zz': 1}},
+        {'registers': [1]},
+        {'program': 'no-such-file.ls8'},
+        {'program': MULT},
+    ]
+    results = list(batch.run_batch(jobs, workers=2, chunksize=4,
+                                   max_cycles=1000))
+    assert [result['halt'] for result in results] == \
+        ['HLT'] + ['error'] * 8 + ['HLT']
+    assert results[0]['output'] == results[-1]['output'] == '72\n'
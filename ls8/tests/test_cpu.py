@@ -0,0 +1,27 @@
+import pytest
+
+from cpu import CPU, HLT
+
+
+def test_load_bytes_rejects_programs_past_the_end_of_ram():
+    cpu = CPU()
+    with pytest.raises(ValueError):
+        cpu.load_bytes(bytes(257))
+    with pytest.raises(ValueError):
+        cpu.load_bytes(bytes(16), address=0xF8)
+    assert len(cpu.RAM) == 256
+
+
+def test_load_bytes_fills_ram_exactly():
+    cpu = CPU()
+    cpu.load_bytes(bytes([HLT]) * 256)
+    assert len(cpu.RAM) == 256
+    cpu.load_bytes(bytes([HLT]) * 8, address=0xF8)
+    assert len(cpu.RAM) == 256
+
+
+def test_load_file_rejects_a_text_program_too_long(tmp_path):
+    program = tmp_path / 'long.ls8'
+    program.write_text('00000001\n' * 300)
+    with pytest.raises(ValueError):
+        CPU().load_file(str(program))
@@ -0,0 +1,16 @@
+import os
+
+import fusion
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'examples')
+
+
+def test_compare_cut_off_by_the_budget():
+    # sieve runs well past 1000 instructions, and fused entries end the
+    # budget mid-way unless the last ones run plain
+    mismatched, cpu = fusion.compare(os.path.join(EXAMPLES, 'sieve.ls8'),
+                                     max_cycles=1001)
+    assert mismatched == []
+    assert cpu.cycles == 1001
+    assert cpu.fusion.executed > 0
@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from cpu import CPU
+from devices import CaptureOutput
+
+OPCODES = sorted(CPU.OPERATIONS)
+
+
+def random_program(rng):
+    """Random instructions, mostly on R0-R4, now and then past R7."""
+    program = bytearray()
+    while len(program) < 0xE0:
+        IR = rng.choice(OPCODES)
+        program.append(IR)
+        for _ in range(IR >> 6):
+            if rng.random() < 0.05:
+                program.append(rng.randrange(8, 256))
+            else:
+                program.append(rng.randrange(5))
+    return bytes(program[:0xE0])
+
+
+def outcome(program, **options):
+    cpu = CPU(output=CaptureOutput(), **options)
+    cpu.load_bytes(program)
+    try:
+        cpu.run(2000)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return (error, cpu.cycles, cpu.PC, cpu.FL, cpu.SP, bytes(cpu.REG),
+            bytes(cpu.RAM), cpu.output.getvalue(), cpu.halted)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_jit_matches_run(seed):
+    program = random_program(random.Random(seed))
+    assert outcome(program, jit=True) == outcome(program)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+"""
+Lockstep LS-8 engine that steps many machines at once with NumPy.
+
+NumPy is only needed for this module; the rest of the emulator doesn't
+import it.
+"""
+
+import sys
+
+import numpy as np
+
+from alu import TABLES, BINARY, UNARY
+from cpu import *
+from devices import CaptureOutput
+
+# Lane status codes
+RUNNING = 0
+HALTED = 1
+FAULTED = 2
+
+BRANCH_CONDITIONS = {
+    JMP: lambda FL: np.ones(FL.shape, bool),
+    JEQ: lambda FL: FL == 1,
+    JNE: lambda FL: FL != 1,
+    JGT: lambda FL: FL == 2,
+    JGE: lambda FL: (FL == 2) | (FL == 1),
+    JLT: lambda FL: FL == 4,
+    JLE: lambda FL: (FL == 4) | (FL == 1),
+}
+
+
+def table(name):
+    """An ALU table from alu.py as a NumPy array."""
+    return np.frombuffer(TABLES[name], dtype=np.uint8)
+
+
+class VectorCPU:
+    """
+    N LS-8 machines held as NumPy arrays and stepped in lockstep.
+
+    Each step fetches the instruction of every running lane, groups the lanes
+    by opcode and applies that opcode to the whole group with masked array
+    operations. Lanes that halt or fault drop out of later steps; PRN and
+    PRA output and fault messages are collected per lane, as ls8.py would
+    print them.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.RAM = np.zeros((count, 256), dtype=np.uint8)
+        self.REG = np.zeros((count, 8), dtype=np.uint8)
+        self.PC = np.zeros(count, dtype=np.uint8)
+        self.FL = np.zeros(count, dtype=np.uint8)
+        self.SP = np.full(count, 0xF4, dtype=np.uint8)
+        self.status = np.full(count, RUNNING, dtype=np.uint8)
+        self.cycles = np.zeros(count, dtype=np.int64)
+        self.output = [[] for _ in range(count)]
+
+    @classmethod
+    def from_machines(cls, machines):
+        """Build lanes from the current state of a list of CPU objects."""
+        vector = cls(len(machines))
+        for lane, cpu in enumerate(machines):
+            vector.RAM[lane] = np.frombuffer(cpu.RAM, dtype=np.uint8)
+            vector.REG[lane] = np.frombuffer(cpu.REG, dtype=np.uint8)
+            vector.PC[lane] = cpu.PC
+            vector.FL[lane] = cpu.FL
+            vector.SP[lane] = cpu.SP
+        return vector
+
+    def load(self, program):
+        """Load the same program file into every lane."""
+        cpu = CPU()
+        cpu.load_file(program)
+        self.RAM[:] = np.frombuffer(cpu.RAM, dtype=np.uint8)
+        self.PC[:] = cpu.PC
+
+    def fault(self, lanes, messages):
+        """Stop lanes with the message of the CPUFault CPU.run() would raise."""
+        for lane, message in zip(lanes, messages):
+            self.output[lane].append(message)
+        self.status[lanes] = FAULTED
+
+    def step(self):
+        """Run one instruction on every running lane."""
+        lanes = np.flatnonzero(self.status == RUNNING)
+        if len(lanes) == 0:
+            return 0
+        pc = self.PC[lanes]
+        # same check as CPU.decode()
+        overflow = self.SP[lanes].astype(np.int16) <= pc.astype(np.int16) + 1
+        if overflow.any():
+            self.fault(lanes[overflow], ['Stack overflow!'] * overflow.sum())
+            lanes = lanes[~overflow]
+            pc = pc[~overflow]
+        IR = self.RAM[lanes, pc]
+        a = self.RAM[lanes, pc + np.uint8(1)]
+        b = self.RAM[lanes, pc + np.uint8(2)]
+        next_pc = pc + ((IR >> 6) + 1).astype(np.uint8)
+        for opcode in np.unique(IR):
+            group = IR == opcode
+            self.execute(int(opcode), lanes[group], a[group], b[group],
+                         pc[group], next_pc[group])
+        # like CPU.run(), an instruction that faults isn't counted
+        self.cycles[lanes[self.status[lanes] != FAULTED]] += 1
+        return len(lanes)
+
+    def execute(self, opcode, lanes, a, b, pc, next_pc):
+        """Apply one opcode to a group of lanes."""
+        REG = self.REG
+        RAM = self.RAM
+        name = ALU_NAMES.get(opcode)
+
+        if opcode == LDI:
+            REG[lanes, a] = b
+        elif opcode == LD:
+            REG[lanes, a] = RAM[lanes, REG[lanes, b]]
+        elif opcode == ST:
+            RAM[lanes, REG[lanes, a]] = REG[lanes, b]
+        elif opcode == PRN:
+            for lane, value in zip(lanes, REG[lanes, a]):
+                self.output[lane].append(str(value))
+        elif opcode == PRA:
+            for lane, value in zip(lanes, REG[lanes, a]):
+                self.output[lane].append(chr(value))
+        elif opcode == ADDI:
+            index = REG[lanes, a].astype(np.intp) << 8 | b
+            REG[lanes, a] = table('ADD')[index]
+        elif name in UNARY:
+            REG[lanes, a] = table(name)[REG[lanes, a]]
+        elif name in BINARY:
+            x = REG[lanes, a].astype(np.intp)
+            y = REG[lanes, b]
+            if name in ('DIV', 'MOD'):
+                zero = y == 0
+                if zero.any():
+                    message = ('Cannot divide by 0.' if name == 'DIV'
+                               else 'Cannot MOD by 0.')
+                    self.fault(lanes[zero], [message] * zero.sum())
+                    lanes, a, x, y, next_pc = (lanes[~zero], a[~zero],
+                                               x[~zero], y[~zero],
+                                               next_pc[~zero])
+            result = table(name)[x << 8 | y]
+            if name == 'CMP':
+                self.FL[lanes] = result
+            else:
+                REG[lanes, a] = result
+        elif opcode in BRANCH_CONDITIONS:
+            taken = BRANCH_CONDITIONS[opcode](self.FL[lanes])
+            next_pc = np.where(taken, REG[lanes, a], next_pc)
+        elif opcode == CALL:
+            self.SP[lanes] -= 1
+            overflow = self.SP[lanes] == pc
+            if overflow.any():
+                self.fault(lanes[overflow], ['Stack overflow!'] * overflow.sum())
+                lanes, a, next_pc = lanes[~overflow], a[~overflow], next_pc[~overflow]
+            RAM[lanes, self.SP[lanes]] = next_pc
+            next_pc = REG[lanes, a]
+        elif opcode == RET or opcode == POP:
+            empty = self.SP[lanes] == 0xF4
+            if empty.any():
+                self.fault(lanes[empty], ['Stack is empty!'] * empty.sum())
+                lanes, a, next_pc = lanes[~empty], a[~empty], next_pc[~empty]
+            top = RAM[lanes, self.SP[lanes]]
+            if opcode == RET:
+                next_pc = top
+            else:
+                REG[lanes, a] = top
+            self.SP[lanes] += 1
+        elif opcode == IRET:
+            empty = self.SP[lanes] > 0xF4 - 9
+            if empty.any():
+                self.fault(lanes[empty], ['Stack is empty!'] * empty.sum())
+                lanes, next_pc = lanes[~empty], next_pc[~empty]
+            sp = self.SP[lanes].astype(np.intp)
+            for register in range(7):
+                REG[lanes, register] = RAM[lanes, sp + 6 - register]
+            self.FL[lanes] = RAM[lanes, sp + 7]
+            next_pc = RAM[lanes, sp + 8]
+            self.SP[lanes] += 9
+        elif opcode == PUSH:
+            self.SP[lanes] -= 1
+            sp = self.SP[lanes]
+            overflow = sp.astype(np.int16) <= pc.astype(np.int16) + 1
+            if overflow.any():
+                self.fault(lanes[overflow], ['Stack overflow!'] * overflow.sum())
+                lanes, a, sp, next_pc = (lanes[~overflow], a[~overflow],
+                                         sp[~overflow], next_pc[~overflow])
+            RAM[lanes, sp] = REG[lanes, a]
+        elif opcode == INT:
+            # IS is R6; lanes don't take interrupts, as on a CPU without
+            # a controller
+            REG[lanes, 6] |= np.left_shift(1, REG[lanes, a] & 7).astype(np.uint8)
+        elif opcode == HLT:
+            self.status[lanes] = HALTED
+        elif opcode != NOP:
+            self.fault(lanes, [f'Unknown instruction {opcode} at address {p}'
+                               for p in pc])
+            return
+        self.PC[lanes] = next_pc
+
+    def run(self, max_steps=None):
+        """Step until every lane has halted or faulted, or max_steps."""
+        steps = 0
+        while (self.status == RUNNING).any():
+            if max_steps is not None and steps >= max_steps:
+                break
+            self.step()
+            steps += 1
+        return steps
+
+    def text(self, lane):
+        """A lane's output, as CPU.run() would have printed it."""
+        return "".join(line + "\n" for line in self.output[lane])
+
+
+def conformance(program, count, seed=0, max_steps=10000):
+    """
+    Run program in count lanes with random starting registers and random
+    bytes in the RAM after the program, and the same starting states one
+    at a time on CPU.run(). Both stop after max_steps instructions.
+    Returns the lanes whose output, final state or cycle count differ.
+    """
+    rng = np.random.default_rng(seed)
+    machines = []
+    for _ in range(count):
+        cpu = CPU(output=CaptureOutput())
+        cpu.load_file(program)
+        cpu.REG[:] = rng.integers(0, 256, 8, dtype=np.uint8).tobytes()
+        # the program ends at its last non-zero byte
+        end = len(cpu.RAM.rstrip(b"\x00"))
+        cpu.RAM[end:] = rng.integers(0, 256, 256 - end, dtype=np.uint8).tobytes()
+        machines.append(cpu)
+    vector = VectorCPU.from_machines(machines)
+    vector.run(max_steps)
+    mismatched = []
+    for lane, cpu in enumerate(machines):
+        text = ''
+        try:
+            cpu.run(max_steps)
+        except CPUFault as fault:
+            text = f"{fault}\n"
+        same = (
+            cpu.output.getvalue() + text == vector.text(lane)
+            and bytes(cpu.RAM) == vector.RAM[lane].tobytes()
+            and bytes(cpu.REG) == vector.REG[lane].tobytes()
+            and cpu.PC == vector.PC[lane]
+            and cpu.FL == vector.FL[lane]
+            and cpu.SP == vector.SP[lane]
+            and cpu.cycles == vector.cycles[lane]
+        )
+        if not same:
+            mismatched.append(lane)
+    return mismatched
+
+
+if __name__ == "__main__":
+    # usage: vector.py count program.ls8...
+    count = int(sys.argv[1])
+    for program in sys.argv[2:]:
+        mismatched = conformance(program, count)
+        print(f"{program}: {count - len(mismatched)}/{count} lanes match")